@@ -1,19 +1,44 @@
-from flask import Flask, render_template, request, jsonify, send_file, redirect, session, after_this_request
+from flask import Flask, render_template, request, jsonify, send_file, redirect, session, after_this_request, stream_with_context
 import pandas as pd
 import os
 from datetime import datetime, timedelta
-from filelock import FileLock
-from openpyxl import Workbook, load_workbook
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Boolean, Text, UniqueConstraint, Index, func, or_
+from openpyxl import Workbook
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Boolean, Text, UniqueConstraint, Index, func, or_, text, bindparam, literal, select, delete, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, joinedload
 from werkzeug.security import generate_password_hash, check_password_hash
 import json
+import csv
+import functools
+import gzip
 import hashlib
+import io
 import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import pytz
+from normalize import norm_sku, norm_code
+from gs1 import parse_barcode
+from audit import AuditBuffer
+from coalesce import SingleFlight
+from json_provider import FastJSONProvider, dumps_ordered
+from group_commit import GroupCommitWriter
+from mdf_store import MDFStore
+from export_cache import ExportCache
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.secret_key = os.environ.get("APP_SECRET", "dsv-stock-count-secret-key-2025")
 
 # --- Timezone Configuration ---
@@ -23,6 +48,10 @@ def abu_dhabi_now():
     """Returns the current time in Abu Dhabi timezone."""
     return datetime.now(ABU_DHABI_TZ)
 
+def to_local_naive(dt):
+    """Naive Abu Dhabi time, as timestamps are stored, for a parsed datetime (offsets converted)"""
+    return dt.astimezone(ABU_DHABI_TZ).replace(tzinfo=None) if dt.tzinfo else dt
+
 def _no_cache(resp):
     resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
     resp.headers["Pragma"] = "no-cache"
@@ -48,18 +77,63 @@ engine = create_engine('sqlite:///line_count.db', echo=False)
 Base = declarative_base()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# Constants
-LOCATIONS = ["KIZAD", "JEBEL_ALI"]
-WAREHOUSES = {
+# Seed reference data (copied into the locations/warehouses tables on first boot)
+DEFAULT_LOCATIONS = ["KIZAD", "JEBEL_ALI"]
+DEFAULT_WAREHOUSES = {
     "KIZAD": ["KIZAD-W1"],
     "JEBEL_ALI": ["JA-W1", "JA-W2", "JA-W3"]
 }
 
+# Reference data / line metadata cache lifetime. Mutations invalidate the local
+# worker immediately; the TTL bounds staleness in other gunicorn workers.
+REFERENCE_CACHE_TTL = float(os.environ.get("REFERENCE_CACHE_TTL", "5"))
+
+# Identical concurrent polling reads share one computation; finished answers are
+# reused for COALESCE_TTL seconds (0 disables the LRU, keeping only single-flight)
+COALESCE_TTL = float(os.environ.get("COALESCE_TTL", "1.0"))
+COALESCE_MAX_ENTRIES = int(os.environ.get("COALESCE_MAX_ENTRIES", "256"))
+
+# Group commit for /api/scan/add: a per-process writer thread collects scans for up to
+# this many milliseconds and commits them in one transaction (0 = commit per request)
+SCAN_GROUP_COMMIT_MS = float(os.environ.get("SCAN_GROUP_COMMIT_MS", "2"))
+SCAN_GROUP_COMMIT_MAX = int(os.environ.get("SCAN_GROUP_COMMIT_MAX", "100"))
+SCAN_WRITE_TIMEOUT = 10
+
+# Response compression for text payloads at or above this size (0 disables)
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", "6"))
+COMPRESS_MIMETYPES = {"application/json", "text/html", "text/css", "application/javascript", "text/javascript", "text/plain"}
+
 EXPORTS_DIR = os.path.join(os.getcwd(), "exports")
-MDF_PATH = os.path.join(EXPORTS_DIR, "MDF.xlsx")
+MDF_PATH = os.path.join(EXPORTS_DIR, "MDF.xlsx")  # pre-partitioning single file, split on boot
 LOCK_PATH = os.path.join(EXPORTS_DIR, "MDF.lock")
+MDF_DIR = os.path.join(EXPORTS_DIR, "mdf")
 COLUMNS = ["Date","Time","Location","Warehouse","CounterName","SKU","SerialOrCode","QTY","Source"]
 
+# One workbook + lock per location/warehouse; the combined MDF is a streaming merge
+mdf_store = MDFStore(MDF_DIR, COLUMNS, LOCK_PATH)
+
+# Generated downloads are kept on disk, keyed by the export's data version
+EXPORT_CACHE_DIR = os.path.join(EXPORTS_DIR, "cache")
+EXPORT_CACHE_KEEP = int(os.environ.get("EXPORT_CACHE_KEEP", "4"))  # files kept per export
+export_cache = ExportCache(EXPORT_CACHE_DIR, keep=EXPORT_CACHE_KEEP)
+
+# /api/export reads scans this many jobs at a time; only one chunk is ever held in memory
+EXPORT_CHUNK_JOBS = int(os.environ.get("EXPORT_CHUNK_JOBS", "50"))
+EXPORT_COLUMNS = COLUMNS + ["LineCode", "JobId", "JobStatus"]
+
+# Cross-line duplicate serial policy: warn (accept + flag), block (reject with 409), allow (no check)
+SERIAL_DUP_POLICIES = ("warn", "block", "allow")
+SERIAL_DUP_POLICY = os.environ.get("SERIAL_DUP_POLICY", "warn").strip().lower()
+if SERIAL_DUP_POLICY not in SERIAL_DUP_POLICIES:
+    SERIAL_DUP_POLICY = "warn"
+
+# Line/log removal: "delete" destroys rows, "archive" moves them to ARCHIVE_DB_PATH first
+DELETE_MODE = os.environ.get("DELETE_MODE", "delete").strip().lower()
+DELETE_CHUNK_SIZE = int(os.environ.get("DELETE_CHUNK_SIZE", "200"))  # jobs per transaction
+ARCHIVE_DIR = os.path.join(os.getcwd(), "archive")
+ARCHIVE_DB_PATH = os.path.join(ARCHIVE_DIR, "deleted.db")
+
 # Models
 class Line(Base):
     __tablename__ = 'lines'
@@ -76,7 +150,29 @@ class Line(Base):
     assignments = relationship("Assignment", back_populates="line")
     scan_jobs = relationship("ScanJob", back_populates="line")
 
-    __table_args__ = (Index('idx_line_warehouse', 'line_code', 'warehouse'),)
+    __table_args__ = (
+        Index('idx_line_warehouse', 'line_code', 'warehouse'),
+        Index('idx_line_location_wh_code', 'location', 'warehouse', 'line_code'),
+    )
+
+class Location(Base):
+    __tablename__ = 'locations'
+
+    id = Column(Integer, primary_key=True)
+    code = Column(String(50), nullable=False, unique=True)
+    sort_order = Column(Integer, default=0)
+    active = Column(Boolean, default=True)
+
+class Warehouse(Base):
+    __tablename__ = 'warehouses'
+
+    id = Column(Integer, primary_key=True)
+    location_code = Column(String(50), ForeignKey('locations.code'), nullable=False)
+    code = Column(String(50), nullable=False)
+    sort_order = Column(Integer, default=0)
+    active = Column(Boolean, default=True)
+
+    __table_args__ = (UniqueConstraint('location_code', 'code', name='uq_warehouse_location_code'),)
 
 class Assignment(Base):
     __tablename__ = 'assignments'
@@ -92,20 +188,35 @@ class Assignment(Base):
 
     line = relationship("Line", back_populates="assignments")
 
+    __table_args__ = (Index('idx_assignment_line_active', 'line_id', 'active'),)
+
 class ScanJob(Base):
     __tablename__ = 'scan_jobs'
 
     id = Column(Integer, primary_key=True)
     line_id = Column(Integer, ForeignKey('lines.id'), nullable=False)
-    status = Column(String(20), default='open')  # open, submitted, variance_approved
+    status = Column(String(20), default='open')  # open, locked_recon, variance_approved, submitted
     opened_at = Column(DateTime, default=abu_dhabi_now)
     closed_at = Column(DateTime)
     opened_by = Column(String(100))
+    version = Column(Integer, nullable=False, default=0)  # bumped by every status transition
+    submit_token = Column(String(32))  # names the submit's MDF export; kept when a stale claim is taken over
+    submit_from = Column(String(20))  # status the submit was claimed from
 
     line = relationship("Line", back_populates="scan_jobs")
     scans = relationship("Scan", back_populates="job")
     reconciliations = relationship("Reconciliation", back_populates="job")
 
+    __table_args__ = (
+        Index('idx_job_line_status', 'line_id', 'status'),
+        Index('idx_job_status_closed', 'status', 'closed_at'),
+        # At most one unfinished job per line
+        Index('uq_job_line_unfinished', 'line_id', unique=True,
+              sqlite_where=text("status IN ('open', 'locked_recon', 'variance_approved')")),
+        # Ids of deleted jobs are never handed out again (new databases; older ones can reuse them)
+        {'sqlite_autoincrement': True},
+    )
+
 class Scan(Base):
     __tablename__ = 'scans'
 
@@ -122,9 +233,22 @@ class Scan(Base):
     job = relationship("ScanJob", back_populates="scans")
 
     __table_args__ = (
-        Index('idx_job_serial', 'job_id', 'serial_code'),
+        Index('idx_scan_serial_line', 'serial_code', 'line_id'),
+        # Newest-first scans of a job; qty makes per-job totals index-only
+        Index('idx_scan_job_recent', 'job_id', text('created_at DESC'), 'qty'),
     )
 
+class SerialIndex(Base):
+    """First sighting of every serial across all jobs, used for cross-line duplicate checks"""
+    __tablename__ = 'serial_index'
+
+    serial_code = Column(String(200), primary_key=True)
+    sku = Column(String(100))
+    job_id = Column(Integer, ForeignKey('scan_jobs.id'), nullable=False)
+    line_id = Column(Integer, ForeignKey('lines.id'), nullable=False)
+    counter_name = Column(String(100))
+    first_seen_at = Column(DateTime, default=abu_dhabi_now)
+
 class Reconciliation(Base):
     __tablename__ = 'reconciliations'
 
@@ -153,35 +277,21 @@ class TLUser(Base):
 
     __table_args__ = (UniqueConstraint('name_norm', name='uq_tl_users_name_norm'),)
 
-class ReconciliationQueue(Base):
-    __tablename__ = 'reconciliation_queue'
-
-    id = Column(Integer, primary_key=True)
-    job_id = Column(Integer, ForeignKey('scan_jobs.id'), nullable=False)
-    line_id = Column(Integer, ForeignKey('lines.id'), nullable=False)
-    requested_by = Column(String(100), nullable=False)
-    reason = Column(Text)
-    scanned_total = Column(Integer, nullable=False)
-    target_qty = Column(Integer, nullable=False)
-    status = Column(String(20), default='pending')  # pending, approved, rejected
-    tl_response = Column(Text)
-    acknowledged = Column(Boolean, default=False)  # Track if counter acknowledged
-    created_at = Column(DateTime, default=abu_dhabi_now)
-    resolved_at = Column(DateTime)
-
-    job = relationship("ScanJob")
-    line = relationship("Line")
-
 class ReconciliationRequest(Base):
+    """A counter's reconciliation request; the one queue behind every TL and counter view"""
     __tablename__ = 'reconciliation_requests'
 
     id = Column(Integer, primary_key=True)
     line_id = Column(Integer, ForeignKey('lines.id'), nullable=False)
     job_id = Column(Integer, ForeignKey('scan_jobs.id'), nullable=False)
-    tl_name_norm = Column(String(120), nullable=False)
+    tl_name_norm = Column(String(120), nullable=False)  # TL whose inbox it lands in
     requested_by = Column(String(100), nullable=False)
-    requested_qty = Column(Integer, nullable=True)
-    status = Column(String(20), default='pending')
+    requested_qty = Column(Integer, nullable=True)  # scanned total when requested
+    target_qty = Column(Integer)  # line target when requested
+    reason = Column(Text)
+    status = Column(String(20), default='pending')  # pending, approved, rejected
+    tl_response = Column(Text)
+    acknowledged = Column(Boolean, default=False)  # counter has seen the TL's response
     resolved_by = Column(String(100))
     resolved_at = Column(DateTime)
     created_at = Column(DateTime, default=abu_dhabi_now)
@@ -189,6 +299,13 @@ class ReconciliationRequest(Base):
     line = relationship("Line")
     job = relationship("ScanJob")
 
+    __table_args__ = (
+        Index('idx_recon_req_tl_status_created', 'tl_name_norm', 'status', 'created_at'),
+        Index('idx_recon_req_job_status', 'job_id', 'status'),
+        Index('idx_recon_req_line_status', 'line_id', 'status'),
+        Index('idx_recon_req_status_created', 'status', 'created_at'),
+    )
+
 class AuditLog(Base):
     __tablename__ = 'audit_log'
 
@@ -200,23 +317,370 @@ class AuditLog(Base):
     payload_json = Column(Text)
     created_at = Column(DateTime, default=abu_dhabi_now)
 
+    __table_args__ = (
+        Index('idx_audit_entity', 'entity', 'entity_id', 'created_at'),
+        Index('idx_audit_actor', 'actor', 'created_at'),
+        Index('idx_audit_created', 'created_at'),
+    )
+
+class CountPeriod(Base):
+    """A closed count campaign whose submitted jobs live in their own archive file"""
+    __tablename__ = 'count_periods'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(120), nullable=False)
+    started_at = Column(DateTime)
+    closed_at = Column(DateTime, default=abu_dhabi_now)
+    closed_by = Column(String(100))
+    archive_path = Column(String(500), nullable=False)
+    job_count = Column(Integer, default=0)
+    scan_count = Column(Integer, default=0)
+
+class ExportVersion(Base):
+    """Change counter of an export's source data, bumped by EXPORT_VERSION_TRIGGERS"""
+    __tablename__ = 'export_versions'
+
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+# Audit entries are buffered and written in batches outside request transactions
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", "0.5"))
+audit_buffer = AuditBuffer(engine, AuditLog.__table__, abu_dhabi_now, flush_interval=AUDIT_FLUSH_INTERVAL)
+
+def record_audit(actor, action, entity, entity_id=None, payload=None):
+    """Queue an audit entry (call after the mutation has committed)"""
+    audit_buffer.record(actor, action, entity, entity_id=entity_id, payload=payload)
+
+# Tables keyed by job_id that go away (or to the archive) with their job
+JOB_CHILD_TABLES = (Scan, Reconciliation, ReconciliationRequest)
+
+# Job state machine: event -> (statuses it may start from, status it ends in)
+JOB_TRANSITIONS = {
+    "request_reconcile": (("open", "variance_approved"), "locked_recon"),
+    "approve_variance": (("open", "locked_recon", "variance_approved"), "variance_approved"),
+    # Submit claims the job ("submitting") before the MDF export and finishes after it; reset
+    # can't start from "submitting", so a job can't be reopened with its rows half exported.
+    # A claim older than SUBMIT_CLAIM_TIMEOUT was left by a worker that died mid-export and
+    # may be taken over; the MDF skips an export whose submit_token it already holds.
+    "submit": (("open", "locked_recon", "variance_approved", "submitting"), "submitting"),
+    "submit_done": (("submitting",), "submitted"),
+    "reset": (("open", "locked_recon", "variance_approved", "submitted"), "open"),
+}
+SUBMIT_CLAIM_TIMEOUT = timedelta(minutes=2)
+
+def _transition_job(db, job, event, **values):
+    """Move a job along one edge with UPDATE ... WHERE status=? AND version=?.
+
+    Returns None on success, "invalid_transition" if the edge doesn't start at the job's
+    status, or "conflict" if someone else moved the job since it was read.
+    """
+    sources, target = JOB_TRANSITIONS[event]
+    if job.status not in sources:
+        return "invalid_transition"
+    result = db.execute(
+        update(ScanJob)
+        .where(ScanJob.id == job.id, ScanJob.status == job.status, ScanJob.version == job.version)
+        .values(status=target, version=ScanJob.version + 1, **values)
+    )
+    return None if result.rowcount == 1 else "conflict"
+
+def _start_job(db, line_id, opened_by=None):
+    """Return (job, created): the line's unfinished job, inserting an open one if it has none.
+
+    Idempotent under concurrency: uq_job_line_unfinished lets exactly one INSERT win and
+    the others fall back to reading the winner. The INSERT only happens while the line
+    still exists (a cached line may have been deleted by another worker); (None, False)
+    means it is gone. The caller commits.
+    """
+    new_job = select(
+        literal(line_id), literal('open'), literal(opened_by, String), literal(abu_dhabi_now(), DateTime), literal(0)
+    ).where(select(Line.id).where(Line.id == line_id).exists())
+    job_id = db.execute(
+        sqlite_insert(ScanJob)
+        .from_select(['line_id', 'status', 'opened_by', 'opened_at', 'version'], new_job)
+        .on_conflict_do_nothing()
+        .returning(ScanJob.id)
+    ).scalar()
+    if job_id is not None:
+        return db.get(ScanJob, job_id), True
+    job = db.query(ScanJob).filter(
+        ScanJob.line_id == line_id,
+        ScanJob.status.in_(['open', 'locked_recon', 'variance_approved'])
+    ).first()
+    return job, False
+
+def _job_conflict(reason, job):
+    return jsonify({"ok": False, "reason": reason, "status": job.status}), 409
+
+LineInfo = namedtuple("LineInfo", "id location warehouse line_code target_qty created_by_tl_norm")
+
+class LineCache:
+    """Read-through cache of line metadata, keyed by id and by (location, warehouse, line_code)"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._by_id = {}
+        self._key_to_id = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _snapshot(line):
+        return LineInfo(line.id, line.location, line.warehouse, line.line_code,
+                        int(line.target_qty or 0), line.created_by_tl_norm)
+
+    def _put(self, line):
+        info = self._snapshot(line)
+        with self._lock:
+            self._by_id[info.id] = (info, time.monotonic() + self.ttl)
+            self._key_to_id[(info.location, info.warehouse, info.line_code)] = info.id
+        return info
+
+    def _fresh(self, line_id):
+        hit = self._by_id.get(line_id)
+        if hit and hit[1] > time.monotonic():
+            return hit[0]
+        return None
+
+    def get(self, db, line_id):
+        info = self._fresh(line_id)
+        if info:
+            return info
+        line = db.get(Line, line_id)
+        return self._put(line) if line else None
+
+    def get_by_key(self, db, location, warehouse, line_code):
+        line_id = self._key_to_id.get((location, warehouse, line_code))
+        info = self._fresh(line_id) if line_id else None
+        if info:
+            return info
+        line = db.query(Line).filter(
+            Line.location == location,
+            Line.warehouse == warehouse,
+            Line.line_code == line_code
+        ).first()
+        return self._put(line) if line else None
+
+    def invalidate(self, line_id=None):
+        """Drop one line (or everything when line_id is None)"""
+        with self._lock:
+            if line_id is None:
+                self._by_id.clear()
+                self._key_to_id.clear()
+                return
+            hit = self._by_id.pop(line_id, None)
+            if hit:
+                info = hit[0]
+                self._key_to_id.pop((info.location, info.warehouse, info.line_code), None)
+
+line_cache = LineCache(REFERENCE_CACHE_TTL)
+
+_reference_cache = {"expires": 0.0, "data": None}
+
+def get_reference_data():
+    """(locations, {location: [warehouses]}) from the reference tables, cached"""
+    cached = _reference_cache["data"]
+    if cached and _reference_cache["expires"] > time.monotonic():
+        return cached
+    db = SessionLocal()
+    try:
+        locations = [code for (code,) in db.query(Location.code).filter(Location.active == True)
+                     .order_by(Location.sort_order, Location.code).all()]
+        warehouses = {code: [] for code in locations}
+        rows = db.query(Warehouse.location_code, Warehouse.code).filter(Warehouse.active == True) \
+            .order_by(Warehouse.sort_order, Warehouse.code).all()
+        for location_code, code in rows:
+            if location_code in warehouses:
+                warehouses[location_code].append(code)
+    finally:
+        db.close()
+    data = (locations, warehouses)
+    _reference_cache["data"] = data
+    _reference_cache["expires"] = time.monotonic() + REFERENCE_CACHE_TTL
+    return data
+
+def invalidate_reference_data():
+    _reference_cache["data"] = None
+
+read_flight = SingleFlight(COALESCE_MAX_ENTRIES, COALESCE_TTL)
+
+# Bumped after every mutating request in this worker; part of every coalescing key,
+# so a local write is visible to the very next read
+_data_version = [0]
+
+@app.after_request
+def _bump_data_version(resp):
+    if request.method not in ("GET", "HEAD", "OPTIONS"):
+        _data_version[0] += 1
+    return resp
+
+def coalesced(key_fn):
+    """Share one computation between identical concurrent requests to a read endpoint.
+
+    key_fn returns the normalized arguments that fully determine the response.
+    Only 2xx responses are cached and shared; errors go to their own caller.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = (view.__name__, key_fn(), request.args.get('format'), _data_version[0])
+
+            def compute():
+                resp = app.make_response(view(*args, **kwargs))
+                return resp.status_code, resp.get_data(), resp.mimetype
+
+            status, body, mimetype = read_flight.do(key, compute, lambda r: 200 <= r[0] < 300)
+            return _no_cache(app.response_class(body, status=status, mimetype=mimetype))
+        return wrapper
+    return decorator
+
+def _rows(rows):
+    """List payload as dicts, or column-oriented ({columns, rows}) when the client sent ?format=columns"""
+    if request.args.get('format') != 'columns':
+        return rows
+    columns = list(rows[0].keys()) if rows else []
+    return {"columns": columns, "rows": [[row.get(c) for c in columns] for row in rows]}
+
+def _accepted_encoding():
+    # Parsed Accept-Encoding: quality 0 for codings that are absent or refused with q=0
+    accept = request.accept_encodings
+    if brotli is not None and accept["br"] > 0:
+        return "br"
+    if accept["gzip"] > 0:
+        return "gzip"
+    return None
+
+@app.after_request
+def _compress(resp):
+    """gzip/brotli text responses above COMPRESS_MIN_BYTES when the client accepts it"""
+    if (not COMPRESS_MIN_BYTES or resp.direct_passthrough or resp.is_streamed
+            or resp.status_code < 200 or resp.status_code in (204, 304)
+            or "Content-Encoding" in resp.headers or resp.mimetype not in COMPRESS_MIMETYPES):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    encoding = _accepted_encoding()
+    if encoding is None:
+        return resp
+    body = resp.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return resp
+    if encoding == "br":
+        body = brotli.compress(body, quality=min(COMPRESS_LEVEL, 11))
+    else:
+        body = gzip.compress(body, compresslevel=COMPRESS_LEVEL, mtime=0)
+    resp.set_data(body)
+    resp.headers["Content-Encoding"] = encoding
+    return resp
+
+def _viewer_key():
+    """Who is asking, as far as TL-filtered responses are concerned"""
+    if session.get('is_manager'):
+        return "manager"
+    tl_session = session.get(SESSION_TL_KEY)
+    return ("tl", (tl_session.get("display_name") or "").lower()) if tl_session else None
+
+# Index plan matched to the hot filters. Applied on every boot with IF NOT EXISTS so
+# databases created before an index was declared on the model pick it up too.
+INDEX_MIGRATIONS = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_scans_job_sku_serial ON scans (job_id, sku, serial_code)",
+    "CREATE INDEX IF NOT EXISTS idx_scan_serial_line ON scans (serial_code, line_id)",
+    "DROP INDEX IF EXISTS idx_scan_job_created",
+    "DROP INDEX IF EXISTS idx_scan_recent_cover",
+    "DROP INDEX IF EXISTS idx_job_serial",  # led by job_id like ux_scans_job_sku_serial
+    "CREATE INDEX IF NOT EXISTS idx_scan_job_recent ON scans (job_id, created_at DESC, qty)",
+    "CREATE INDEX IF NOT EXISTS idx_line_location_wh_code ON lines (location, warehouse, line_code)",
+    "CREATE INDEX IF NOT EXISTS idx_assignment_line_active ON assignments (line_id, active)",
+    "CREATE INDEX IF NOT EXISTS idx_assignment_tl_lower ON assignments (lower(tl_name), active)",
+    "CREATE INDEX IF NOT EXISTS idx_job_line_status ON scan_jobs (line_id, status)",
+    "CREATE INDEX IF NOT EXISTS idx_job_status_closed ON scan_jobs (status, closed_at)",
+    "DROP INDEX IF EXISTS idx_recon_req_tl_status",
+    "CREATE INDEX IF NOT EXISTS idx_recon_req_tl_status_created "
+    "ON reconciliation_requests (tl_name_norm, status, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_recon_req_job_status ON reconciliation_requests (job_id, status)",
+    "CREATE INDEX IF NOT EXISTS idx_recon_req_line_status ON reconciliation_requests (line_id, status)",
+    "CREATE INDEX IF NOT EXISTS idx_recon_req_status_created ON reconciliation_requests (status, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_audit_entity ON audit_log (entity, entity_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_audit_actor ON audit_log (actor, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_audit_created ON audit_log (created_at)",
+]
+
+# Anything that changes what GET /exports/MDF.xlsx returns (scans of submitted jobs and
+# their line) bumps the 'mdf' export version in the same transaction, whichever route or
+# worker made the change.
+_BUMP_MDF = "UPDATE export_versions SET version = version + 1 WHERE name = 'mdf'"
+_SUBMITTED_JOB = "EXISTS (SELECT 1 FROM scan_jobs WHERE id = {}.job_id AND status = 'submitted')"
+EXPORT_VERSION_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS trg_mdf_job_insert AFTER INSERT ON scan_jobs "
+    f"WHEN NEW.status = 'submitted' BEGIN {_BUMP_MDF}; END",
+    "CREATE TRIGGER IF NOT EXISTS trg_mdf_job_status AFTER UPDATE OF status ON scan_jobs "
+    f"WHEN OLD.status = 'submitted' OR NEW.status = 'submitted' BEGIN {_BUMP_MDF}; END",
+    "CREATE TRIGGER IF NOT EXISTS trg_mdf_job_delete AFTER DELETE ON scan_jobs "
+    f"WHEN OLD.status = 'submitted' BEGIN {_BUMP_MDF}; END",
+    "CREATE TRIGGER IF NOT EXISTS trg_mdf_scan_insert AFTER INSERT ON scans "
+    f"WHEN {_SUBMITTED_JOB.format('NEW')} BEGIN {_BUMP_MDF}; END",
+    "CREATE TRIGGER IF NOT EXISTS trg_mdf_scan_update AFTER UPDATE ON scans "
+    f"WHEN {_SUBMITTED_JOB.format('OLD')} OR {_SUBMITTED_JOB.format('NEW')} BEGIN {_BUMP_MDF}; END",
+    "CREATE TRIGGER IF NOT EXISTS trg_mdf_scan_delete AFTER DELETE ON scans "
+    f"WHEN {_SUBMITTED_JOB.format('OLD')} BEGIN {_BUMP_MDF}; END",
+    "CREATE TRIGGER IF NOT EXISTS trg_mdf_line_update AFTER UPDATE OF location, warehouse ON lines "
+    f"BEGIN {_BUMP_MDF}; END",
+]
+
+def seed_reference_data():
+    """Copy the default locations/warehouses into their tables on first boot"""
+    db = SessionLocal()
+    try:
+        if db.query(Location.id).first():
+            return
+        for i, code in enumerate(DEFAULT_LOCATIONS):
+            db.add(Location(code=code, sort_order=i))
+            for j, wh in enumerate(DEFAULT_WAREHOUSES.get(code, [])):
+                db.add(Warehouse(location_code=code, code=wh, sort_order=j))
+        db.commit()
+        invalidate_reference_data()
+    finally:
+        db.close()
+
 def init_db():
     """Initialize database and create tables"""
     Base.metadata.create_all(bind=engine)
+    seed_reference_data()
 
     # Handle database migration for missing columns and indexes
     try:
         from sqlalchemy import text
         with engine.connect() as conn:
-            # Check if acknowledged column exists
-            result = conn.execute(text("PRAGMA table_info(reconciliation_queue)"))
+            # reconciliation_requests took over the queue's columns
+            result = conn.execute(text("PRAGMA table_info(reconciliation_requests)"))
             columns = [row[1] for row in result.fetchall()]
 
-            if 'acknowledged' not in columns:
-                print("Adding missing 'acknowledged' column to reconciliation_queue table...")
-                conn.execute(text("ALTER TABLE reconciliation_queue ADD COLUMN acknowledged BOOLEAN DEFAULT 0"))
-                conn.commit()
-                print("Database migration completed successfully")
+            for name, ddl in (("target_qty", "INTEGER"), ("reason", "TEXT"), ("tl_response", "TEXT"),
+                              ("acknowledged", "BOOLEAN DEFAULT 0")):
+                if name not in columns:
+                    print(f"Adding missing '{name}' column to reconciliation_requests table...")
+                    conn.execute(text(f"ALTER TABLE reconciliation_requests ADD COLUMN {name} {ddl}"))
+            conn.commit()
+
+            # Merge the old reconciliation_queue table into reconciliation_requests, then drop it
+            result = conn.execute(text("PRAGMA table_info(reconciliation_queue)"))
+            queue_columns = [row[1] for row in result.fetchall()]
+
+            if queue_columns:
+                print("Merging reconciliation_queue into reconciliation_requests...")
+                acknowledged = "COALESCE(q.acknowledged, 0)" if 'acknowledged' in queue_columns else "0"
+                moved = conn.execute(text(
+                    "INSERT INTO reconciliation_requests "
+                    "(line_id, job_id, tl_name_norm, requested_by, requested_qty, target_qty, reason, "
+                    "status, tl_response, acknowledged, resolved_at, created_at) "
+                    "SELECT q.line_id, q.job_id, "
+                    "COALESCE((SELECT lower(trim(a.tl_name)) FROM assignments a "
+                    "WHERE a.line_id = q.line_id AND a.active = 1 ORDER BY a.id DESC LIMIT 1), ''), "
+                    "q.requested_by, q.scanned_total, q.target_qty, q.reason, "
+                    f"COALESCE(q.status, 'pending'), q.tl_response, {acknowledged}, q.resolved_at, q.created_at "
+                    "FROM reconciliation_queue q ORDER BY q.id"
+                )).rowcount
+                conn.execute(text("DROP TABLE reconciliation_queue"))
+                conn.commit()  # one transaction: copied and dropped together
+                print(f"Merged {moved} reconciliation_queue rows")
 
             # Check if created_by_tl_norm column exists in lines table
             result = conn.execute(text("PRAGMA table_info(lines)"))
@@ -238,6 +702,50 @@ def init_db():
                 conn.commit()
                 print("Added role column")
 
+            # Check if version column exists in scan_jobs table
+            result = conn.execute(text("PRAGMA table_info(scan_jobs)"))
+            job_columns = [row[1] for row in result.fetchall()]
+
+            if 'version' not in job_columns:
+                print("Adding missing 'version' column to scan_jobs table...")
+                conn.execute(text("ALTER TABLE scan_jobs ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+                conn.commit()
+                print("Added version column")
+
+            for name in ("submit_token", "submit_from"):
+                if name not in job_columns:
+                    print(f"Adding missing '{name}' column to scan_jobs table...")
+                    conn.execute(text(f"ALTER TABLE scan_jobs ADD COLUMN {name} VARCHAR(32)"))
+            conn.commit()
+
+            # One unfinished job per line. GET /api/job/state used to create jobs, so older
+            # databases can hold extra empty ones: drop those first, then add the index.
+            has_open_job_index = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type='index' AND name='uq_job_line_unfinished'"
+            )).fetchone()
+            if not has_open_job_index:
+                unfinished = "('open', 'locked_recon', 'variance_approved')"
+                removed = conn.execute(text(
+                    f"DELETE FROM scan_jobs WHERE status IN {unfinished} "
+                    "AND NOT EXISTS (SELECT 1 FROM scans s WHERE s.job_id = scan_jobs.id) "
+                    "AND NOT EXISTS (SELECT 1 FROM reconciliation_requests r WHERE r.job_id = scan_jobs.id) "
+                    "AND NOT EXISTS (SELECT 1 FROM reconciliations r WHERE r.job_id = scan_jobs.id) "
+                    f"AND EXISTS (SELECT 1 FROM scan_jobs k WHERE k.line_id = scan_jobs.line_id "
+                    f"AND k.status IN {unfinished} AND k.id != scan_jobs.id "
+                    "AND (k.id < scan_jobs.id OR EXISTS (SELECT 1 FROM scans s WHERE s.job_id = k.id)))"
+                )).rowcount
+                conn.commit()
+                try:
+                    conn.execute(text(
+                        "CREATE UNIQUE INDEX uq_job_line_unfinished ON scan_jobs (line_id) "
+                        f"WHERE status IN {unfinished}"
+                    ))
+                    conn.commit()
+                    print(f"Added one-open-job-per-line index (removed {removed} empty duplicate jobs)")
+                except Exception as uq_e:
+                    conn.rollback()
+                    print(f"One-open-job-per-line index not added, lines with several scanned open jobs remain: {uq_e}")
+
             # Remove old unique constraint if it exists and add new composite index
             try:
                 # Check if old constraint exists
@@ -247,30 +755,60 @@ def init_db():
                     conn.execute(text("DROP INDEX IF EXISTS unique_job_serial"))
                     conn.commit()
 
-                # Add composite unique index for proper duplicate checking
+                # Composite unique index for proper duplicate checking, plus the hot-query index plan
+                for ddl in INDEX_MIGRATIONS:
+                    conn.execute(text(ddl))
+
+                # Older LINE_SETUP entries stored the raw request body, including the TL PIN
                 conn.execute(text(
-                    "CREATE UNIQUE INDEX IF NOT EXISTS ux_scans_job_sku_serial "
-                    "ON scans (job_id, sku, serial_code)"
+                    "UPDATE audit_log SET payload_json = json_set(payload_json, '$.pin', '***') "
+                    "WHERE action = 'LINE_SETUP' AND json_valid(payload_json) "
+                    "AND json_extract(payload_json, '$.pin') IS NOT NULL "
+                    "AND json_extract(payload_json, '$.pin') != '***'"
                 ))
                 conn.commit()
+                conn.execute(text("PRAGMA optimize"))
                 print("Added composite unique index for scan duplicates")
             except Exception as idx_e:
                 print(f"Index creation warning: {idx_e}")
 
+            # Export data versions. A counter that starts over (new or replaced database)
+            # could name files cached for other data, so the cache starts over with it.
+            created = conn.execute(text(
+                "INSERT OR IGNORE INTO export_versions (name, version) VALUES ('mdf', 0)"
+            )).rowcount
+            for ddl in EXPORT_VERSION_TRIGGERS:
+                conn.execute(text(ddl))
+            conn.commit()
+            if created:
+                export_cache.clear()
+
+            # Backfill the global serial index from existing scans (first sighting wins)
+            has_index_rows = conn.execute(text("SELECT 1 FROM serial_index LIMIT 1")).fetchone()
+            if not has_index_rows:
+                conn.execute(text(
+                    "INSERT OR IGNORE INTO serial_index "
+                    "(serial_code, sku, job_id, line_id, counter_name, first_seen_at) "
+                    "SELECT serial_code, sku, job_id, line_id, counter_name, created_at "
+                    "FROM scans ORDER BY created_at, id"
+                ))
+                conn.commit()
+
     except Exception as e:
         print(f"Database migration warning: {e}")
         # Continue anyway as this is not critical
 
 def ensure_mdf():
-    """Ensure MDF.xlsx exists with proper headers"""
-    os.makedirs(EXPORTS_DIR, exist_ok=True)
-    if not os.path.exists(MDF_PATH):
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Sheet1"
-        ws.append(COLUMNS)
-        wb.save(MDF_PATH)
-        print(f"Created {MDF_PATH} with headers")
+    """Ensure the MDF partition directory exists, splitting a pre-partitioning MDF.xlsx into it"""
+    os.makedirs(MDF_DIR, exist_ok=True)
+    if os.path.exists(MDF_PATH):
+        moved = mdf_store.split_legacy(MDF_PATH)
+        print(f"Split {MDF_PATH} into per-warehouse MDF files ({moved} rows)")
+
+def _mdf_frame():
+    """The combined MDF as a DataFrame (None when there are no rows)"""
+    rows = mdf_store.rows()
+    return pd.DataFrame(rows, columns=COLUMNS) if rows else None
 
 @app.before_request
 def _boot():
@@ -308,13 +846,249 @@ def _is_manager():
     finally:
         db.close()
 
-def norm_sku(s):
-    """Normalize SKU for consistent storage"""
-    return re.sub(r"[^A-Za-z0-9\-_]", "", (s or "").strip()).upper()
+def _serial_first_seen(db, entry):
+    """Describe where a serial was first counted"""
+    line = db.get(Line, entry.line_id)
+    return {
+        "serial_code": entry.serial_code,
+        "sku": entry.sku or "",
+        "job_id": entry.job_id,
+        "line_id": entry.line_id,
+        "line_code": line.line_code if line else None,
+        "location": line.location if line else None,
+        "warehouse": line.warehouse if line else None,
+        "counter_name": entry.counter_name,
+        "first_seen_at": entry.first_seen_at
+    }
+
+def _cross_line_serial(db, code, line_id):
+    """Return the serial index entry if this serial was already counted on another line"""
+    if SERIAL_DUP_POLICY == "allow":
+        return None
+    entry = db.get(SerialIndex, code)
+    if entry and entry.line_id != line_id:
+        return entry
+    return None
+
+# A serial index entry is stale once its job is gone, or finished before the running
+# count period started (the last period close); such a sighting is from an earlier count
+_SERIAL_ENTRY_STALE = text(
+    "NOT EXISTS (SELECT 1 FROM scan_jobs j WHERE j.id = serial_index.job_id"
+    " AND (j.status IN ('open', 'locked_recon', 'variance_approved', 'submitting')"
+    " OR j.closed_at IS NULL"
+    " OR j.closed_at >= COALESCE((SELECT MAX(closed_at) FROM count_periods), '')))"
+)
+
+def _claim_serial(db, code, sku, job_id, line_id, counter_name, seen_at):
+    """Insert the serial index entry, taking over a stale one; True if this is the first current sighting"""
+    stmt = sqlite_insert(SerialIndex).values(
+        serial_code=code, sku=sku, job_id=job_id, line_id=line_id,
+        counter_name=counter_name, first_seen_at=seen_at
+    )
+    return db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["serial_code"],
+            set_={c: stmt.excluded[c] for c in ("sku", "job_id", "line_id", "counter_name", "first_seen_at")},
+            where=_SERIAL_ENTRY_STALE
+        ).returning(SerialIndex.serial_code)
+    ).scalar() is not None
+
+def _reindex_serials(db, job_ids):
+    """Drop serial index entries owned by removed jobs and re-point them at the next remaining sighting.
+
+    db may be a Session or a Core Connection.
+    """
+    if not job_ids:
+        return
+    owned = db.execute(select(SerialIndex.serial_code).where(SerialIndex.job_id.in_(job_ids)))
+    codes = [c for (c,) in owned]
+    if not codes:
+        return
+    db.execute(delete(SerialIndex).where(SerialIndex.job_id.in_(job_ids)))
+    for i in range(0, len(codes), 500):
+        chunk = codes[i:i + 500]
+        db.execute(text(
+            "INSERT OR IGNORE INTO serial_index "
+            "(serial_code, sku, job_id, line_id, counter_name, first_seen_at) "
+            "SELECT serial_code, sku, job_id, line_id, counter_name, created_at "
+            "FROM scans WHERE serial_code IN :codes ORDER BY created_at, id"
+        ).bindparams(bindparam("codes", expanding=True)), {"codes": chunk})
+
+def _archive_table(conn, table, alias="archive"):
+    """Create/extend the archive copy of a table (plain columns + archived_at, no constraints)"""
+    name = table.name
+    exists = conn.exec_driver_sql(
+        f"SELECT 1 FROM {alias}.sqlite_master WHERE type='table' AND name=?", (name,)
+    ).fetchone()
+    if not exists:
+        conn.exec_driver_sql(f"CREATE TABLE {alias}.{name} AS SELECT * FROM main.{name} WHERE 0")
+        conn.exec_driver_sql(f"ALTER TABLE {alias}.{name} ADD COLUMN archived_at DATETIME")
+    have = {row[1] for row in conn.exec_driver_sql(f"PRAGMA {alias}.table_info({name})")}
+    for col in table.columns:
+        if col.name not in have:
+            conn.exec_driver_sql(f"ALTER TABLE {alias}.{name} ADD COLUMN {col.name}")
+    return [col.name for col in table.columns]
+
+def _archive_copy(conn, table, where_sql, params, archived_at, alias="archive"):
+    """INSERT INTO archive.t SELECT ... FROM main.t WHERE <where_sql>"""
+    cols = ", ".join(_archive_table(conn, table, alias))
+    conn.exec_driver_sql(
+        f"INSERT INTO {alias}.{table.name} ({cols}, archived_at) "
+        f"SELECT {cols}, ? FROM main.{table.name} WHERE {where_sql}",
+        (archived_at,) + tuple(params)
+    )
+
+def _attach(conn, path, alias="archive"):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn.exec_driver_sql(f"ATTACH DATABASE ? AS {alias}", (path,))
+    conn.commit()
+
+def _detach(conn, alias="archive"):
+    conn.exec_driver_sql(f"DETACH DATABASE {alias}")
+    conn.commit()
 
-def norm_code(s):
-    """Normalize serial/code for consistent storage"""
-    return re.sub(r"[^A-Za-z0-9\-_]", "", (s or "").strip()).upper()
+def _purge_jobs(job_ids, archive=False, chunk_size=None, extra=None, archive_path=None):
+    """Set-based removal of jobs and everything hanging off them.
+
+    Each chunk of job ids is one short transaction (one DELETE ... WHERE job_id IN (...)
+    per child table), so scanners can get the write lock between chunks. With
+    archive=True the rows are first copied via ATTACH to archive_path (default ARCHIVE_DB_PATH).
+    extra(conn, archived_at) runs in the final chunk's transaction for caller cleanup.
+    """
+    job_ids = list(job_ids)
+    chunk_size = chunk_size or DELETE_CHUNK_SIZE
+    archived_at = abu_dhabi_now().strftime("%Y-%m-%d %H:%M:%S.%f")
+    chunks = [job_ids[i:i + chunk_size] for i in range(0, len(job_ids), chunk_size)] or [[]]
+
+    with engine.connect() as conn:
+        if archive:
+            _attach(conn, archive_path or ARCHIVE_DB_PATH)
+        try:
+            for n, chunk in enumerate(chunks):
+                with conn.begin():
+                    if chunk:
+                        if archive:
+                            marks = ", ".join("?" * len(chunk))
+                            _archive_copy(conn, Line.__table__,
+                                          f"id IN (SELECT line_id FROM main.scan_jobs WHERE id IN ({marks})) "
+                                          f"AND id NOT IN (SELECT id FROM archive.lines)", chunk, archived_at)
+                            _archive_copy(conn, ScanJob.__table__, f"id IN ({marks})", chunk, archived_at)
+                            for child in JOB_CHILD_TABLES:
+                                _archive_copy(conn, child.__table__, f"job_id IN ({marks})", chunk, archived_at)
+                        for child in JOB_CHILD_TABLES:
+                            conn.execute(delete(child).where(child.job_id.in_(chunk)))
+                        _reindex_serials(conn, chunk)
+                        conn.execute(delete(ScanJob).where(ScanJob.id.in_(chunk)))
+                    if extra and n == len(chunks) - 1:
+                        extra(conn, archived_at)
+        finally:
+            if archive:
+                _detach(conn)
+    return len(job_ids)
+
+def _wants_archive(data):
+    """Delete mode from the request body, falling back to DELETE_MODE; None if it isn't a valid mode"""
+    mode = data.get("mode") or DELETE_MODE
+    if not isinstance(mode, str) or mode.strip().lower() not in ("delete", "archive"):
+        return None
+    return mode.strip().lower() == "archive"
+
+def _bad_mode():
+    return jsonify({"ok": False, "reason": "bad_mode"}), 400
+
+_archive_engines = {}
+
+def _archive_engine(path):
+    """Read-only engine for a period archive file (cached per path)"""
+    eng = _archive_engines.get(path)
+    if eng is None:
+        eng = create_engine(f"sqlite:///file:{path}?mode=ro&uri=true", echo=False)
+        _archive_engines[path] = eng
+    return eng
+
+def dispose_engines(close=True):
+    """Drop pooled connections; forked workers pass close=False so the parent's sockets stay untouched"""
+    engine.dispose(close=close)
+    for eng in _archive_engines.values():
+        eng.dispose(close=close)
+
+def query_history(sql, params=None, periods="live"):
+    """Run one read-only SELECT against the live DB and/or closed-period archives.
+
+    periods is "live", "all", or a list of CountPeriod ids (may include "live").
+    Archive tables keep the live column names, so the same SQL works on both; it may
+    use :period_id, bound to the source's period id (NULL for the live DB).
+    Returns a list of dicts, each tagged with period_id (None for live rows).
+    """
+    if periods in ("live", "all"):
+        wanted = [periods]
+    else:
+        wanted = list(periods)
+    sources = []
+    if "live" in wanted or "all" in wanted:
+        sources.append((None, engine))
+
+    db = SessionLocal()
+    try:
+        q = db.query(CountPeriod).order_by(CountPeriod.id)
+        if "all" not in wanted:
+            ids = [int(p) for p in wanted if p != "live"]
+            q = q.filter(CountPeriod.id.in_(ids))
+        for period in q.all():
+            if os.path.exists(period.archive_path):
+                sources.append((period.id, _archive_engine(period.archive_path)))
+    finally:
+        db.close()
+
+    rows = []
+    for period_id, eng in sources:
+        with eng.connect() as conn:
+            for row in conn.execute(text(sql), {**(params or {}), "period_id": period_id}).mappings():
+                item = dict(row)
+                item["period_id"] = period_id
+                rows.append(item)
+    return rows
+
+# Batch loaders for list endpoints: one query per kind of data, never one per row
+def _job_scan_totals(db, job_ids):
+    """job_id -> (scan rows, summed qty) in one grouped query"""
+    if not job_ids:
+        return {}
+    rows = db.execute(
+        select(Scan.job_id, func.count(Scan.id), func.coalesce(func.sum(Scan.qty), 0))
+        .where(Scan.job_id.in_(job_ids)).group_by(Scan.job_id)
+    ).all()
+    return {job_id: (n, int(qty)) for job_id, n, qty in rows}
+
+def _active_assignments(db, line_ids):
+    """line_id -> its active Assignment"""
+    if not line_ids:
+        return {}
+    out = {}
+    for a in db.scalars(select(Assignment).where(Assignment.line_id.in_(line_ids), Assignment.active == True)
+                        .order_by(Assignment.id)):
+        out.setdefault(a.line_id, a)
+    return out
+
+LineJob = namedtuple("LineJob", "id status")
+
+def _line_jobs(db, line_ids):
+    """line_id -> (unfinished LineJob or None, Counter of job statuses), from one grouped read"""
+    if not line_ids:
+        return {}
+    out = {line_id: [None, Counter()] for line_id in line_ids}
+    rows = db.execute(
+        select(ScanJob.line_id, ScanJob.status, func.count(), func.min(ScanJob.id))
+        .where(ScanJob.line_id.in_(line_ids))
+        .group_by(ScanJob.line_id, ScanJob.status)
+    )
+    for line_id, status, count, first_id in rows:
+        entry = out[line_id]
+        entry[1][status] += count
+        # The oldest unfinished job, as when walking the jobs in id order
+        if status in ('open', 'locked_recon', 'variance_approved') and (entry[0] is None or first_id < entry[0].id):
+            entry[0] = LineJob(first_id, status)
+    return {line_id: tuple(v) for line_id, v in out.items()}
 
 # Routes
 @app.route('/signin')
@@ -323,7 +1097,8 @@ def signin():
 
 @app.route('/')
 def home():
-    return render_template('home.html', locations=LOCATIONS, warehouses=WAREHOUSES)
+    locations, warehouses = get_reference_data()
+    return render_template('home.html', locations=locations, warehouses=warehouses)
 
 @app.route('/count')
 def count():
@@ -350,16 +1125,16 @@ def log():
     db = SessionLocal()
     try:
         # Get completed jobs from database
-        jobs = db.query(ScanJob).filter(
+        jobs = db.query(ScanJob).options(joinedload(ScanJob.line)).filter(
             ScanJob.status.in_(['submitted', 'variance_approved'])
         ).order_by(ScanJob.closed_at.desc()).all()
+        totals = _job_scan_totals(db, [job.id for job in jobs])
 
         job_data = []
 
         # Add database jobs
         for job in jobs:
-            total_scans = db.query(Scan).filter(Scan.job_id == job.id).count()
-            total_qty = db.query(func.sum(Scan.qty)).filter(Scan.job_id == job.id).scalar() or 0
+            total_scans, total_qty = totals.get(job.id, (0, 0))
 
             job_data.append({
                 'line': job.line,
@@ -372,8 +1147,8 @@ def log():
 
         # Also read historical data from MDF Excel file
         try:
-            if os.path.exists(MDF_PATH):
-                df = pd.read_excel(MDF_PATH)
+            df = _mdf_frame()
+            if df is not None:
                 if not df.empty and len(df) > 0:
                     # Group by date, location, warehouse, and first counter name to identify unique jobs
                     historical_jobs = df.groupby(['Date', 'Location', 'Warehouse', 'CounterName']).agg({
@@ -514,28 +1289,30 @@ def api_reconcile_state():
 
     db = SessionLocal()
     try:
-        line = db.query(Line).filter_by(location=loc, warehouse=wh, line_code=line_code).first()
+        line = line_cache.get_by_key(db, loc, wh, line_code)
         if not line:
             return jsonify({"ok": False, "reason": "not_configured"}), 404
 
-        job = db.query(ScanJob).filter_by(line_id=line.id, status="open").order_by(ScanJob.id.desc()).first()
-        if not job:
-            job = ScanJob(line_id=line.id, status="open", opened_at=abu_dhabi_now())
-            db.add(job)
-            db.commit()
+        # The line's unfinished job (uq_job_line_unfinished allows at most one)
+        job = db.query(ScanJob).filter(
+            ScanJob.line_id == line.id,
+            ScanJob.status.in_(['open', 'locked_recon', 'variance_approved'])
+        ).first()
 
-        scanned_total = db.query(func.coalesce(func.sum(Scan.qty), 0)).filter_by(job_id=job.id).scalar() or 0
+        scanned_total = 0
+        if job:
+            scanned_total = db.query(func.coalesce(func.sum(Scan.qty), 0)).filter_by(job_id=job.id).scalar() or 0
         asg = db.query(Assignment).filter_by(line_id=line.id).order_by(Assignment.id.desc()).first()
         assigned = [asg.counter_name_1 if asg else "", asg.counter_name_2 if asg else ""]
 
         return jsonify({
             "ok": True,
             "line_id": line.id,
-            "job_id": job.id,
+            "job_id": job.id if job else None,
             "target_qty": int(line.target_qty or 0),
             "scanned_total": int(scanned_total),
             "assigned": assigned,
-            "status": job.status
+            "status": job.status if job else "not_started"
         })
     finally:
         db.close()
@@ -588,18 +1365,14 @@ def api_reconcile_edit_target():
             )
             db.add(rec)
 
+        db.commit()
+        line_cache.invalidate(line_id)
+
         # Add audit log
         tl_session = session.get(SESSION_TL_KEY, {})
-        audit = AuditLog(
-            actor=tl_session.get("display_name", "TL"),
-            action='TARGET_UPDATED',
-            entity='LINE',
-            entity_id=line_id,
-            payload_json=json.dumps({"previous_target": prev, "new_target": new_target})
-        )
-        db.add(audit)
+        record_audit(tl_session.get("display_name", "TL"), 'TARGET_UPDATED', 'LINE', line_id,
+                     {"previous_target": prev, "new_target": new_target})
 
-        db.commit()
         return jsonify({
             "ok": True,
             "target_qty": new_target,
@@ -629,8 +1402,10 @@ def api_reconcile_approve_variance():
         if not job:
             return jsonify({"ok": False, "reason": "not_found"}), 404
 
-        job.status = "variance_approved"
-        db.add(job)
+        failed = _transition_job(db, job, "approve_variance")
+        if failed:
+            db.rollback()
+            return _job_conflict(failed, job)
 
         tl_session = session.get(SESSION_TL_KEY, {})
         tl_name = tl_session.get("display_name", "TL")
@@ -649,6 +1424,7 @@ def api_reconcile_approve_variance():
         db.close()
 
 @app.route('/api/lines')
+@coalesced(lambda: (request.args.get('location', '').strip(), request.args.get('warehouse', '').strip(), _viewer_key()))
 def api_lines():
     """
     Query params: location, warehouse
@@ -695,13 +1471,11 @@ def api_lines():
 
         lines = lines_query.all()
         print(f"DEBUG: Found {len(lines)} lines for location={location}, warehouse={warehouse}")
+        assignments = _active_assignments(db, [line.id for line in lines])
 
         out = []
         for line in lines:
-            assignment = db.query(Assignment).filter(
-                Assignment.line_id == line.id,
-                Assignment.active == True
-            ).first()
+            assignment = assignments.get(line.id)
 
             assigned = []
             tl_name_for_line = "Unknown"
@@ -719,7 +1493,7 @@ def api_lines():
                 'assigned': assigned
             })
 
-        return jsonify({'ok': True, 'lines': out})
+        return jsonify({'ok': True, 'lines': _rows(out)})
 
     finally:
         db.close()
@@ -769,6 +1543,12 @@ def api_line_upsert():
         # Deactivate old assignments
         db.query(Assignment).filter(Assignment.line_id == line.id).update({'active': False})
 
+        # Pending reconciliation requests move to the new TL's inbox
+        db.query(ReconciliationRequest).filter(
+            ReconciliationRequest.line_id == line.id,
+            ReconciliationRequest.status == 'pending'
+        ).update({'tl_name_norm': _norm(tl_name)})
+
         # Create new assignment
         assignment = Assignment(
             line_id=line.id,
@@ -780,32 +1560,14 @@ def api_line_upsert():
         )
         db.add(assignment)
 
-        # Ensure one open job exists
-        open_job = db.query(ScanJob).filter(
-            ScanJob.line_id == line.id,
-            ScanJob.status == 'open'
-        ).first()
-
-        if not open_job:
-            job = ScanJob(
-                line_id=line.id,
-                status='open',
-                opened_by=tl_name,
-                opened_at=abu_dhabi_now() # Updated here
-            )
-            db.add(job)
-
-        # Audit log
-        audit = AuditLog(
-            actor=tl_name,
-            action='LINE_SETUP',
-            entity='LINE',
-            entity_id=line.id,
-            payload_json=json.dumps(data)
-        )
-        db.add(audit)
+        # Ensure the line has a job to count into
+        _start_job(db, line.id, opened_by=tl_name)
 
         db.commit()
+        line_cache.invalidate(line.id)
+
+        # Audit log (PIN is redacted by the audit writer)
+        record_audit(tl_name, 'LINE_SETUP', 'LINE', line.id, data)
 
         # Return fresh state
         return jsonify({
@@ -823,6 +1585,8 @@ def api_line_upsert():
         db.close()
 
 @app.route('/api/job/state')
+@coalesced(lambda: (request.args.get('location', '').strip(), request.args.get('warehouse', '').strip(),
+                    request.args.get('line_code', '').strip(), _norm(request.args.get('counter', ''))))
 def api_job_state():
     """Get current job state for a line"""
     location = request.args.get('location', '').strip()
@@ -835,11 +1599,7 @@ def api_job_state():
 
     db = SessionLocal()
     try:
-        line = db.query(Line).filter(
-            Line.location == location,
-            Line.warehouse == warehouse,
-            Line.line_code == line_code
-        ).first()
+        line = line_cache.get_by_key(db, location, warehouse, line_code)
 
         if not line:
             return jsonify({'ok': False, 'reason': 'not_configured'}), 404
@@ -866,7 +1626,7 @@ def api_job_state():
         # Check if there are completed jobs
         completed_jobs = db.query(ScanJob).filter(
             ScanJob.line_id == line.id,
-            ScanJob.status == 'submitted'
+            ScanJob.status.in_(['submitting', 'submitted'])
         ).count()
 
         # If there are completed jobs and no current jobs, the line is completed
@@ -877,15 +1637,19 @@ def api_job_state():
                 'message': 'This line has been completed. Contact your Team Leader for a new assignment.'
             }), 410
 
-        # If no current job exists and no completed jobs, create a new open job
+        # No job yet: reads never create one, the client starts it with POST /api/job/start
         if not current_job:
-            current_job = ScanJob(
-                line_id=line.id,
-                status='open',
-                opened_at=abu_dhabi_now()
-            )
-            db.add(current_job)
-            db.commit()
+            return jsonify({
+                'ok': True,
+                'line_id': line.id,
+                'job_id': None,
+                'target': int(line.target_qty or 0),
+                'target_qty': int(line.target_qty or 0),
+                'assigned': assigned,
+                'is_assigned': bool(is_assigned),
+                'scanned_total': 0,
+                'status': 'not_started'
+            })
 
         # Count scanned total using sum of qty
         scanned_total = db.query(func.coalesce(func.sum(Scan.qty), 0)).filter(Scan.job_id == current_job.id).scalar() or 0
@@ -905,10 +1669,142 @@ def api_job_state():
     finally:
         db.close()
 
-def _ns(s):
-    """Normalize string for scan comparison"""
-    import re
-    return re.sub(r"[^A-Za-z0-9\-_]", "", (s or "").strip()).upper()
+@app.route('/api/job/start', methods=['POST'])
+def api_job_start():
+    """Open the line's job if it has none yet (idempotent: returns the running job otherwise)"""
+    data = request.get_json(force=True)
+    location = (data.get('location') or '').strip()
+    warehouse = (data.get('warehouse') or '').strip()
+    line_code = (data.get('line_code') or '').strip()
+    counter = (data.get('counter') or '').strip()
+
+    if not all([location, warehouse, line_code]):
+        return jsonify({'ok': False, 'reason': 'missing_params'}), 400
+
+    db = SessionLocal()
+    try:
+        line = line_cache.get_by_key(db, location, warehouse, line_code)
+        if not line:
+            return jsonify({'ok': False, 'reason': 'not_configured'}), 404
+
+        # A finished line only reopens through a TL line reset
+        has_unfinished = db.query(ScanJob.id).filter(
+            ScanJob.line_id == line.id,
+            ScanJob.status.in_(['open', 'locked_recon', 'variance_approved'])
+        ).first() is not None
+        if not has_unfinished and db.query(ScanJob.id).filter(
+            ScanJob.line_id == line.id,
+            ScanJob.status.in_(['submitting', 'submitted'])
+        ).first() is not None:
+            return jsonify({
+                'ok': False,
+                'reason': 'line_completed',
+                'message': 'This line has been completed. Contact your Team Leader for a new assignment.'
+            }), 410
+
+        job, created = _start_job(db, line.id, opened_by=counter or None)
+        if job is None:
+            # Deleted since it was cached (possibly by another worker)
+            db.rollback()
+            line_cache.invalidate(line.id)
+            return jsonify({'ok': False, 'reason': 'not_configured'}), 404
+        db.commit()
+        if created:
+            record_audit(counter or 'Unknown', 'JOB_START', 'SCANJOB', job.id, {'line_id': line.id})
+
+        return jsonify({'ok': True, 'line_id': line.id, 'job_id': job.id, 'status': job.status, 'created': created})
+
+    except Exception as e:
+        db.rollback()
+        return jsonify({'ok': False, 'error': str(e)}), 500
+    finally:
+        db.close()
+
+def _scan_fields(sku_raw, code_raw, qty):
+    """Decode structured (GS1) payloads into SKU/serial/qty, then normalize.
+
+    The GTIN fills an empty SKU, the serial (or SSCC) becomes the serial code and a
+    count AI replaces the default qty of 1. Plain codes pass through unchanged.
+    Decoding is cached by raw payload in gs1.parse_barcode.
+    """
+    parsed = parse_barcode(code_raw)
+    if parsed:
+        if not sku_raw and parsed.gtin:
+            sku_raw = parsed.gtin
+        # No serial on the label: use the bare element string so raw and bracketed forms match
+        code_raw = parsed.serial or parsed.sscc or "".join(ai + value for ai, value in parsed.ais)
+        if parsed.qty and qty == 1:
+            qty = parsed.qty
+    return norm_sku(sku_raw), norm_code(code_raw), qty, parsed
+
+def _parsed_summary(parsed):
+    return {"gtin": parsed.gtin, "serial": parsed.serial, "lot": parsed.lot,
+            "qty": parsed.qty, "sscc": parsed.sscc, "expiry": parsed.expiry}
+
+@app.route('/api/barcode/parse', methods=['POST'])
+def api_barcode_parse():
+    """Decode a batch of raw scanner payloads into SKU/serial/qty without saving"""
+    data = request.get_json(force=True) or {}
+    payloads = data.get("payloads") or []
+    if not isinstance(payloads, list):
+        return jsonify({"ok": False, "reason": "bad_input"}), 400
+
+    items = []
+    for raw in payloads:
+        raw = str(raw or "").strip()
+        sku, code, qty, parsed = _scan_fields("", raw, 1)
+        items.append({
+            "raw": raw,
+            "sku": sku,
+            "serial_code": code,
+            "qty": qty,
+            "gs1": _parsed_summary(parsed) if parsed else None
+        })
+    return jsonify({"ok": True, "items": items})
+
+def _write_scan(db, item):
+    """Insert one scan inside db's open transaction; returns {"status": ok|duplicate|cross_line, ...}"""
+    # Strict duplicate check is the unique index on (job_id, sku, serial_code): a duplicate,
+    # including one racing in from the other counter, simply returns no row
+    scan_id = db.execute(
+        sqlite_insert(Scan).values(**item)
+        .on_conflict_do_nothing(index_elements=["job_id", "sku", "serial_code"]).returning(Scan.id)
+    ).scalar()
+    if scan_id is None:
+        return {"status": "duplicate"}
+
+    # First sighting claims the serial index entry; only a repeat needs the cross-line lookup
+    cross_line_warning = None
+    if not _claim_serial(db, item["serial_code"], item["sku"], item["job_id"], item["line_id"],
+                         item["counter_name"], item["created_at"]):
+        first_seen = _cross_line_serial(db, item["serial_code"], item["line_id"])
+        if first_seen and SERIAL_DUP_POLICY == "block":
+            # Undo just this scan; the rest of a group-commit batch stays
+            db.execute(delete(Scan).where(Scan.id == scan_id))
+            return {"status": "cross_line", "first_seen": _serial_first_seen(db, first_seen)}
+        cross_line_warning = _serial_first_seen(db, first_seen) if first_seen else None
+    return {"status": "ok", "cross_line_warning": cross_line_warning}
+
+def _apply_scan_batch(db, items):
+    """Write a batch of scans in one transaction (caller commits) and attach each job's new total"""
+    results = [_write_scan(db, item) for item in items]
+    job_ids = {item["job_id"] for item, r in zip(items, results) if r["status"] == "ok"}
+    totals = {}
+    if job_ids:
+        totals = dict(db.execute(
+            select(Scan.job_id, func.coalesce(func.sum(Scan.qty), 0))
+            .where(Scan.job_id.in_(job_ids)).group_by(Scan.job_id)
+        ).all())
+    for item, r in zip(items, results):
+        if r["status"] == "ok":
+            r["scanned_total"] = int(totals.get(item["job_id"], 0))
+    return results
+
+scan_writer = (
+    GroupCommitWriter(SessionLocal, _apply_scan_batch, max_wait=SCAN_GROUP_COMMIT_MS / 1000.0,
+                      max_batch=SCAN_GROUP_COMMIT_MAX, name="scan-writer")
+    if SCAN_GROUP_COMMIT_MS > 0 else None
+)
 
 @app.route('/api/scan/add', methods=['POST'])
 def api_scan_add():
@@ -925,45 +1821,45 @@ def api_scan_add():
     if not (job_id and line_id and counter_name and code_raw and qty >= 1):
         return jsonify({"ok": False, "reason": "missing"}), 400
 
-    sku = _ns(sku_raw)
-    code = _ns(code_raw)
+    sku, code, qty, parsed = _scan_fields(sku_raw, code_raw, qty)
+    item = {"job_id": job_id, "line_id": line_id, "counter_name": counter_name, "sku": sku,
+            "serial_code": code, "qty": qty, "source": source, "created_at": abu_dhabi_now()}
 
-    db = SessionLocal()
     try:
-        # Strict duplicate check: same (job_id, sku, serial_code) combination only
-        existing = db.query(Scan.id).filter(
-            Scan.job_id == job_id,
-            Scan.sku == sku,
-            Scan.serial_code == code
-        ).first()
-
-        if existing:
-            return jsonify({"ok": False, "duplicate": True}), 409
-
-        # Add scan
-        scan = Scan(
-            job_id=job_id,
-            line_id=line_id,
-            counter_name=counter_name,
-            sku=sku,
-            serial_code=code,
-            qty=qty,
-            source=source,
-            created_at=abu_dhabi_now()
-        )
-        db.add(scan)
-        db.commit()
-
-        # Get updated total count
-        scanned_total = db.query(func.coalesce(func.sum(Scan.qty), 0)).filter(Scan.job_id == job_id).scalar() or 0
+        if scan_writer is not None:
+            future = scan_writer.submit(item)
+            try:
+                result = future.result(timeout=SCAN_WRITE_TIMEOUT)
+            except FutureTimeoutError:
+                # Still queued: withdraw it, so a scan reported as failed is never committed
+                # later. Already being written: wait for that outcome instead.
+                if future.cancel():
+                    raise
+                result = future.result()
+        else:
+            db = SessionLocal()
+            try:
+                result = _apply_scan_batch(db, [item])[0]
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+    except Exception:
+        return jsonify({'ok': False, 'error': 'Failed to add item'}), 500
 
-        return jsonify({"ok": True, "scanned_total": int(scanned_total)})
+    if result["status"] == "duplicate":
+        return jsonify({"ok": False, "duplicate": True}), 409
+    if result["status"] == "cross_line":
+        return jsonify({"ok": False, "duplicate": True, "cross_line": True, "first_seen": result["first_seen"]}), 409
 
-    except Exception as e:
-        db.rollback()
-        return jsonify({'ok': False, 'error': 'Failed to add item'}), 500
-    finally:
-        db.close()
+    out = {"ok": True, "scanned_total": result["scanned_total"]}
+    if parsed:
+        out["gs1"] = _parsed_summary(parsed)
+    if result.get("cross_line_warning"):
+        out["cross_line_warning"] = result["cross_line_warning"]
+    return jsonify(out)
 
 @app.route('/api/submit/final', methods=['POST'])
 def api_submit_final():
@@ -981,24 +1877,36 @@ def api_submit_final():
         line = job.line
         scanned_total = db.query(func.coalesce(func.sum(Scan.qty), 0)).filter(Scan.job_id == job_id).scalar() or 0
 
-        # Check if submission allowed
-        allow = (job.status == "variance_approved") or (scanned_total == int(line.target_qty or 0))
+        # Another submit is exporting this job (unless its claim has gone stale)
+        if job.status == "submitting" and job.closed_at is not None and (
+                abu_dhabi_now().replace(tzinfo=None) - job.closed_at < SUBMIT_CLAIM_TIMEOUT):
+            return _job_conflict("conflict", job)
+
+        # Check if submission allowed (a takeover is judged by the status the claim started from)
+        takeover = job.status == "submitting"
+        origin = job.submit_from if takeover else job.status
+        allow = origin == "variance_approved" or (scanned_total == int(line.target_qty or 0))
         if not allow:
             return jsonify({"ok": False, "reason": "mismatch"}), 412
 
+        # Claim the submit first, so a concurrent reset/submit can't interleave with the export
+        token = job.submit_token if takeover else uuid.uuid4().hex
+        claimed_version = job.version + 1
+        failed = _transition_job(db, job, "submit", closed_at=abu_dhabi_now(), submit_token=token, submit_from=origin)
+        if failed:
+            db.rollback()
+            return _job_conflict(failed, job)
+        db.commit()
+
         # Get all scans for export
         scans = db.query(Scan).filter(Scan.job_id == job_id).all()
 
-        # Export to Excel
-        with FileLock(LOCK_PATH, timeout=10):
-            wb = load_workbook(MDF_PATH)
-            ws = wb.active
-
-            for scan in scans:
-                now = scan.created_at
-                row = [
-                    now.strftime("%Y-%m-%d"),  # Date
-                    now.strftime("%H:%M:%S"),  # Time
+        # Export to this warehouse's MDF file (other warehouses' submits don't wait on it)
+        try:
+            mdf_store.append(line.location, line.warehouse, f"{job.id}:{token}", [
+                [
+                    scan.created_at.strftime("%Y-%m-%d"),  # Date
+                    scan.created_at.strftime("%H:%M:%S"),  # Time
                     line.location,             # Location
                     line.warehouse,            # Warehouse
                     scan.counter_name,         # CounterName
@@ -1007,26 +1915,29 @@ def api_submit_final():
                     scan.qty,                  # QTY
                     scan.source                # Source
                 ]
-                ws.append(row)
-
-            wb.save(MDF_PATH)
-            wb.close()
+                for scan in scans
+            ])
+        except Exception:
+            # Export failed: hand the job back in the state it was submitted from
+            db.rollback()
+            db.execute(
+                update(ScanJob)
+                .where(ScanJob.id == job.id, ScanJob.status == "submitting", ScanJob.version == claimed_version)
+                .values(status=origin, closed_at=None, version=ScanJob.version + 1)
+            )
+            db.commit()
+            raise
 
-        # Close job
-        job.status = 'submitted'
-        job.closed_at = abu_dhabi_now()
+        # Rows are in the MDF: only now does the job count as submitted
+        failed = _transition_job(db, job, "submit_done")
+        if failed:
+            db.rollback()
+            return _job_conflict(failed, job)
+        db.commit()
 
         # Audit log
-        audit = AuditLog(
-            actor=counter_name or 'Unknown',
-            action='JOB_SUBMIT',
-            entity='SCANJOB',
-            entity_id=job_id,
-            payload_json=json.dumps({'scanned_total': scanned_total, 'target': line.target_qty})
-        )
-        db.add(audit)
-
-        db.commit()
+        record_audit(counter_name or 'Unknown', 'JOB_SUBMIT', 'SCANJOB', job_id,
+                     {'scanned_total': scanned_total, 'target': line.target_qty})
 
         return jsonify({'ok': True, 'submitted': True})
 
@@ -1075,14 +1986,17 @@ def api_reconcile_request():
             requested_by=counter_name,
             reason=reason,
             requested_qty=int(scanned_total),
+            target_qty=target,
             status='pending'
         )
 
         # Lock job until TL acts
-        job.status = "locked_recon"
+        failed = _transition_job(db, job, "request_reconcile")
+        if failed:
+            db.rollback()
+            return _job_conflict(failed, job)
 
         db.add(req)
-        db.add(job)
         db.commit()
 
         return jsonify({"ok": True, "requested_qty": int(scanned_total)})
@@ -1121,7 +2035,10 @@ def api_reconcile_approve():
             reconciliation.result = 'edited_target'
             reconciliation.new_target = new_target
         elif mode == 'approve_variance':
-            job.status = 'variance_approved'
+            failed = _transition_job(db, job, "approve_variance")
+            if failed:
+                db.rollback()
+                return _job_conflict(failed, job)
             reconciliation.result = 'approved_variance'
 
         reconciliation.tl_approved_by = session.get('tl_name') # This should also be updated to display_name if used
@@ -1129,6 +2046,7 @@ def api_reconcile_approve():
         reconciliation.note = note
 
         db.commit()
+        line_cache.invalidate(job.line_id)
         return jsonify({'success': True})
 
     except Exception as e:
@@ -1137,121 +2055,304 @@ def api_reconcile_approve():
     finally:
         db.close()
 
+RECENT_SCANS_LIMIT = 10
+RECENT_SCANS_MAX_DELTA = 200
+
 @app.route('/api/recent-scans')
 def api_recent_scans():
-    """Get recent scans for a job"""
-    job_id = request.args.get('job_id')
+    """Get recent scans for a job.
+
+    Plain mode returns the latest RECENT_SCANS_LIMIT rows as a list. With since_id it
+    returns only rows newer than that id: {"ok", "scans", "last_id", "truncated"}. If more
+    than RECENT_SCANS_MAX_DELTA arrived, only the newest are sent and truncated is true;
+    the client then reloads in plain mode.
+    Both walk idx_scan_job_recent newest first.
+    """
+    job_id = request.args.get('job_id', type=int)
+    since_id = request.args.get('since_id', type=int)
     if not job_id:
-        return jsonify([])
+        return jsonify([] if since_id is None else {"ok": True, "scans": [], "last_id": since_id})
+
+    stmt = select(
+        Scan.id, Scan.sku, Scan.serial_code, Scan.qty, Scan.counter_name, Scan.source, Scan.created_at
+    ).where(Scan.job_id == job_id)
+    if since_id is not None:
+        stmt = stmt.where(Scan.id > since_id).order_by(Scan.created_at.desc()).limit(RECENT_SCANS_MAX_DELTA + 1)
+    else:
+        stmt = stmt.order_by(Scan.created_at.desc()).limit(RECENT_SCANS_LIMIT)
+
+    with engine.connect() as conn:
+        rows = conn.execute(stmt).all()
+    truncated = since_id is not None and len(rows) > RECENT_SCANS_MAX_DELTA
+    rows = rows[:RECENT_SCANS_MAX_DELTA]
+
+    scan_data = [{
+        'id': scan_id,
+        'sku': sku or '',
+        'serial_code': serial_code,
+        'qty': qty,
+        'counter_name': counter_name,
+        'source': source,
+        'time': created_at.strftime('%H:%M:%S')
+    } for scan_id, sku, serial_code, qty, counter_name, source, created_at in rows]
+
+    if since_id is None:
+        return jsonify(scan_data)
+    last_id = max([since_id] + [r['id'] for r in scan_data])
+    return jsonify({"ok": True, "scans": scan_data, "last_id": last_id, "truncated": truncated})
+
+@app.route('/api/reports/cross_line_duplicates')
+def api_cross_line_duplicates():
+    """Serials counted on more than one line, with every sighting of each serial"""
+    if not require_tl():
+        return jsonify({"ok": False, "reason": "unauthorized"}), 401
 
     db = SessionLocal()
     try:
-        scans = db.query(Scan).filter(
-            Scan.job_id == job_id
-        ).order_by(Scan.created_at.desc()).limit(10).all()
-
-        scan_data = []
-        for scan in scans:
-            scan_data.append({
-                'sku': scan.sku or '',
-                'serial_code': scan.serial_code,
-                'qty': scan.qty,
-                'counter_name': scan.counter_name,
-                'source': scan.source,
-                'time': scan.created_at.strftime('%H:%M:%S')
+        # One group per serial rather than a pair per two sightings
+        serials = select(Scan.serial_code).group_by(Scan.serial_code).having(
+            func.count(func.distinct(Scan.line_id)) > 1
+        )
+        rows = db.execute(
+            select(Scan.serial_code, Scan.sku, Scan.job_id, Scan.counter_name, Scan.created_at,
+                   Line.id, Line.location, Line.warehouse, Line.line_code)
+            .join(Line, Line.id == Scan.line_id)
+            .where(Scan.serial_code.in_(serials))
+            .order_by(Scan.serial_code, Scan.created_at)
+        ).all()
+
+        duplicates = []
+        for serial_code, sku, job_id, counter, created_at, line_id, location, warehouse, line_code in rows:
+            if not duplicates or duplicates[-1]['serial_code'] != serial_code:
+                duplicates.append({'serial_code': serial_code, 'sightings': []})
+            duplicates[-1]['sightings'].append({
+                'sku': sku or '',
+                'job_id': job_id,
+                'line_id': line_id,
+                'line_code': line_code,
+                'location': location,
+                'warehouse': warehouse,
+                'counter_name': counter,
+                'scanned_at': created_at
             })
 
-        return jsonify(scan_data)
+        return jsonify({"ok": True, "policy": SERIAL_DUP_POLICY, "count": len(duplicates), "duplicates": duplicates})
 
     finally:
         db.close()
 
+def _write_mdf_workbook(db, out):
+    """Write every scan of submitted jobs (not variance_approved) as a workbook to out (path or file)"""
+    # Scans with their line, in one query
+    scans = db.execute(
+        select(Scan.created_at, Line.location, Line.warehouse, Scan.counter_name, Scan.sku,
+               Scan.serial_code, Scan.qty, Scan.source)
+        .join(ScanJob, ScanJob.id == Scan.job_id).join(Line, Line.id == ScanJob.line_id)
+        .where(ScanJob.status == 'submitted')
+        .order_by(ScanJob.id, Scan.id)
+    )
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    ws.append(COLUMNS)
+
+    # Add all scans from completed jobs
+    for scan in scans:
+        now = scan.created_at # This will be in Abu Dhabi time
+        row = [
+            now.strftime("%Y-%m-%d"),  # Date
+            now.strftime("%H:%M:%S"),  # Time
+            scan.location,             # Location
+            scan.warehouse,            # Warehouse
+            scan.counter_name,         # CounterName
+            scan.sku or '',            # SKU
+            scan.serial_code,          # SerialOrCode
+            scan.qty,                  # QTY
+            scan.source                # Source
+        ]
+        ws.append(row)
+
+    wb.save(out)
+
 @app.route('/exports/MDF.xlsx')
 def download_excel():
     """Download the Excel file with all completed job data"""
     db = SessionLocal()
     try:
-        # Get only submitted jobs from database (not variance_approved)
-        jobs = db.query(ScanJob).filter(
-            ScanJob.status == 'submitted'
-        ).all()
-
-        # Regenerate Excel file with current data
-        with FileLock(LOCK_PATH, timeout=10):
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Sheet1"
-            ws.append(COLUMNS)
-
-            # Add all scans from completed jobs
-            for job in jobs:
-                scans = db.query(Scan).filter(Scan.job_id == job.id).all()
-                for scan in scans:
-                    now = scan.created_at # This will be in Abu Dhabi time
-                    row = [
-                        now.strftime("%Y-%m-%d"),  # Date
-                        now.strftime("%H:%M:%S"),  # Time
-                        job.line.location,         # Location
-                        job.line.warehouse,        # Warehouse
-                        scan.counter_name,         # CounterName
-                        scan.sku or '',            # SKU
-                        scan.serial_code,          # SerialOrCode
-                        scan.qty,                  # QTY
-                        scan.source                # Source
-                    ]
-                    ws.append(row)
-
-            wb.save(MDF_PATH)
-            wb.close()
-
-        return send_file(MDF_PATH, as_attachment=True, download_name='MDF.xlsx')
+        # Read the version before the data: a file is never older than its key
+        version = db.scalar(select(ExportVersion.version).where(ExportVersion.name == 'mdf'))
+        if version is None:
+            # No change counter (migration did not run): nothing to key a cached file on
+            os.makedirs(EXPORTS_DIR, exist_ok=True)
+            out = tempfile.TemporaryFile(dir=EXPORTS_DIR)  # unlinked: gone once the response is sent
+            _write_mdf_workbook(db, out)
+            out.seek(0)
+            return send_file(out, as_attachment=True, download_name='MDF.xlsx')
+        # Served from disk: ETag/Last-Modified revalidation (304) and Range requests (206).
+        # Another worker's prune can remove the entry before send_file opens it: look it up
+        # (and if need be rebuild it) once more.
+        for retry in (False, True):
+            cached = export_cache.get("mdf", {}, version, lambda path: _write_mdf_workbook(db, path))
+            try:
+                return send_file(cached.path, as_attachment=True, download_name='MDF.xlsx',
+                                 etag=cached.etag, last_modified=cached.mtime, conditional=True)
+            except FileNotFoundError:
+                if retry:
+                    raise
     finally:
         db.close()
 
-@app.route('/api/reconcile/tl_queue')
-def api_tl_reconcile_queue():
-    """Get pending reconciliation requests for TL"""
+@app.route('/api/export')
+def api_export():
+    """Stream scans as CSV or JSONL (?format=csv|jsonl), filtered by location, warehouse,
+    line, counter, status (comma-separated, default submitted) and since/until (until exclusive)"""
     if not require_tl():
         return jsonify({"ok": False, "reason": "unauthorized"}), 401
 
-    tl_session = session.get(SESSION_TL_KEY, {})
-    tl_name = tl_session.get("display_name", "")
+    fmt = (request.args.get("format") or "csv").strip().lower()
+    if fmt not in ("csv", "jsonl"):
+        return jsonify({"ok": False, "reason": "bad_format"}), 400
+
+    known_statuses = {s for starts, end in JOB_TRANSITIONS.values() for s in (*starts, end)}
+    statuses = [s.strip().lower() for s in (request.args.get("status") or "submitted").split(",") if s.strip()]
+    if not statuses or not set(statuses) <= known_statuses:
+        return jsonify({"ok": False, "reason": "bad_status"}), 400
 
-    db = SessionLocal()
     try:
-        # Get TL's lines using case-insensitive comparison
-        assignments = db.query(Assignment).filter(
-            func.lower(Assignment.tl_name) == func.lower(tl_name),
-            Assignment.active == True
-        ).all()
+        since = to_local_naive(datetime.fromisoformat(request.args["since"])) if request.args.get("since") else None
+        until = to_local_naive(datetime.fromisoformat(request.args["until"])) if request.args.get("until") else None
+    except ValueError:
+        return jsonify({"ok": False, "reason": "bad_date"}), 400
+
+    location = (request.args.get("location") or "").strip()
+    warehouse = (request.args.get("warehouse") or "").strip()
+    line_code = (request.args.get("line") or "").strip()
+    counter = (request.args.get("counter") or "").strip()
+
+    def generate():
+        db = SessionLocal()
+        try:
+            jobs_q = (select(ScanJob.id, ScanJob.status, Line.location, Line.warehouse, Line.line_code)
+                      .join(Line, Line.id == ScanJob.line_id)
+                      .where(ScanJob.status.in_(statuses)))
+            if location:
+                jobs_q = jobs_q.where(Line.location == location)
+            if warehouse:
+                jobs_q = jobs_q.where(Line.warehouse == warehouse)
+            if line_code:
+                jobs_q = jobs_q.where(Line.line_code == line_code)
+            # Narrow the jobs by the scan filters too, so a one-day or one-counter export over
+            # a long history doesn't read chunk after empty chunk before its first row. A job's
+            # scans are made after it opened and, once it is finished, before it closed.
+            if since:
+                jobs_q = jobs_q.where(or_(
+                    ScanJob.status.in_(['open', 'locked_recon', 'variance_approved']),
+                    ScanJob.closed_at.is_(None), ScanJob.closed_at >= since))
+            if until:
+                jobs_q = jobs_q.where(ScanJob.opened_at < until)
+            if counter:
+                jobs_q = jobs_q.where(
+                    select(Scan.id).where(Scan.job_id == ScanJob.id, Scan.counter_name == counter).exists())
+            jobs = {row.id: row for row in db.execute(jobs_q.order_by(ScanJob.id))}
+
+            if fmt == "csv":
+                header = io.StringIO()
+                csv.writer(header).writerow(EXPORT_COLUMNS)
+                yield header.getvalue()
+
+            job_ids = list(jobs)
+            for start in range(0, len(job_ids), EXPORT_CHUNK_JOBS):
+                # Scans of a few jobs at a time off idx_scan_job_recent, sorted per job only.
+                # Each chunk is read in full before any of it is sent, so a slow client
+                # never keeps a statement (and SQLite's read lock) open between chunks.
+                scans_q = (select(Scan.job_id, Scan.created_at, Scan.counter_name, Scan.sku,
+                                  Scan.serial_code, Scan.qty, Scan.source)
+                           .where(Scan.job_id.in_(job_ids[start:start + EXPORT_CHUNK_JOBS])))
+                if counter:
+                    scans_q = scans_q.where(Scan.counter_name == counter)
+                if since:
+                    scans_q = scans_q.where(Scan.created_at >= since)
+                if until:
+                    scans_q = scans_q.where(Scan.created_at < until)
+                scans = db.execute(scans_q.order_by(Scan.job_id, Scan.created_at, Scan.id)).all()
+                if not scans:
+                    continue
+
+                out = io.StringIO()
+                writer = csv.writer(out) if fmt == "csv" else None
+                for scan in scans:
+                    job = jobs[scan.job_id]
+                    row = [scan.created_at.strftime("%Y-%m-%d"), scan.created_at.strftime("%H:%M:%S"),
+                           job.location, job.warehouse, scan.counter_name, scan.sku or '',
+                           scan.serial_code, scan.qty, scan.source, job.line_code, scan.job_id, job.status]
+                    if writer:
+                        writer.writerow(row)
+                    else:
+                        out.write(dumps_ordered(dict(zip(EXPORT_COLUMNS, row))))
+                        out.write("\n")
+                yield out.getvalue()
+        finally:
+            db.close()
 
-        line_ids = [a.line_id for a in assignments]
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    resp = app.response_class(stream_with_context(generate()), mimetype=mimetype)
+    resp.headers["Content-Disposition"] = f"attachment; filename=export.{fmt}"
+    return _no_cache(resp)
+
+def _inbox_owner():
+    """tl_name_norm whose requests the signed-in TL sees, or None (every TL's) for managers"""
+    if session.get('is_manager'):
+        return None
+    return _norm((session.get(SESSION_TL_KEY) or {}).get("name", ""))
+
+def _tl_inbox(db, tl_norm):
+    """Pending reconciliation requests for one TL (None: all), newest first, with their line"""
+    q = (
+        select(ReconciliationRequest.id, ReconciliationRequest.job_id, ReconciliationRequest.line_id,
+               ReconciliationRequest.tl_name_norm, ReconciliationRequest.requested_by,
+               ReconciliationRequest.requested_qty, ReconciliationRequest.reason,
+               func.coalesce(ReconciliationRequest.target_qty, Line.target_qty).label("requested_target"),
+               ReconciliationRequest.created_at,
+               Line.line_code, Line.location, Line.warehouse, Line.target_qty)
+        .join(Line, Line.id == ReconciliationRequest.line_id)
+        .where(ReconciliationRequest.status == 'pending')
+        .order_by(ReconciliationRequest.created_at.desc())
+    )
+    if tl_norm is not None:
+        q = q.where(ReconciliationRequest.tl_name_norm == tl_norm)
+    return db.execute(q).all()
 
-        if not line_ids:
-            return jsonify({"ok": True, "requests": []})
+def _tl_inbox_count(db, tl_norm):
+    """Number of pending reconciliation requests for one TL (None: all)"""
+    q = select(func.count()).select_from(ReconciliationRequest).where(ReconciliationRequest.status == 'pending')
+    if tl_norm is not None:
+        q = q.where(ReconciliationRequest.tl_name_norm == tl_norm)
+    return db.execute(q).scalar()
 
-        # Get pending reconciliation requests for TL's lines
-        requests = db.query(ReconciliationQueue).filter(
-            ReconciliationQueue.line_id.in_(line_ids),
-            ReconciliationQueue.status == 'pending'
-        ).order_by(ReconciliationQueue.created_at.desc()).all()
+@app.route('/api/reconcile/tl_queue')
+def api_tl_reconcile_queue():
+    """Get pending reconciliation requests for TL"""
+    if not require_tl():
+        return jsonify({"ok": False, "reason": "unauthorized"}), 401
 
+    db = SessionLocal()
+    try:
         queue_data = []
-        for req in requests:
+        for req in _tl_inbox(db, _inbox_owner()):
             queue_data.append({
                 'id': req.id,
                 'job_id': req.job_id,
-                'line_code': req.line.line_code,
-                'location': req.line.location,
-                'warehouse': req.line.warehouse,
+                'line_code': req.line_code,
+                'location': req.location,
+                'warehouse': req.warehouse,
                 'requested_by': req.requested_by,
                 'reason': req.reason,
-                'scanned_total': req.scanned_total,
-                'target_qty': req.target_qty,
+                'scanned_total': req.requested_qty,
+                'target_qty': req.requested_target,
                 'created_at': req.created_at.strftime('%H:%M:%S')
             })
 
-        return jsonify({"ok": True, "requests": queue_data})
+        return jsonify({"ok": True, "requests": _rows(queue_data)})
 
     finally:
         db.close()
@@ -1262,29 +2363,9 @@ def api_reconcile_notification_count():
     if not require_tl():
         return jsonify({"ok": False, "reason": "unauthorized"}), 401
 
-    tl_session = session.get(SESSION_TL_KEY, {})
-    tl_name = tl_session.get("display_name", "")
-
     db = SessionLocal()
     try:
-        # Get TL's lines using case-insensitive comparison
-        assignments = db.query(Assignment).filter(
-            func.lower(Assignment.tl_name) == func.lower(tl_name),
-            Assignment.active == True
-        ).all()
-
-        line_ids = [a.line_id for a in assignments]
-
-        if not line_ids:
-            return jsonify({"ok": True, "count": 0})
-
-        # Count pending reconciliation requests for TL's lines
-        count = db.query(ReconciliationQueue).filter(
-            ReconciliationQueue.line_id.in_(line_ids),
-            ReconciliationQueue.status == 'pending'
-        ).count()
-
-        return jsonify({"ok": True, "count": count})
+        return jsonify({"ok": True, "count": _tl_inbox_count(db, _inbox_owner())})
 
     finally:
         db.close()
@@ -1294,12 +2375,7 @@ def api_reconcile_pending_count_all():
     """Get count of all pending reconciliation requests (no TL auth required)"""
     db = SessionLocal()
     try:
-        # Count all pending reconciliation requests
-        count = db.query(ReconciliationQueue).filter(
-            ReconciliationQueue.status == 'pending'
-        ).count()
-
-        return jsonify({"ok": True, "count": count})
+        return jsonify({"ok": True, "count": _tl_inbox_count(db, None)})
 
     finally:
         db.close()
@@ -1320,9 +2396,11 @@ def api_tl_respond_reconcile():
 
     db = SessionLocal()
     try:
-        queue_item = db.query(ReconciliationQueue).filter(ReconciliationQueue.id == queue_id).first()
+        queue_item = db.get(ReconciliationRequest, queue_id)
         if not queue_item:
             return jsonify({'error': 'Request not found'}), 404
+        if queue_item.status != 'pending':
+            return jsonify({'error': 'Request already resolved'}), 409
 
         tl_session = session.get(SESSION_TL_KEY, {})
         tl_name = tl_session.get("display_name", "TL")
@@ -1336,15 +2414,20 @@ def api_tl_respond_reconcile():
 
             queue_item.status = 'approved'
             queue_item.tl_response = f"Target updated from {old_target} to {new_target}. {note}"
+            queue_item.resolved_by = tl_name
             queue_item.resolved_at = abu_dhabi_now()
 
         elif action == 'approve_variance':
             # Approve variance - update job status
             job = queue_item.job
-            job.status = 'variance_approved'
+            failed = _transition_job(db, job, "approve_variance")
+            if failed:
+                db.rollback()
+                return _job_conflict(failed, job)
 
             queue_item.status = 'approved'
             queue_item.tl_response = f"Variance approved. {note}"
+            queue_item.resolved_by = tl_name
             queue_item.resolved_at = abu_dhabi_now()
 
         # Add reconciliation record
@@ -1352,7 +2435,7 @@ def api_tl_respond_reconcile():
             job_id=queue_item.job_id,
             requested_by=queue_item.requested_by,
             reason=queue_item.reason,
-            previous_target=queue_item.target_qty,
+            previous_target=old_target if action == 'edit_target' else queue_item.target_qty,
             new_target=new_target if action == 'edit_target' else queue_item.target_qty,
             result=action,
             approved_at=abu_dhabi_now(),
@@ -1362,6 +2445,7 @@ def api_tl_respond_reconcile():
         db.add(reconciliation)
 
         db.commit()
+        line_cache.invalidate(queue_item.line_id)
         return jsonify({'success': True})
 
     except Exception as e:
@@ -1380,11 +2464,11 @@ def api_check_reconcile_response():
     db = SessionLocal()
     try:
         # Check if there's a resolved request for this job that hasn't been acknowledged yet
-        resolved_request = db.query(ReconciliationQueue).filter(
-            ReconciliationQueue.job_id == job_id,
-            ReconciliationQueue.status == 'approved',
-            ReconciliationQueue.acknowledged == False
-        ).order_by(ReconciliationQueue.resolved_at.desc()).first()
+        resolved_request = db.query(ReconciliationRequest).filter(
+            ReconciliationRequest.job_id == job_id,
+            ReconciliationRequest.status == 'approved',
+            ReconciliationRequest.acknowledged == False
+        ).order_by(ReconciliationRequest.resolved_at.desc()).first()
 
         if resolved_request:
             return jsonify({
@@ -1411,14 +2495,15 @@ def api_reconcile_acknowledge():
     db = SessionLocal()
     try:
         # Find the resolved request and mark it as acknowledged
-        resolved_request = db.query(ReconciliationQueue).filter(
-            ReconciliationQueue.job_id == job_id,
-            ReconciliationQueue.status == 'approved',
-            ReconciliationQueue.acknowledged == False
-        ).first()
-
-        if resolved_request:
-            resolved_request.acknowledged = True
+        acknowledged = db.execute(
+            update(ReconciliationRequest)
+            .where(ReconciliationRequest.job_id == job_id,
+                   ReconciliationRequest.status == 'approved',
+                   ReconciliationRequest.acknowledged == False)
+            .values(acknowledged=True)
+        ).rowcount
+
+        if acknowledged:
             db.commit()
             return jsonify({'success': True, 'acknowledged': True})
         else:
@@ -1442,6 +2527,9 @@ def api_delete_log(job_index):
     # Verify passcode for historical log deletion
     if passcode != '240986':
         return jsonify({"error": "Invalid passcode"}), 403
+    archive = _wants_archive(data)
+    if archive is None:
+        return _bad_mode()
 
     db = SessionLocal()
     try:
@@ -1453,8 +2541,8 @@ def api_delete_log(job_index):
         # Get historical jobs from Excel
         historical_jobs = []
         try:
-            if os.path.exists(MDF_PATH):
-                df = pd.read_excel(MDF_PATH)
+            df = _mdf_frame()
+            if df is not None:
                 if not df.empty and len(df) > 0:
                     # Group by date, location, warehouse, and first counter name to identify unique jobs
                     historical_groups = df.groupby(['Date', 'Location', 'Warehouse', 'CounterName']).agg({
@@ -1516,83 +2604,40 @@ def api_delete_log(job_index):
         job_to_delete = all_jobs[job_index]
 
         if job_to_delete['type'] == 'database':
-            # Delete database job
+            # Delete (or archive) the job with its scans, reconciliations and queue items
             job = job_to_delete['job']
+            deleted_job_id = job.id
+            deleted_line_code = job.line.line_code
+            db.close()
 
-            # Delete related scans first
-            db.query(Scan).filter(Scan.job_id == job.id).delete()
-            # Delete related reconciliations
-            db.query(Reconciliation).filter(Reconciliation.job_id == job.id).delete()
-            # Delete related reconciliation queue items
-            db.query(ReconciliationQueue).filter(ReconciliationQueue.job_id == job.id).delete()
-            # Delete the job
-            db.delete(job)
+            _purge_jobs([deleted_job_id], archive=archive)
 
             # Add audit log
             tl_session = session.get(SESSION_TL_KEY, {})
-            audit = AuditLog(
-                actor=tl_session.get("display_name", "TL"),
-                action='LOG_DELETE',
-                entity='SCANJOB',
-                entity_id=job.id,
-                payload_json=json.dumps({"line_code": job.line.line_code, "type": "database"})
-            )
-            db.add(audit)
-            db.commit()
+            record_audit(tl_session.get("display_name", "TL"), 'LOG_DELETE', 'SCANJOB', deleted_job_id,
+                         {"line_code": deleted_line_code, "type": "database", "archived": archive})
 
         elif job_to_delete['type'] == 'historical':
             # Delete historical job from Excel
             hist_job = job_to_delete['job']
 
-            with FileLock(LOCK_PATH, timeout=10):
-                df = pd.read_excel(MDF_PATH)
-
-                # Remove rows matching this historical job
-                mask = (
-                    (df['Date'].astype(str) == hist_job['date']) &
-                    (df['Location'] == hist_job['location']) &
-                    (df['Warehouse'] == hist_job['warehouse']) &
-                    (df['CounterName'] == hist_job['counter'])
-                )
-
-                df_filtered = df[~mask]
-
-                # Save back to Excel
-                from openpyxl import Workbook
-                wb = Workbook()
-                ws = wb.active
-                ws.title = "Sheet1"
-
-                # Add headers
-                ws.append(COLUMNS)
-
-                # Add remaining data
-                for _, row in df_filtered.iterrows():
-                    ws.append([
-                        row['Date'], row['Time'], row['Location'], row['Warehouse'],
-                        row['CounterName'], row['SKU'], row['SerialOrCode'],
-                        row['QTY'], row['Source']
-                    ])
-
-                wb.save(MDF_PATH)
-                wb.close()
+            # Remove rows matching this historical job; only its warehouse's file is rewritten
+            mdf_store.rewrite(hist_job['location'], hist_job['warehouse'], lambda row: not (
+                str(row[0]) == hist_job['date'] and
+                row[2] == hist_job['location'] and
+                row[3] == hist_job['warehouse'] and
+                row[4] == hist_job['counter']
+            ))
 
             # Add audit log
             tl_session = session.get(SESSION_TL_KEY, {})
-            audit = AuditLog(
-                actor=tl_session.get("display_name", "TL"),
-                action='HISTORICAL_LOG_DELETE',
-                entity='EXCEL',
-                payload_json=json.dumps({
-                    "date": hist_job['date'],
-                    "location": hist_job['location'],
-                    "warehouse": hist_job['warehouse'],
-                    "counter": hist_job['counter'],
-                    "type": "historical"
-                })
-            )
-            db.add(audit)
-            db.commit()
+            record_audit(tl_session.get("display_name", "TL"), 'HISTORICAL_LOG_DELETE', 'EXCEL', payload={
+                "date": hist_job['date'],
+                "location": hist_job['location'],
+                "warehouse": hist_job['warehouse'],
+                "counter": hist_job['counter'],
+                "type": "historical"
+            })
 
         return jsonify({"success": True})
 
@@ -1618,8 +2663,15 @@ def api_job_reset():
         if not job:
             return jsonify({"ok": False, "reason": "not_found"}), 404
 
-        job.status = "open"
-        db.add(job)
+        try:
+            failed = _transition_job(db, job, "reset")
+        except IntegrityError:
+            # Reopening a submitted job while its line already has a newer unfinished one
+            db.rollback()
+            return _job_conflict("line_has_open_job", job)
+        if failed:
+            db.rollback()
+            return _job_conflict(failed, job)
         db.commit()
 
         return jsonify({"ok": True})
@@ -1657,17 +2709,21 @@ def api_lines_inline_reconcile():
         line.updated_at = abu_dhabi_now()
 
         # Unlock job and allow submit
-        job.status = "variance_approved"
+        failed = _transition_job(db, job, "approve_variance")
+        if failed:
+            db.rollback()
+            return _job_conflict(failed, job)
         req.status = "approved"
+        req.tl_response = f"Target set to {tgt}."
         req.resolved_at = abu_dhabi_now()
 
         tl_session = session.get(SESSION_TL_KEY, {})
         req.resolved_by = tl_session.get("display_name", "TL")
 
         db.add(line)
-        db.add(job)
         db.add(req)
         db.commit()
+        line_cache.invalidate(line.id)
 
         return jsonify({"ok": True, "target_qty": tgt, "job_status": job.status})
 
@@ -1709,39 +2765,20 @@ def api_line_reset():
             if line.created_by_tl_norm != tl_norm:
                 return jsonify({'error': 'You can only reset lines you created'}), 403
 
-        # Check if there's already an open job
-        open_job = db.query(ScanJob).filter(
-            ScanJob.line_id == line.id,
-            ScanJob.status == 'open'
-        ).first()
-
-        if open_job:
+        # Create new open job, unless one is still running
+        _, created = _start_job(db, line.id, opened_by=display_name)
+        if not created:
+            db.rollback()
             return jsonify({'error': 'Line already has an open job'}), 400
 
-        # Create new open job
-        new_job = ScanJob(
-            line_id=line.id,
-            status='open',
-            opened_at=abu_dhabi_now(),
-            opened_by=display_name
-        )
-        db.add(new_job)
+        db.commit()
 
         # Add audit log
-        audit = AuditLog(
-            actor=display_name,
-            action='LINE_RESET',
-            entity='LINE',
-            entity_id=line.id,
-            payload_json=json.dumps({
-                'location': line.location,
-                'warehouse': line.warehouse,
-                'line_code': line.line_code
-            })
-        )
-        db.add(audit)
-
-        db.commit()
+        record_audit(display_name, 'LINE_RESET', 'LINE', line.id, {
+            'location': line.location,
+            'warehouse': line.warehouse,
+            'line_code': line.line_code
+        })
         return jsonify({'ok': True, 'message': 'Line reset successfully. Counters can now start counting again.'})
 
     except Exception as e:
@@ -1789,7 +2826,7 @@ def api_counter_jobs():
                     "status": job.status
                 })
 
-        return jsonify({"ok": True, "items": items})
+        return jsonify({"ok": True, "items": _rows(items)})
 
     finally:
         db.close()
@@ -1800,31 +2837,23 @@ def api_reconcile_inbox():
     if not _require_tl():
         return jsonify({"ok": False, "reason": "unauthorized"}), 401
 
-    _, tl_norm = _session_user()
-
     db = SessionLocal()
     try:
-        # Get pending reconciliation requests for this TL
-        requests = db.query(ReconciliationRequest).filter(
-            ReconciliationRequest.tl_name_norm == tl_norm,
-            ReconciliationRequest.status == 'pending'
-        ).order_by(ReconciliationRequest.created_at.desc()).all()
-
         inbox_data = []
-        for req in requests:
+        for req in _tl_inbox(db, _inbox_owner()):
             inbox_data.append({
                 'request_id': req.id,
                 'job_id': req.job_id,
-                'line_code': req.line.line_code,
-                'location': req.line.location,
-                'warehouse': req.line.warehouse,
+                'line_code': req.line_code,
+                'location': req.location,
+                'warehouse': req.warehouse,
                 'requested_by': req.requested_by,
                 'requested_qty': req.requested_qty,
-                'target_qty': req.line.target_qty,
+                'target_qty': req.target_qty,
                 'created_at': req.created_at.strftime('%H:%M:%S')
             })
 
-        return jsonify({"ok": True, "requests": inbox_data})
+        return jsonify({"ok": True, "requests": _rows(inbox_data)})
 
     finally:
         db.close()
@@ -1858,17 +2887,21 @@ def api_reconcile_resolve():
             line.target_qty = req.requested_qty
 
         # Unlock job and allow submit
-        job.status = "variance_approved"
+        failed = _transition_job(db, job, "approve_variance")
+        if failed:
+            db.rollback()
+            return _job_conflict(failed, job)
         req.status = "approved"
+        req.tl_response = f"Target set to {line.target_qty}." if action == "edit_target" else "Variance approved."
         req.resolved_at = abu_dhabi_now()
 
         display_name, _ = _session_user()
         req.resolved_by = display_name
 
-        db.add(job)
         db.add(line)
         db.add(req)
         db.commit()
+        line_cache.invalidate(line.id)
 
         return jsonify({"ok": True, "target_qty": int(line.target_qty)})
 
@@ -1901,11 +2934,11 @@ def api_reconcile_line_requests():
                 'id': req.id,
                 'requested_by': req.requested_by,
                 'requested_qty': req.requested_qty,
-                'created_at': req.created_at.isoformat(),
+                'created_at': req.created_at,
                 'job_id': req.job_id
             })
 
-        return jsonify({"ok": True, "requests": request_data})
+        return jsonify({"ok": True, "requests": _rows(request_data)})
 
     finally:
         db.close()
@@ -1927,13 +2960,17 @@ def api_lines_manage():
             (Assignment.line_id == Line.id) & (Assignment.active == True)
         ).all()
 
+        line_ids = [line.id for line, _ in lines_with_assignments]
+        jobs_by_line = _line_jobs(db, line_ids)
+        pending_lines = set(db.scalars(
+            select(ReconciliationRequest.line_id)
+            .where(ReconciliationRequest.line_id.in_(line_ids), ReconciliationRequest.status == 'pending')
+        )) if line_ids else set()
+
         lines_data = []
         for line, assignment in lines_with_assignments:
             # Check current job status
-            current_job = db.query(ScanJob).filter(
-                ScanJob.line_id == line.id,
-                ScanJob.status.in_(['open', 'locked_recon', 'variance_approved'])
-            ).first()
+            current_job = jobs_by_line[line.id][0]
 
             if current_job:
                 job_status = current_job.status
@@ -1944,10 +2981,7 @@ def api_lines_manage():
             can_edit = is_manager or (line.created_by_tl_norm == tl_norm)
 
             # Check for pending reconciliation requests
-            pending_reconciliation = db.query(ReconciliationRequest).filter(
-                ReconciliationRequest.line_id == line.id,
-                ReconciliationRequest.status == 'pending'
-            ).first() is not None
+            pending_reconciliation = line.id in pending_lines
 
             line_data = {
                 'id': line.id,
@@ -1965,7 +2999,7 @@ def api_lines_manage():
             }
             lines_data.append(line_data)
 
-        return jsonify({'ok': True, 'lines': lines_data, 'current_tl': display_name, 'is_manager': is_manager})
+        return jsonify({'ok': True, 'lines': _rows(lines_data), 'current_tl': display_name, 'is_manager': is_manager})
 
     finally:
         db.close()
@@ -1985,6 +3019,9 @@ def api_line_delete():
 
     if not all([location, warehouse, line_code]):
         return jsonify({'error': 'Missing required fields'}), 400
+    archive = _wants_archive(data)
+    if archive is None:
+        return _bad_mode()
 
     # Check TL session
     tl_session = session.get(SESSION_TL_KEY)
@@ -2039,41 +3076,33 @@ def api_line_delete():
             if _norm(current_tl_name) != _norm(assignment.tl_name):
                 return jsonify({'error': 'You can only delete lines you created'}), 403
 
-        # Delete related data in correct order
-        # Delete scans first
-        jobs = db.query(ScanJob).filter(ScanJob.line_id == line.id).all()
-        for job in jobs:
-            db.query(Scan).filter(Scan.job_id == job.id).delete()
-            db.query(Reconciliation).filter(Reconciliation.job_id == job.id).delete()
-            db.query(ReconciliationQueue).filter(ReconciliationQueue.job_id == job.id).delete()
-
-        # Delete jobs
-        db.query(ScanJob).filter(ScanJob.line_id == line.id).delete()
+        deleted_line_id = line.id
+        original_tl = assignment.tl_name
+        job_ids = [job_id for (job_id,) in db.query(ScanJob.id).filter(ScanJob.line_id == line.id).all()]
+        db.close()
 
-        # Delete assignments
-        db.query(Assignment).filter(Assignment.line_id == line.id).delete()
+        def _drop_line(conn, archived_at):
+            # Assignments and the line itself go in the same transaction as the last job chunk
+            if archive:
+                _archive_copy(conn, Assignment.__table__, "line_id = ?", (deleted_line_id,), archived_at)
+                _archive_copy(conn, Line.__table__, "id = ? AND id NOT IN (SELECT id FROM archive.lines)",
+                              (deleted_line_id,), archived_at)
+            conn.execute(delete(Assignment).where(Assignment.line_id == deleted_line_id))
+            conn.execute(delete(Line).where(Line.id == deleted_line_id))
 
-        # Delete the line
-        db.delete(line)
+        _purge_jobs(job_ids, archive=archive, extra=_drop_line)
+        line_cache.invalidate(deleted_line_id)
 
         # Audit log
         actor_name = session.get(SESSION_TL_KEY, {}).get('display_name', 'Unknown')
-        audit = AuditLog(
-            actor=actor_name,
-            action='LINE_DELETE',
-            entity='LINE',
-            entity_id=line.id,
-            payload_json=json.dumps({
-                'location': location,
-                'warehouse': warehouse,
-                'line_code': line_code,
-                'deleted_by': 'manager' if (is_manager or is_manager_delete) else 'tl',
-                'original_tl': assignment.tl_name
-            })
-        )
-        db.add(audit)
-
-        db.commit()
+        record_audit(actor_name, 'LINE_DELETE', 'LINE', deleted_line_id, {
+            'location': location,
+            'warehouse': warehouse,
+            'line_code': line_code,
+            'deleted_by': 'manager' if (is_manager or is_manager_delete) else 'tl',
+            'original_tl': original_tl,
+            'archived': archive
+        })
         return jsonify({'ok': True})
 
     except Exception as e:
@@ -2089,39 +3118,16 @@ def api_create_fresh_mdf():
         return jsonify({"error": "TL authentication required"}), 401
 
     try:
-        # Backup existing MDF if it exists
-        backup_name = None
-        if os.path.exists(MDF_PATH):
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            backup_name = f"MDF_backup_{timestamp}.xlsx"
-            backup_path = os.path.join(EXPORTS_DIR, backup_name)
-
-            # Copy the existing file as backup
-            import shutil
-            shutil.copy2(MDF_PATH, backup_path)
-
-        # Create fresh MDF with just headers
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Sheet1"
-        ws.append(COLUMNS)
-        wb.save(MDF_PATH)
+        # Fresh MDF: no rows in any warehouse; existing rows (all warehouses, merged) go to a backup
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        backup_name = f"MDF_backup_{timestamp}.xlsx"
+        if not mdf_store.drain(os.path.join(EXPORTS_DIR, backup_name)):
+            backup_name = None
 
         # Add audit log
         tl_session = session.get(SESSION_TL_KEY, {})
-        audit = AuditLog(
-            actor=tl_session.get("display_name", "TL"),
-            action='FRESH_MDF_CREATED',
-            entity='MDF',
-            payload_json=json.dumps({"backup_created": backup_name})
-        )
-
-        db = SessionLocal()
-        try:
-            db.add(audit)
-            db.commit()
-        finally:
-            db.close()
+        record_audit(tl_session.get("display_name", "TL"), 'FRESH_MDF_CREATED', 'MDF',
+                     payload={"backup_created": backup_name})
 
         return jsonify({
             "success": True,
@@ -2144,44 +3150,33 @@ def api_delete_all_logs():
     # Verify passcode
     if passcode != '240986':
         return jsonify({"error": "Invalid passcode"}), 403
+    archive = _wants_archive(data)
+    if archive is None:
+        return _bad_mode()
 
     db = SessionLocal()
     try:
         # Get all completed jobs from database
-        jobs = db.query(ScanJob).filter(
+        job_ids = [job_id for (job_id,) in db.query(ScanJob.id).filter(
             ScanJob.status.in_(['submitted', 'variance_approved'])
-        ).all()
+        ).all()]
+        db.close()
 
-        job_count = len(jobs)
+        # Delete (or archive) them chunk by chunk so counters aren't blocked
+        job_count = _purge_jobs(job_ids, archive=archive)
 
-        # Delete all database jobs
-        for job in jobs:
-            db.query(Scan).filter(Scan.job_id == job.id).delete()
-            db.query(Reconciliation).filter(Reconciliation.job_id == job.id).delete()
-            db.query(ReconciliationQueue).filter(ReconciliationQueue.job_id == job.id).delete()
-            db.delete(job)
-
-        # Create fresh Excel file (removes all historical data)
-        with FileLock(LOCK_PATH, timeout=10):
-            from openpyxl import Workbook
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Sheet1"
-            ws.append(COLUMNS)  # Only headers, no data
-            wb.save(MDF_PATH)
-            wb.close()
+        # Empty every warehouse's MDF (removes all historical data)
+        if archive:
+            os.makedirs(ARCHIVE_DIR, exist_ok=True)
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            mdf_store.drain(os.path.join(ARCHIVE_DIR, f"MDF_{timestamp}.xlsx"))
+        else:
+            mdf_store.drain()
 
         # Add audit log
         tl_session = session.get(SESSION_TL_KEY, {})
-        audit = AuditLog(
-            actor=tl_session.get("display_name", "TL"),
-            action='ALL_LOGS_DELETE',
-            entity='SCANJOB',
-            payload_json=json.dumps({"deleted_count": job_count, "historical_deleted": True})
-        )
-        db.add(audit)
-
-        db.commit()
+        record_audit(tl_session.get("display_name", "TL"), 'ALL_LOGS_DELETE', 'SCANJOB',
+                     payload={"deleted_count": job_count, "historical_deleted": True, "archived": archive})
         return jsonify({"success": True, "deleted_count": job_count})
 
     except Exception as e:
@@ -2192,7 +3187,8 @@ def api_delete_all_logs():
 
 @app.route('/line-management')
 def line_management():
-    return render_template('line_management.html')
+    locations, warehouses = get_reference_data()
+    return render_template('line_management.html', locations=locations, warehouses=warehouses)
 
 @app.route('/api/line-management/all')
 def api_line_management_all():
@@ -2213,30 +3209,21 @@ def api_line_management_all():
             (Assignment.line_id == Line.id) & (Assignment.active == True)
         ).all()
 
-        # Get pending requests for this TL or all if manager
-        my_reqs = db.query(ReconciliationRequest).filter(
-            ReconciliationRequest.status == 'pending'
-        ).all()
-        
-        # Map line_id -> req for this TL identity
+        # Pending requests in this TL's inbox (all if manager), line_id -> requests
         req_by_line = {}
-        for r in my_reqs:
-            if is_manager or (r.tl_name_norm == tl_norm):
-                req_by_line.setdefault(r.line_id, []).append(r)
+        for r in _tl_inbox(db, _inbox_owner()):
+            req_by_line.setdefault(r.line_id, []).append(r)
+
+        jobs_by_line = _line_jobs(db, [line.id for line, _ in lines_with_assignments])
 
         lines_data = []
         for line, assignment in lines_with_assignments:
+            statuses = jobs_by_line[line.id][1]
             # Check if line has completed jobs
-            completed_jobs = db.query(ScanJob).filter(
-                ScanJob.line_id == line.id,
-                ScanJob.status.in_(['submitted', 'variance_approved'])
-            ).count()
+            completed_jobs = statuses['submitted'] + statuses['variance_approved']
 
             # Check if line has open jobs
-            open_jobs = db.query(ScanJob).filter(
-                ScanJob.line_id == line.id,
-                ScanJob.status == 'open'
-            ).count()
+            open_jobs = statuses['open']
 
             # Determine status
             if completed_jobs > 0 and open_jobs == 0:
@@ -2282,7 +3269,7 @@ def api_line_management_all():
             }
             lines_data.append(line_data)
 
-        return jsonify({'ok': True, 'lines': lines_data, 'current_tl': tl_name, 'is_manager': is_manager})
+        return jsonify({'ok': True, 'lines': _rows(lines_data), 'current_tl': tl_name, 'is_manager': is_manager})
 
     finally:
         db.close()
@@ -2292,6 +3279,7 @@ def insights():
     return render_template('insights.html')
 
 @app.route('/api/counter/assignments')
+@coalesced(lambda: request.args.get('counter_name', '').strip().lower())
 def api_counter_assignments():
     """Get assignments for a specific counter"""
     counter_name = request.args.get('counter_name', '').strip()
@@ -2314,7 +3302,8 @@ def api_counter_assignments():
 
         counter_assignments = []
         counter_name_lower = counter_name.lower().strip()
-        
+        jobs_by_line = _line_jobs(db, [line.id for _, line in assignments])
+
         for assignment, line in assignments:
             print(f"DEBUG ASSIGNMENTS: Checking assignment - Line {line.line_code} at {line.location}/{line.warehouse}")
             print(f"DEBUG ASSIGNMENTS: Counter1: '{assignment.counter_name_1}', Counter2: '{assignment.counter_name_2}'")
@@ -2329,17 +3318,9 @@ def api_counter_assignments():
                 
             print(f"DEBUG ASSIGNMENTS: ✅ Counter '{counter_name}' IS assigned to line {line.line_code}")
             
-            # Check if there's an active job for this line
-            current_job = db.query(ScanJob).filter(
-                ScanJob.line_id == line.id,
-                ScanJob.status.in_(['open', 'locked_recon', 'variance_approved'])
-            ).first()
-            
-            # Also check for completed jobs
-            completed_jobs = db.query(ScanJob).filter(
-                ScanJob.line_id == line.id,
-                ScanJob.status == 'submitted'
-            ).count()
+            # Check if there's an active job for this line, and for completed jobs
+            current_job, statuses = jobs_by_line[line.id]
+            completed_jobs = statuses['submitted']
             
             if current_job:
                 print(f"DEBUG ASSIGNMENTS: Active job found for line {line.line_code} with status: {current_job.status}")
@@ -2375,7 +3356,7 @@ def api_counter_assignments():
         
         return jsonify({
             "ok": True,
-            "assignments": counter_assignments
+            "assignments": _rows(counter_assignments)
         })
 
     finally:
@@ -2398,7 +3379,8 @@ def api_insights_dashboard():
 
         # Get location data
         location_data = []
-        for location in LOCATIONS:
+        locations, _ = get_reference_data()
+        for location in locations:
             lines_count = db.query(Line).filter(Line.location == location).count()
             active_jobs_count = db.query(ScanJob).join(Line).filter(
                 Line.location == location,
@@ -2425,6 +3407,10 @@ def api_insights_dashboard():
         # Get TL performance
         tl_performance = []
         assignments = db.query(Assignment).filter(Assignment.active == True).all()
+        jobs_by_line = defaultdict(list)
+        for job in db.query(ScanJob).filter(ScanJob.line_id.in_([a.line_id for a in assignments])):
+            jobs_by_line[job.line_id].append(job)
+        totals = _job_scan_totals(db, [job.id for jobs in jobs_by_line.values() for job in jobs])
         tl_stats = {}
 
         for assignment in assignments:
@@ -2441,16 +3427,14 @@ def api_insights_dashboard():
             tl_stats[tl_name]['linesManaged'] += 1
 
             # Get jobs for this line
-            line_jobs = db.query(ScanJob).filter(ScanJob.line_id == assignment.line_id).all()
-            for job in line_jobs:
+            for job in jobs_by_line[assignment.line_id]:
                 if job.status == 'open':
                     tl_stats[tl_name]['activeJobs'] += 1
                 elif job.status in ['submitted', 'variance_approved']:
                     tl_stats[tl_name]['completedJobs'] += 1
 
                 # Get scans for this job
-                job_scans = db.query(func.sum(Scan.qty)).filter(Scan.job_id == job.id).scalar() or 0
-                tl_stats[tl_name]['totalScans'] += job_scans
+                tl_stats[tl_name]['totalScans'] += totals.get(job.id, (0, 0))[1]
 
         tl_performance = list(tl_stats.values())
 
@@ -2459,16 +3443,15 @@ def api_insights_dashboard():
         lines_with_jobs = db.query(Line, ScanJob).join(ScanJob).filter(
             ScanJob.status == 'open'
         ).all()
+        line_assignments = _active_assignments(db, [line.id for line, _ in lines_with_jobs])
+        open_totals = _job_scan_totals(db, [job.id for _, job in lines_with_jobs])
 
         for line, job in lines_with_jobs:
             # Get assignment
-            assignment = db.query(Assignment).filter(
-                Assignment.line_id == line.id,
-                Assignment.active == True
-            ).first()
+            assignment = line_assignments.get(line.id)
 
             # Get scanned count
-            scanned = db.query(func.sum(Scan.qty)).filter(Scan.job_id == job.id).scalar() or 0
+            scanned = open_totals.get(job.id, (0, 0))[1]
 
             assigned_counters = []
             if assignment:
@@ -2504,6 +3487,238 @@ def api_insights_dashboard():
     finally:
         db.close()
 
+@app.route('/api/periods/close', methods=['POST'])
+def api_close_period():
+    """Close the current count period: move its submitted jobs, scans and audit trail to an archive file"""
+    if not require_tl():
+        return jsonify({"ok": False, "reason": "unauthorized"}), 401
+
+    data = request.get_json(force=True) or {}
+    if (data.get("passcode") or "") != '240986':
+        return jsonify({"ok": False, "reason": "bad_passcode"}), 403
+    name = (data.get("name") or "").strip() or abu_dhabi_now().strftime("Count %Y-%m-%d")
+
+    db = SessionLocal()
+    try:
+        job_ids = [job_id for (job_id,) in db.query(ScanJob.id).filter(ScanJob.status == 'submitted').all()]
+        if not job_ids:
+            return jsonify({"ok": False, "reason": "nothing_to_archive"}), 400
+
+        scan_count = db.query(func.count(Scan.id)).filter(Scan.job_id.in_(job_ids)).scalar() or 0
+        previous = db.query(CountPeriod).order_by(CountPeriod.id.desc()).first()
+        started_at = previous.closed_at if previous else db.query(func.min(ScanJob.opened_at)).filter(ScanJob.id.in_(job_ids)).scalar()
+
+        display_name, _ = _session_user()
+        period = CountPeriod(name=name, started_at=started_at, closed_by=display_name, archive_path="")
+        db.add(period)
+        db.flush()
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", name).strip("_").lower() or "period"
+        period.archive_path = os.path.join(ARCHIVE_DIR, f"period_{period.id}_{slug}.db")
+        period.job_count = len(job_ids)
+        period.scan_count = int(scan_count)
+        db.commit()
+        period_id, archive_path = period.id, period.archive_path
+    finally:
+        db.close()
+
+    # Audit rows up to the close travel with the period
+    audit_buffer.flush()
+
+    def _move_audit(conn, archived_at):
+        _archive_copy(conn, AuditLog.__table__, "created_at < ?", (archived_at,), archived_at)
+        conn.exec_driver_sql("DELETE FROM main.audit_log WHERE created_at < ?", (archived_at,))
+
+    try:
+        _purge_jobs(job_ids, archive=True, extra=_move_audit, archive_path=archive_path)
+    except Exception:
+        # The move runs in chunks. If none reached the archive, the period is dropped;
+        # otherwise it stays (it is the only way to reach those rows) with what it holds.
+        try:
+            moved = query_history("SELECT (SELECT COUNT(*) FROM scan_jobs) AS job_count, "
+                                  "(SELECT COUNT(*) FROM scans) AS scan_count", periods=[period_id])
+        except Exception:
+            moved = []
+        db = SessionLocal()
+        try:
+            period = db.get(CountPeriod, period_id)
+            if moved and moved[0]["job_count"]:
+                period.job_count = moved[0]["job_count"]
+                period.scan_count = moved[0]["scan_count"]
+            else:
+                db.delete(period)
+                period_id = None
+            db.commit()
+        finally:
+            db.close()
+        return jsonify({"ok": False, "reason": "archive_failed", "period_id": period_id}), 500
+
+    record_audit(display_name, 'PERIOD_CLOSED', 'PERIOD', period_id,
+                 {"name": name, "job_count": len(job_ids), "scan_count": int(scan_count)})
+    return jsonify({"ok": True, "period_id": period_id, "job_count": len(job_ids), "scan_count": int(scan_count)})
+
+@app.route('/api/periods')
+def api_periods():
+    """List closed count periods"""
+    if not require_tl():
+        return jsonify({"ok": False, "reason": "unauthorized"}), 401
+
+    db = SessionLocal()
+    try:
+        periods = db.query(CountPeriod).order_by(CountPeriod.id.desc()).all()
+        return jsonify({"ok": True, "periods": [{
+            'id': p.id,
+            'name': p.name,
+            'started_at': p.started_at,
+            'closed_at': p.closed_at,
+            'closed_by': p.closed_by,
+            'job_count': p.job_count,
+            'scan_count': p.scan_count
+        } for p in periods]})
+    finally:
+        db.close()
+
+def _periods_arg(default):
+    """?period=live|all|<id>[,<id>] as query_history's periods argument, or None if malformed"""
+    period_arg = (request.args.get("period") or default).strip().lower()
+    if period_arg in ("live", "all"):
+        return period_arg
+    try:
+        return [p if p == "live" else int(p) for p in period_arg.split(",") if p]
+    except ValueError:
+        return None
+
+@app.route('/api/history/jobs')
+def api_history_jobs():
+    """Completed job totals from the live DB and/or archived periods (?period=live|all|<id>[,<id>])"""
+    if not require_tl():
+        return jsonify({"ok": False, "reason": "unauthorized"}), 401
+
+    periods = _periods_arg("live")
+    if periods is None:
+        return jsonify({"ok": False, "reason": "bad_period"}), 400
+
+    rows = query_history(
+        "SELECT j.id AS job_id, l.location, l.warehouse, l.line_code, j.status, j.closed_at, "
+        "COUNT(s.id) AS total_scans, COALESCE(SUM(s.qty), 0) AS total_qty "
+        "FROM scan_jobs j JOIN lines l ON l.id = j.line_id "
+        "LEFT JOIN scans s ON s.job_id = j.id "
+        "WHERE j.status IN ('submitted', 'variance_approved') "
+        "AND (:location = '' OR l.location = :location) "
+        "AND (:warehouse = '' OR l.warehouse = :warehouse) "
+        "GROUP BY j.id, l.id ORDER BY j.closed_at DESC",
+        {"location": (request.args.get("location") or "").strip(),
+         "warehouse": (request.args.get("warehouse") or "").strip()},
+        periods=periods
+    )
+    for row in rows:
+        row["closed_at"] = str(row["closed_at"]) if row["closed_at"] is not None else None
+        row["total_qty"] = int(row["total_qty"] or 0)
+
+    return jsonify({"ok": True, "jobs": _rows(rows)})
+
+# Audit sources in sort order: archives by period id, then the live DB
+_AUDIT_LIVE_RANK = 2 ** 62
+
+def _audit_rank(period_id):
+    return _AUDIT_LIVE_RANK if period_id is None else period_id
+
+@app.route('/api/audit')
+def api_audit_query():
+    """Query the audit trail by entity, actor and time range (newest first)"""
+    if not require_tl():
+        return jsonify({"ok": False, "reason": "unauthorized"}), 401
+
+    entity = (request.args.get("entity") or "").strip().upper()
+    entity_id = request.args.get("entity_id", type=int)
+    actor = (request.args.get("actor") or "").strip()
+    limit = min(max(request.args.get("limit", 100, type=int), 1), 1000)
+
+    try:
+        since = to_local_naive(datetime.fromisoformat(request.args["since"])) if request.args.get("since") else None
+        until = to_local_naive(datetime.fromisoformat(request.args["until"])) if request.args.get("until") else None
+    except ValueError:
+        return jsonify({"ok": False, "reason": "bad_date"}), 400
+
+    # Keyset paging on the sort order itself: pass back the previous page's "next" cursor.
+    # Ids repeat across the live DB and period archives, so the cursor names its source too.
+    before_id = request.args.get("before_id", type=int)
+    before_period = (request.args.get("before_period") or "").strip().lower() or None
+    try:
+        before_ts = to_local_naive(datetime.fromisoformat(request.args["before_ts"])) if request.args.get("before_ts") else None
+        before_rank = None if before_period is None else _AUDIT_LIVE_RANK if before_period == "live" else int(before_period)
+    except ValueError:
+        return jsonify({"ok": False, "reason": "bad_cursor"}), 400
+    if len({before_id is None, before_ts is None, before_period is None}) > 1:
+        return jsonify({"ok": False, "reason": "bad_cursor"}), 400
+
+    # Entries moved out by a period close are still part of the trail (?period, default all)
+    periods = _periods_arg("all")
+    if periods is None:
+        return jsonify({"ok": False, "reason": "bad_period"}), 400
+
+    # Make entries still sitting in the buffer visible
+    audit_buffer.flush()
+
+    where, params = [], {"limit": limit + 1}  # one extra row tells whether a next page exists
+    if entity:
+        where.append("entity = :entity")
+        params["entity"] = entity
+        if entity_id is not None:
+            where.append("entity_id = :entity_id")
+            params["entity_id"] = entity_id
+    if actor:
+        where.append("actor = :actor")
+        params["actor"] = actor
+    if since:
+        where.append("created_at >= :since")
+        params["since"] = since.strftime("%Y-%m-%d %H:%M:%S.%f")
+    if until:
+        where.append("created_at < :until")
+        params["until"] = until.strftime("%Y-%m-%d %H:%M:%S.%f")
+    if before_ts:
+        where.append(
+            "(created_at < :before_ts OR (created_at = :before_ts AND ("
+            "COALESCE(:period_id, :live_rank) < :before_rank OR "
+            "(COALESCE(:period_id, :live_rank) = :before_rank AND id < :before_id))))"
+        )
+        params.update(before_ts=before_ts.strftime("%Y-%m-%d %H:%M:%S.%f"), before_id=before_id,
+                      before_rank=before_rank, live_rank=_AUDIT_LIVE_RANK)
+
+    # Newest rows of each source, then the newest `limit` overall
+    rows = query_history(
+        "SELECT id, actor, action, entity, entity_id, payload_json, created_at FROM audit_log "
+        + ("WHERE " + " AND ".join(where) + " " if where else "")
+        + "ORDER BY created_at DESC, id DESC LIMIT :limit",
+        params, periods=periods
+    )
+    rows.sort(key=lambda r: (r["created_at"], _audit_rank(r["period_id"]), r["id"]), reverse=True)
+
+    entries = []
+    for row in rows[:limit]:
+        entries.append({
+            'id': row['id'],
+            'actor': row['actor'],
+            'action': row['action'],
+            'entity': row['entity'],
+            'entity_id': row['entity_id'],
+            'payload': json.loads(row['payload_json']) if row['payload_json'] else None,
+            'created_at': datetime.fromisoformat(row['created_at']),
+            'period_id': row['period_id']
+        })
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = entries[-1]
+        next_cursor = {"before_ts": last["created_at"], "before_period": last["period_id"] or "live",
+                       "before_id": last["id"]}
+    return jsonify({"ok": True, "entries": _rows(entries), "next": next_cursor})
+
+@app.route('/api/locations')
+def api_locations():
+    """Locations and their warehouses from the reference tables"""
+    locations, warehouses = get_reference_data()
+    return jsonify({'ok': True, 'locations': locations, 'warehouses': warehouses})
+
 @app.route('/health')
 def health():
     return jsonify({'ok': True})
@@ -0,0 +1,85 @@
+"""
+Buffered audit trail writer.
+
+Route handlers call AuditBuffer.record() after their own commit; entries are
+queued in memory and written by a background thread in one multi-row INSERT per
+batch, so audit rows never ride along in (or lengthen) the request transaction.
+Sensitive fields (PINs, passcodes) are redacted before anything is queued.
+"""
+import atexit
+import json
+import threading
+
+from worker_thread import WorkerThreadMixin
+
+SENSITIVE_KEYS = {"pin", "tl_pin", "pin_hash", "tl_pin_hash", "passcode", "password", "secret"}
+REDACTED = "***"
+
+
+def redact(payload):
+    """Return a copy of payload with sensitive keys masked (recursively)"""
+    if isinstance(payload, dict):
+        return {
+            k: (REDACTED if str(k).lower() in SENSITIVE_KEYS else redact(v))
+            for k, v in payload.items()
+        }
+    if isinstance(payload, (list, tuple)):
+        return [redact(v) for v in payload]
+    return payload
+
+
+class AuditBuffer(WorkerThreadMixin):
+    thread_name = "audit-writer"
+
+    def __init__(self, engine, table, clock, flush_interval=0.5, max_batch=200):
+        self.engine = engine
+        self.table = table
+        self.clock = clock
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        atexit.register(self.flush)
+
+    def record(self, actor, action, entity, entity_id=None, payload=None):
+        """Queue one audit entry; returns immediately"""
+        row = {
+            "actor": actor or "Unknown",
+            "action": action,
+            "entity": entity,
+            "entity_id": entity_id,
+            "payload_json": json.dumps(redact(payload), default=str) if payload is not None else None,
+            "created_at": self.clock(),
+        }
+        with self._lock:
+            self._pending.append(row)
+            full = len(self._pending) >= self.max_batch
+        self._ensure_thread()
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """Write everything queued so far in a single transaction"""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(self.table.insert(), rows)
+            except Exception as e:
+                # Put the batch back so the next flush retries it
+                with self._lock:
+                    self._pending[:0] = rows
+                print(f"Audit flush warning: {e}")
+                return 0
+            return len(rows)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
@@ -0,0 +1,285 @@
+"""
+Micro-benchmarks for the Excel export and history paths.
+
+Each case drives the real route through the Flask test client against an MDF
+fixture of the given size, so a change to the export engine shows up here as-is:
+
+  submit_final     POST   /api/submit/final     load the warehouse's MDF, append one job, save
+  download         GET    /exports/MDF.xlsx     full regeneration from the database (cache miss)
+  download_cached  GET    /exports/MDF.xlsx     repeat download with no data change (cache hit)
+  export_csv       GET    /api/export           streamed CSV of every submitted scan
+  log              GET    /log                  read_excel + groupby of the whole MDF
+  delete_log       DELETE /api/logs/delete/N    read_excel, drop one historical job, rewrite
+
+Fixtures (SQLite database with N submitted scans + an MDF partition with N rows) are built
+once per size and cached in --fixture-dir. Every measurement runs in a fresh
+subprocess on a fresh copy of the fixture, so peak RSS is not polluted by earlier
+runs:
+
+    python bench/bench_exports.py                         # 10k, 100k, 1m
+    python bench/bench_exports.py --sizes 10k --repeat 5 --cases log,delete_log
+
+Wall time (median and min over --repeat runs) and peak memory (growth of the
+process's max RSS during the call) are printed and written to bench/results/;
+streamed responses also report the time to their first chunk.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+DEFAULT_FIXTURE_DIR = os.path.join(tempfile.gettempdir(), "line_count_bench_fixtures")
+FIXTURE_VERSION = 2
+
+CASES = ("submit_final", "download", "download_cached", "export_csv", "log", "delete_log")
+SCANS_PER_JOB = 500
+HISTORICAL_DAYS = 30
+APPEND_ROWS = 500
+LOCATION, WAREHOUSE = "KIZAD", "KIZAD-W1"
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    for suffix, mult in (("k", 1_000), ("m", 1_000_000)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * mult)
+    return int(text)
+
+
+def _rss_kb():
+    """Current resident set size in KiB (Linux), falling back to the peak"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# ---------------------------------------------------------------- fixtures
+
+def build_fixture(rows, path):
+    """Database with `rows` submitted scans and an MDF partition with `rows` historical rows"""
+    os.makedirs(path, exist_ok=True)
+    os.chdir(path)
+    sys.path.insert(0, ROOT)
+    import app as app_module
+    from openpyxl import Workbook
+
+    app_module.init_db()
+    rng = random.Random(rows)
+    now = app_module.abu_dhabi_now().replace(microsecond=0)
+
+    n_jobs = max(rows // SCANS_PER_JOB, 1)
+    n_lines = max(n_jobs // 4, 1)
+    with app_module.engine.begin() as conn:
+        conn.execute(app_module.Line.__table__.insert(), [
+            {"id": i + 1, "location": LOCATION, "warehouse": WAREHOUSE, "line_code": f"B{i + 1:05d}",
+             "target_qty": SCANS_PER_JOB, "created_at": now, "updated_at": now}
+            for i in range(n_lines)])
+        conn.execute(app_module.ScanJob.__table__.insert(), [
+            {"id": j + 1, "line_id": j % n_lines + 1, "status": "submitted", "opened_by": "bench",
+             "opened_at": now - timedelta(hours=2), "closed_at": now - timedelta(minutes=j)}
+            for j in range(n_jobs)])
+        batch = []
+        for i in range(rows):
+            job_id = i % n_jobs + 1
+            batch.append({
+                "job_id": job_id, "line_id": (job_id - 1) % n_lines + 1,
+                "counter_name": f"counter{job_id % 50:02d}", "sku": f"SKU{rng.randrange(2000):05d}",
+                "serial_code": f"SN{i:09d}", "qty": 1, "source": "scan",
+                "created_at": now - timedelta(seconds=rows - i)})
+            if len(batch) == 20_000:
+                conn.execute(app_module.Scan.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(app_module.Scan.__table__.insert(), batch)
+
+    # Historical MDF: older than every database job, grouped by day and counter
+    os.makedirs(app_module.MDF_DIR, exist_ok=True)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    ws.append(app_module.COLUMNS)
+    start = datetime(2024, 1, 1, 8, 0, 0)
+    for i in range(rows):
+        ts = start + timedelta(days=i * HISTORICAL_DAYS // rows, seconds=i % 36_000)
+        ws.append([ts.strftime("%Y-%m-%d"), ts.strftime("%H:%M:%S"), LOCATION, WAREHOUSE,
+                   f"counter{i % 10}", f"SKU{rng.randrange(2000):05d}", f"H{i:09d}", 1, "scan"])
+    wb.save(app_module.mdf_store.partition_path(LOCATION, WAREHOUSE))
+    app_module.audit_buffer.flush()
+    app_module.engine.dispose()
+
+    with open(os.path.join(path, "fixture.json"), "w") as f:
+        json.dump({"rows": rows, "version": FIXTURE_VERSION, "jobs": n_jobs,
+                   "historical_groups": HISTORICAL_DAYS * 10}, f)
+
+
+def ensure_fixture(rows, fixture_dir):
+    path = os.path.join(fixture_dir, f"mdf-{rows}")
+    meta_path = os.path.join(path, "fixture.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f).get("version") == FIXTURE_VERSION:
+                return path
+    shutil.rmtree(path, ignore_errors=True)
+    print(f"building {rows:,}-row fixture in {path} ...", flush=True)
+    started = time.perf_counter()
+    subprocess.run([sys.executable, __file__, "--build-fixture", str(rows), "--workdir", path], check=True)
+    print(f"  done in {time.perf_counter() - started:.1f}s", flush=True)
+    return path
+
+
+# ---------------------------------------------------------------- one measurement
+
+def run_case(case, workdir):
+    """Runs inside a fresh subprocess with cwd = a private copy of the fixture"""
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import app as app_module
+
+    with open(os.path.join(workdir, "fixture.json")) as f:
+        meta = json.load(f)
+    flask_app = app_module.app
+    flask_app.config["SESSION_COOKIE_SECURE"] = False
+    client = flask_app.test_client()
+    client.get("/health")  # boot outside the measurement
+
+    if case == "submit_final":
+        # A fresh line whose job matches its target, so submit is allowed
+        now = app_module.abu_dhabi_now()
+        with app_module.engine.begin() as conn:
+            line_id = conn.execute(app_module.Line.__table__.insert().values(
+                location=LOCATION, warehouse=WAREHOUSE, line_code="BENCH", target_qty=APPEND_ROWS,
+                created_at=now, updated_at=now)).inserted_primary_key[0]
+            job_id = conn.execute(app_module.ScanJob.__table__.insert().values(
+                line_id=line_id, status="open", opened_by="bench", opened_at=now)).inserted_primary_key[0]
+            conn.execute(app_module.Scan.__table__.insert(), [
+                {"job_id": job_id, "line_id": line_id, "counter_name": "bench", "sku": "SKU",
+                 "serial_code": f"NEW{i:06d}", "qty": 1, "source": "scan", "created_at": now}
+                for i in range(APPEND_ROWS)])
+        call = lambda: client.post("/api/submit/final", json={"job_id": job_id, "counter_name": "bench"})
+    elif case == "download":
+        call = lambda: client.get("/exports/MDF.xlsx")
+    elif case == "download_cached":
+        client.get("/exports/MDF.xlsx").close()  # generates the cached file (its peak RSS shows in +MB)
+        call = lambda: client.get("/exports/MDF.xlsx")
+    elif case == "export_csv":
+        client.post("/api/tl/login", json={"tl_name": "jawad", "tl_pin": "112233"})
+        call = lambda: client.get("/api/export")
+    elif case == "log":
+        call = lambda: client.get("/log")
+    elif case == "delete_log":
+        client.post("/api/tl/login", json={"tl_name": "jawad", "tl_pin": "112233"})
+        # Newest first: database jobs, then historical groups; the last index is the oldest group
+        index = meta["jobs"] + meta["historical_groups"] - 1
+        call = lambda: client.delete(f"/api/logs/delete/{index}", json={"passcode": "240986"})
+    else:
+        raise SystemExit(f"unknown case {case}")
+
+    rss_before = _rss_kb()
+    started = time.perf_counter()
+    resp = call()
+    first_chunk = None
+    if resp.is_streamed:
+        size = 0
+        for chunk in resp.response:
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - started
+            size += len(chunk)
+        resp.close()
+    else:
+        size = len(resp.get_data())
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    app_module.audit_buffer.flush()
+
+    ok = resp.status_code == 200
+    json.dump({"case": case, "seconds": elapsed, "status": resp.status_code, "ok": ok,
+               "peak_rss_mb": peak / 1024, "peak_growth_mb": max(peak - rss_before, 0) / 1024,
+               "response_bytes": size, "first_chunk_s": first_chunk}, sys.stdout)
+
+
+def measure(case, fixture_path, scratch):
+    workdir = os.path.join(scratch, case)
+    shutil.rmtree(workdir, ignore_errors=True)
+    shutil.copytree(fixture_path, workdir)
+    try:
+        out = subprocess.run([sys.executable, __file__, "--worker", case, "--workdir", workdir],
+                             capture_output=True, text=True, check=True).stdout
+        return json.loads(out.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="10k,100k,1m")
+    ap.add_argument("--cases", default=",".join(CASES))
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--fixture-dir", default=DEFAULT_FIXTURE_DIR)
+    ap.add_argument("--label", default="exports")
+    ap.add_argument("--out")
+    ap.add_argument("--worker", help=argparse.SUPPRESS)
+    ap.add_argument("--build-fixture", type=int, help=argparse.SUPPRESS)
+    ap.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.build_fixture:
+        build_fixture(args.build_fixture, args.workdir)
+        return 0
+    if args.worker:
+        run_case(args.worker, args.workdir)
+        return 0
+
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    cases = [c.strip() for c in args.cases.split(",") if c.strip()]
+    results = []
+    scratch = tempfile.mkdtemp(prefix="bench_exports_")
+    try:
+        print(f"{'rows':>9} {'case':16} {'median s':>9} {'min s':>9} {'peak MB':>9} {'+MB':>8}  status")
+        for rows in sizes:
+            fixture = ensure_fixture(rows, args.fixture_dir)
+            for case in cases:
+                runs = [measure(case, fixture, scratch) for _ in range(args.repeat)]
+                seconds = [r["seconds"] for r in runs]
+                row = {
+                    "rows": rows, "case": case, "repeat": args.repeat,
+                    "median_s": round(_median(seconds), 4), "min_s": round(min(seconds), 4),
+                    "peak_rss_mb": round(max(r["peak_rss_mb"] for r in runs), 1),
+                    "peak_growth_mb": round(max(r["peak_growth_mb"] for r in runs), 1),
+                    "status": sorted({r["status"] for r in runs}),
+                }
+                if runs[0]["first_chunk_s"] is not None:
+                    row["first_chunk_s"] = round(_median([r["first_chunk_s"] for r in runs]), 4)
+                results.append(row)
+                print(f"{rows:>9,} {case:16} {row['median_s']:>9} {row['min_s']:>9} "
+                      f"{row['peak_rss_mb']:>9} {row['peak_growth_mb']:>8}  {row['status']}"
+                      + (f"  first chunk {row['first_chunk_s']}s" if "first_chunk_s" in row else ""), flush=True)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out = args.out or os.path.join(RESULTS_DIR, f"{args.label}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(out, "w") as f:
+        json.dump({"label": args.label, "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "results": results}, f, indent=2)
+    print(f"\nresults written to {out}")
+    return 0 if all(r["status"] == [200] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
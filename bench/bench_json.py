@@ -0,0 +1,96 @@
+"""
+JSON serialization benchmark for the API payloads.
+
+Compares the stdlib encoder with Flask's default settings against the app's
+FastJSONProvider (orjson when installed) on the real /api/line-management/all and
+/api/insights/dashboard payloads, a datetime-heavy row list (native datetimes vs
+per-row strftime), and end to end through the test client:
+
+    python bench/bench_json.py [--lines 300]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK = tempfile.mkdtemp(prefix="bench_json_")
+os.chdir(WORK)
+sys.path.insert(0, ROOT)
+
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+import app as app_module  # noqa: E402
+import json_provider  # noqa: E402
+
+PAYLOAD_URLS = ["/api/line-management/all", "/api/insights/dashboard"]
+
+
+def _seed(client, n_lines):
+    client.post("/api/tl/login", json={"tl_name": "jawad", "tl_pin": "112233"})
+    for i in range(n_lines):
+        client.post("/api/line/upsert", json={
+            "location": "KIZAD", "warehouse": "KIZAD-W1", "line_code": f"J{i:04d}", "target_qty": 3,
+            "counter1": f"counter{2 * i:04d}", "counter2": f"counter{2 * i + 1:04d}",
+            "tl_name": "jawad", "pin": "1234"})
+        state = client.get(f"/api/job/state?location=KIZAD&warehouse=KIZAD-W1&line_code=J{i:04d}").get_json()
+        for n in range(3):
+            client.post("/api/scan/add", json={
+                "job_id": state["job_id"], "line_id": state["line_id"], "counter_name": f"counter{2 * i:04d}",
+                "sku": "SKU1", "serial_or_code": f"S{i}-{n}", "qty": 1})
+        if i % 2 == 0:
+            client.post("/api/submit/final", json={"job_id": state["job_id"], "counter_name": f"counter{2 * i:04d}"})
+
+
+def _best_us(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, default=300)
+    ap.add_argument("--number", type=int, default=200)
+    args = ap.parse_args()
+
+    flask_app = app_module.app
+    flask_app.config["SESSION_COOKIE_SECURE"] = False
+    client = flask_app.test_client()
+    client.get("/health")
+    _seed(client, args.lines)
+    app_module.audit_buffer.flush()
+
+    fast = json_provider.FastJSONProvider(flask_app)
+    print(f"provider backend: {json_provider.backend()}; {args.lines} lines\n")
+    print(f"{'payload':40} {'stdlib us':>10} {'provider us':>12} {'speedup':>8}")
+
+    for url in PAYLOAD_URLS:
+        obj = client.get(url).get_json()
+        std = _best_us(lambda: json_provider.stdlib_dumps(obj), args.number)
+        new = _best_us(lambda: fast.dumps(obj), args.number)
+        print(f"{url:40} {std:>10.0f} {new:>12.0f} {std / new:>7.1f}x")
+
+    # Row lists with timestamps: strftime per row (old style) vs native datetimes
+    base = datetime(2026, 1, 1, 8, 0, 0)
+    rows = [{"id": i, "line_code": f"L{i}", "qty": i % 7, "created_at": base + timedelta(seconds=i)}
+            for i in range(1000)]
+    old = _best_us(lambda: json_provider.stdlib_dumps(
+        [{**r, "created_at": r["created_at"].strftime("%Y-%m-%d %H:%M:%S")} for r in rows]), args.number // 4)
+    new = _best_us(lambda: fast.dumps(rows), args.number // 4)
+    print(f"{'1000 rows, strftime vs native datetime':40} {old:>10.0f} {new:>12.0f} {old / new:>7.1f}x")
+
+    print(f"\n{'end to end (test client)':40} {'default us':>10} {'provider us':>12} {'speedup':>8}")
+    for url in PAYLOAD_URLS:
+        timings = {}
+        for name, provider in (("default", DefaultJSONProvider(flask_app)), ("fast", fast)):
+            flask_app.json = provider
+            timings[name] = _best_us(lambda: client.get(url), max(args.number // 20, 5))
+        print(f"{url:40} {timings['default']:>10.0f} {timings['fast']:>12.0f} "
+              f"{timings['default'] / timings['fast']:>7.2f}x")
+    flask_app.json = fast
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
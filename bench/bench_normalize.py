@@ -0,0 +1,89 @@
+"""
+Micro-benchmark and equivalence check for normalize.py.
+
+Run from the repo root:
+    python bench/bench_normalize.py [--n 200000]
+
+Exits non-zero if the fast paths disagree with the original regex rule.
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from normalize import normalize, norm_code, norm_series, regex_normalize, cache_info
+
+EDGE_CASES = [
+    None, "", "   ", "abc-123_x", " (01)0950601234567(21)SN-42 ", "sku/with.dots",
+    "ÄÖÜ-ß-12", "серийный-7", "tab\tand\nnewline", "emoji🙂42", "ǅ-dz", " nbsp ",
+    "x" * 300, "MiXeD-CaSe_09",
+]
+
+
+def _samples(n, seed=7):
+    rnd = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + "-_ ./()" + "éÜ"
+    pool = ["".join(rnd.choice(alphabet) for _ in range(rnd.randint(6, 28))) for _ in range(max(n // 20, 1))]
+    # Scanner traffic repeats: ~20 reads per distinct label
+    return [rnd.choice(pool) for _ in range(n)]
+
+
+def check_equivalence(values):
+    bad = []
+    for v in values:
+        expected = regex_normalize(v)
+        if normalize(v or "") != expected or norm_code(v) != expected:
+            bad.append(v)
+    series = pd.Series(values, dtype=object)
+    vec = norm_series(series).tolist()
+    for v, got in zip(values, vec):
+        if got != regex_normalize(v):
+            bad.append(v)
+    return bad
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=200000)
+    args = ap.parse_args()
+
+    values = _samples(args.n)
+    bad = check_equivalence(EDGE_CASES + values[:5000])
+    if bad:
+        print(f"MISMATCH on {len(bad)} values, e.g. {bad[:5]!r}")
+        return 1
+    print("equivalence: ok")
+
+    def run(fn):
+        return min(timeit.repeat(lambda: [fn(v) for v in values], number=1, repeat=3))
+
+    t_regex = run(regex_normalize)
+    t_translate = run(normalize)
+    t_cached = run(norm_code)
+    series = pd.Series(values, dtype=object)
+    t_regex_vec = min(timeit.repeat(
+        lambda: series.str.strip().str.replace(r"[^A-Za-z0-9\-_]", "", regex=True).str.upper(), number=1, repeat=3))
+    t_vec = min(timeit.repeat(lambda: norm_series(series), number=1, repeat=3))
+
+    n = len(values)
+    print(f"{'variant':<28}{'total s':>10}{'ns/value':>12}")
+    for name, t in [
+        ("regex per call", t_regex),
+        ("str.translate", t_translate),
+        ("str.translate + LRU", t_cached),
+        ("pandas regex (bulk)", t_regex_vec),
+        ("norm_series (bulk)", t_vec),
+    ]:
+        print(f"{name:<28}{t:>10.4f}{t / n * 1e9:>12.1f}")
+    print(f"cache: {cache_info()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
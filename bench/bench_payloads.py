@@ -0,0 +1,100 @@
+"""
+Payload size and client parse time of the largest list endpoints.
+
+Seeds a throwaway database with --lines lines (two counters each, a submitted job
+on every other line) and fetches each endpoint in the default dict format and in
+the compact ?format=columns form, uncompressed and with each supported
+Content-Encoding. Parse time is json.loads (after decompression) as a stand-in
+for the handheld's JSON.parse:
+
+    python bench/bench_payloads.py [--lines 300]
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK = tempfile.mkdtemp(prefix="payloads_")
+os.chdir(WORK)
+sys.path.insert(0, ROOT)
+
+import app as app_module  # noqa: E402
+
+ENDPOINTS = [
+    "/api/line-management/all",
+    "/api/lines/manage",
+    "/api/lines?location=KIZAD&warehouse=KIZAD-W1",
+    "/api/history/jobs",
+]
+
+
+def _seed(client, n_lines):
+    client.post("/api/tl/login", json={"tl_name": "jawad", "tl_pin": "112233"})
+    for i in range(n_lines):
+        client.post("/api/line/upsert", json={
+            "location": "KIZAD", "warehouse": "KIZAD-W1", "line_code": f"P{i:04d}", "target_qty": 1,
+            "counter1": f"counter{2 * i:04d}", "counter2": f"counter{2 * i + 1:04d}",
+            "tl_name": "jawad", "pin": "1234"})
+        if i % 2 == 0:
+            state = client.get(f"/api/job/state?location=KIZAD&warehouse=KIZAD-W1&line_code=P{i:04d}").get_json()
+            client.post("/api/scan/add", json={
+                "job_id": state["job_id"], "line_id": state["line_id"], "counter_name": f"counter{2 * i:04d}",
+                "sku": "SKU1", "serial_or_code": f"SER{i}", "qty": 1})
+            client.post("/api/submit/final", json={"job_id": state["job_id"], "counter_name": f"counter{2 * i:04d}"})
+
+
+def _decode(body, encoding):
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "br":
+        return app_module.brotli.decompress(body)
+    return body
+
+
+def _parse_us(body, encoding, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        json.loads(_decode(body, encoding))
+        best = min(best, time.perf_counter() - started)
+    return best * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, default=300)
+    ap.add_argument("--repeat", type=int, default=50)
+    args = ap.parse_args()
+
+    flask_app = app_module.app
+    flask_app.config["SESSION_COOKIE_SECURE"] = False
+    client = flask_app.test_client()
+    client.get("/health")
+    _seed(client, args.lines)
+    app_module.audit_buffer.flush()
+
+    encodings = ["identity", "gzip"] + (["br"] if app_module.brotli is not None else [])
+    print(f"{args.lines} lines; parse = best json.loads incl. decompression over {args.repeat} runs\n")
+    print(f"{'endpoint':46} {'format':8} {'encoding':9} {'bytes':>9} {'vs base':>8} {'parse us':>9}")
+    for url in ENDPOINTS:
+        base_size = None
+        for fmt in ("dicts", "columns"):
+            full = url + (("&" if "?" in url else "?") + "format=columns" if fmt == "columns" else "")
+            for enc in encodings:
+                resp = client.get(full, headers={"Accept-Encoding": enc})
+                body = resp.get_data()
+                got = resp.headers.get("Content-Encoding", "identity")
+                size = len(body)
+                base_size = base_size or size
+                print(f"{url.split('?')[0]:46} {fmt:8} {got:9} {size:>9,} {size / base_size:>7.0%} "
+                      f"{_parse_us(body, got, args.repeat):>9.0f}")
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
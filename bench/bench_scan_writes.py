@@ -0,0 +1,106 @@
+"""
+Scan write throughput and tail latency, with and without group commit.
+
+Starts the app on a local gunicorn once per SCAN_GROUP_COMMIT_MS setting, seeds
+lines, then runs --clients closed-loop clients that post unique scans back to back
+(no think time) for --duration seconds; --dup-rate makes that fraction of posts a
+re-scan of an already accepted serial. Reports accepted scans/sec, posts/sec and
+latency percentiles per setting:
+
+    python bench/bench_scan_writes.py --settings 0,2,5 --clients 32 --duration 20
+    python bench/bench_scan_writes.py --settings 0 --dup-rate 0.2
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from loadtest import Client, Recorder, percentile, start_server, stop_server
+from seed_count_night import seed
+
+
+def _run_setting(ms, args):
+    os.environ["SCAN_GROUP_COMMIT_MS"] = str(ms)
+    workdir = tempfile.mkdtemp(prefix="scan_writes_")
+    proc = None
+    try:
+        proc, base_url = start_server("gunicorn", args.port, workdir, args.gunicorn_args)
+        lines = seed(Client(base_url), counters=args.clients, scans_per_line=10, mismatch_rate=0,
+                     rng=random.Random(1))
+        targets = []
+        for line in lines:
+            state_client = Client(base_url)
+            status, state = state_client.get(
+                f"/api/job/state?location={line['location']}&warehouse={line['warehouse']}"
+                f"&line_code={line['line_code']}")
+            state_client.close()
+            for counter in line["counters"]:
+                targets.append((state["job_id"], state["line_id"], counter))
+
+        recorder = Recorder()
+        stop_at = time.monotonic() + args.duration
+        accepted = [0] * len(targets)
+
+        def client_loop(idx, job_id, line_id, counter):
+            client = Client(base_url, recorder)
+            rng = random.Random(idx)
+            n = 0
+            while time.monotonic() < stop_at:
+                rescan = n and rng.random() < args.dup_rate
+                status, _ = client.post("/api/scan/add", {
+                    "job_id": job_id, "line_id": line_id, "counter_name": counter, "sku": "SKU1",
+                    "serial_or_code": f"W{idx}-{rng.randrange(n) if rescan else n}", "qty": 1})
+                if not rescan:
+                    n += 1
+                if status == 200:
+                    accepted[idx] += 1
+            client.close()
+
+        threads = [threading.Thread(target=client_loop, args=(i, *t)) for i, t in enumerate(targets)]
+        started = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.monotonic() - started
+
+        latencies = sorted(e * 1000 for _, _, e, _, _ in recorder.samples)
+        errors = sum(1 for s in recorder.samples if s[3] not in (200, 409))
+        return {
+            "ms": ms, "scans_per_s": sum(accepted) / wall, "posts_per_s": len(recorder.samples) / wall,
+            "errors": errors,
+            "p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99), "max": latencies[-1] if latencies else None,
+        }
+    finally:
+        stop_server(proc)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--settings", default="0,2,5", help="SCAN_GROUP_COMMIT_MS values to compare")
+    ap.add_argument("--clients", type=int, default=32)
+    ap.add_argument("--duration", type=float, default=20)
+    ap.add_argument("--dup-rate", type=float, default=0.0, help="fraction of posts that re-scan a serial")
+    ap.add_argument("--port", type=int, default=8766)
+    ap.add_argument("--gunicorn-args", nargs=argparse.REMAINDER)
+    args = ap.parse_args()
+
+    print(f"{args.clients} closed-loop clients, {args.duration}s per setting, dup rate {args.dup_rate:g}\n")
+    print(f"{'group commit':>14} {'scans/s':>9} {'posts/s':>9} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'max ms':>8}")
+    for ms in (float(x) for x in args.settings.split(",")):
+        r = _run_setting(ms, args)
+        label = "off" if not ms else f"{ms:g} ms"
+        print(f"{label:>14} {r['scans_per_s']:>9.0f} {r['posts_per_s']:>9.0f} {r['errors']:>7} {r['p50']:>8.1f} {r['p95']:>8.1f} "
+              f"{r['p99']:>8.1f} {r['max']:>8.1f}", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
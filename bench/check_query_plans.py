@@ -0,0 +1,164 @@
+"""
+Query-plan check: runs EXPLAIN QUERY PLAN on every SQL statement the endpoints issue.
+
+Boots the app against a throwaway SQLite database, seeds a small data set,
+drives each endpoint through the Flask test client while recording the SQL
+it sends, then explains every SELECT/UPDATE/DELETE. A full table scan of one
+of the large tables from a hot endpoint is a failure (exit code 1), so this
+can gate CI:
+
+    python bench/check_query_plans.py [-v]
+
+The planner is left without ANALYZE statistics on purpose: SQLite then
+assumes large tables, which is exactly when a missing index matters.
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK = tempfile.mkdtemp(prefix="qplan_")
+os.chdir(WORK)
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import event  # noqa: E402
+
+import app as app_module  # noqa: E402
+
+# Tables that grow with every count night
+LARGE_TABLES = {"scans", "scan_jobs", "reconciliation_requests",
+                "serial_index", "audit_log", "reconciliations"}
+
+# (endpoint label, table) pairs that legitimately read the whole table
+ALLOWED_SCANS = {
+    ("GET /api/insights/dashboard", "scans"),        # grand total of all scanned qty
+    ("GET /api/reports/cross_line_duplicates", "scans"),  # grouping every serial
+    ("GET /exports/MDF.xlsx", "scans"),              # full export
+}
+
+_SCAN_RE = re.compile(r"^SCAN (\S+)(?: AS (\S+))?")
+
+
+def _seed(client):
+    client.post("/api/tl/login", json={"tl_name": "jawad", "tl_pin": "112233"})
+    for i in range(1, 4):
+        client.post("/api/line/upsert", json={
+            "location": "KIZAD", "warehouse": "KIZAD-W1", "line_code": f"L{i}", "target_qty": 5,
+            "counter1": "c1", "counter2": "c2", "tl_name": "jawad", "pin": "1234"})
+    state = client.get("/api/job/state?location=KIZAD&warehouse=KIZAD-W1&line_code=L1&counter=c1").get_json()
+    for n in range(3):
+        client.post("/api/scan/add", json={
+            "job_id": state["job_id"], "line_id": state["line_id"], "counter_name": "c1",
+            "sku": "SKU1", "serial_or_code": f"SER{n}", "qty": 1})
+    return state
+
+
+def _endpoints(state):
+    job_id, line_id = state["job_id"], state["line_id"]
+    q = "location=KIZAD&warehouse=KIZAD-W1&line_code=L1"
+    scan = {"job_id": job_id, "line_id": line_id, "counter_name": "c1", "sku": "SKU1", "serial_or_code": "NEW1", "qty": 1}
+    # (method, url, json, hot)
+    return [
+        ("GET", f"/api/job/state?{q}&counter=c1", None, True),
+        ("POST", "/api/job/start", {"location": "KIZAD", "warehouse": "KIZAD-W1", "line_code": "L1"}, True),
+        ("POST", "/api/scan/add", scan, True),
+        ("GET", f"/api/recent-scans?job_id={job_id}", None, True),
+        ("GET", f"/api/recent-scans?job_id={job_id}&since_id=1", None, True),
+        ("GET", f"/api/reconcile/state?{q}", None, True),
+        ("GET", f"/api/reconcile/check_response?job_id={job_id}", None, True),
+        ("POST", "/api/reconcile/acknowledge", {"job_id": job_id}, True),
+        ("GET", "/api/reconcile/notification_count", None, True),
+        ("GET", "/api/reconcile/pending_count_all", None, True),
+        ("GET", "/api/reconcile/tl_queue", None, True),
+        ("GET", "/api/reconcile/inbox", None, True),
+        ("GET", f"/api/reconcile/line_requests?line_id={line_id}", None, True),
+        ("GET", "/api/counter/jobs?counter=c1", None, True),
+        ("GET", "/api/counter/assignments?counter_name=c1", None, True),
+        ("GET", "/api/lines?location=KIZAD&warehouse=KIZAD-W1", None, True),
+        ("GET", "/api/line-management/all", None, True),
+        ("GET", "/api/lines/manage", None, True),
+        ("GET", "/api/insights/dashboard", None, True),
+        ("POST", "/api/reconcile/request", {"job_id": job_id, "line_id": line_id, "counter_name": "c1"}, True),
+        ("GET", "/log", None, False),
+        ("GET", "/api/audit?entity=LINE&entity_id=1", None, False),
+        ("GET", "/api/reports/cross_line_duplicates", None, False),
+        ("GET", "/api/history/jobs", None, False),
+        ("GET", "/exports/MDF.xlsx", None, False),
+        ("GET", "/api/export?status=open,submitted", None, False),
+        ("GET", "/api/export?format=jsonl&status=open&location=KIZAD&warehouse=KIZAD-W1&line=L1&counter=c1&since=2020-01-01", None, False),
+    ]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-v", "--verbose", action="store_true", help="print every plan")
+    args = ap.parse_args()
+
+    flask_app = app_module.app
+    flask_app.config["SESSION_COOKIE_SECURE"] = False
+    client = flask_app.test_client()
+    client.get("/health")  # boot: create tables + index migrations
+    state = _seed(client)
+    app_module.audit_buffer.flush()
+
+    captured = defaultdict(list)
+    current = {"label": None}
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        if current["label"] and not executemany:
+            captured[current["label"]].append((statement, parameters))
+
+    event.listen(app_module.engine, "before_cursor_execute", _capture)
+
+    hot_labels = set()
+    for method, url, body, hot in _endpoints(state):
+        label = f"{method} {url.split('?')[0]}"
+        if hot:
+            hot_labels.add(label)
+        current["label"] = label
+        client.open(url, method=method, json=body, buffered=True)  # run streamed bodies too
+        current["label"] = None
+    event.remove(app_module.engine, "before_cursor_execute", _capture)
+
+    failures = []
+    raw = app_module.engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        for label, statements in captured.items():
+            seen = set()
+            for statement, params in statements:
+                verb = statement.lstrip().split(None, 1)[0].upper()
+                if verb not in ("SELECT", "UPDATE", "DELETE", "WITH") or statement in seen:
+                    continue
+                seen.add(statement)
+                cur.execute("EXPLAIN QUERY PLAN " + statement, params or ())
+                details = [row[3] for row in cur.fetchall()]
+                bad = []
+                for detail in details:
+                    m = _SCAN_RE.match(detail)
+                    if not m:
+                        continue
+                    table = m.group(1)
+                    if table in LARGE_TABLES and (label, table) not in ALLOWED_SCANS:
+                        bad.append(detail)
+                if bad and label in hot_labels:
+                    failures.append((label, statement, bad))
+                if args.verbose or bad:
+                    status = "FAIL" if bad and label in hot_labels else ("warn" if bad else "ok")
+                    print(f"[{status}] {label}")
+                    print("    " + " ".join(statement.split())[:200])
+                    for detail in details:
+                        print(f"      {detail}")
+    finally:
+        raw.close()
+
+    total = sum(len(v) for v in captured.values())
+    print(f"\n{len(captured)} endpoints, {total} statements checked, {len(failures)} hot full-table scans")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Statement-count check: catches lazy-load N+1 regressions in the list endpoints.
+
+Boots the app against a throwaway SQLite database, seeds a few lines (open jobs
+with scans, submitted jobs, pending reconciliation requests), and counts the
+SQL statements each endpoint issues. It then seeds as many lines again and
+counts a second time. A list endpoint's statement count must not depend on
+how many rows it returns, so any endpoint whose count grew is a failure
+(exit code 1):
+
+    python bench/check_statement_counts.py [--lines 3] [-v]
+"""
+import argparse
+import os
+import sys
+import tempfile
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK = tempfile.mkdtemp(prefix="stmtcount_")
+os.chdir(WORK)
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import event  # noqa: E402
+
+import app as app_module  # noqa: E402
+
+# GET endpoints that return one row (or one group) per line/job/request
+ENDPOINTS = [
+    "/log",
+    "/api/reconcile/tl_queue",
+    "/api/reconcile/inbox",
+    "/api/reconcile/notification_count",
+    "/api/reconcile/pending_count_all",
+    "/api/lines?location=KIZAD&warehouse=KIZAD-W1",
+    "/api/lines/manage",
+    "/api/line-management/all",
+    "/api/counter/jobs?counter=c1",
+    "/api/counter/assignments?counter_name=c1",
+    "/api/history/jobs",
+    "/api/insights/dashboard",
+    "/exports/MDF.xlsx",
+]
+
+
+def _seed(client, start, n):
+    """n more lines: every third submitted, every third waiting on a reconciliation"""
+    for i in range(start, start + n):
+        code = f"L{i}"
+        client.post("/api/line/upsert", json={
+            "location": "KIZAD", "warehouse": "KIZAD-W1", "line_code": code, "target_qty": 5,
+            "counter1": "c1", "counter2": "c2", "tl_name": "jawad", "pin": "1234"})
+        state = client.get(f"/api/job/state?location=KIZAD&warehouse=KIZAD-W1&line_code={code}").get_json()
+        scans = 5 if i % 3 == 0 else 3
+        for n_scan in range(scans):
+            client.post("/api/scan/add", json={
+                "job_id": state["job_id"], "line_id": state["line_id"], "counter_name": "c1",
+                "sku": "SKU1", "serial_or_code": f"{code}-{n_scan}", "qty": 1})
+        if i % 3 == 0:
+            client.post("/api/submit/final", json={"job_id": state["job_id"], "counter_name": "c1"})
+        elif i % 3 == 1:
+            client.post("/api/reconcile/request", json={
+                "job_id": state["job_id"], "line_id": state["line_id"], "counter_name": "c1", "reason": "short"})
+    app_module.audit_buffer.flush()
+
+
+def _count(client):
+    counts = Counter()
+    current = {"url": None}
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        if current["url"]:
+            counts[current["url"]] += 1
+
+    event.listen(app_module.engine, "before_cursor_execute", _capture)
+    try:
+        for url in ENDPOINTS:
+            current["url"] = url
+            status = client.get(url).status_code
+            current["url"] = None
+            if status != 200:
+                print(f"warning: {url} returned {status}")
+    finally:
+        event.remove(app_module.engine, "before_cursor_execute", _capture)
+    return counts
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, default=3, help="lines added per round")
+    ap.add_argument("-v", "--verbose", action="store_true", help="print every endpoint, not just growth")
+    args = ap.parse_args()
+
+    flask_app = app_module.app
+    flask_app.config["SESSION_COOKIE_SECURE"] = False
+    client = flask_app.test_client()
+    client.get("/health")
+    client.post("/api/tl/login", json={"tl_name": "jawad", "tl_pin": "112233"})
+
+    _seed(client, 0, args.lines)
+    small = _count(client)
+    _seed(client, args.lines, args.lines)
+    large = _count(client)
+
+    failures = []
+    print(f"{'endpoint':48} {args.lines:>6} {2 * args.lines:>6}  lines")
+    for url in ENDPOINTS:
+        grew = large[url] > small[url]
+        if grew:
+            failures.append(url)
+        if args.verbose or grew:
+            print(f"{url.split('?')[0]:48} {small[url]:>6} {large[url]:>6}  {'GROWS' if grew else 'ok'}")
+
+    print(f"\n{len(ENDPOINTS)} endpoints, {len(failures)} with per-row statements")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,577 @@
+"""
+Count-night load test: drives the real app over HTTP the way the floor does.
+
+Simulated users (one thread each, one keep-alive connection each, like a browser tab):
+
+  * counters  - open their line, scan with randomised inter-scan gaps and run the
+                polling loops from count.html / scanner.js / home.js (job state 3s,
+                recent scans after every scan, reconcile response 3s, line list 15s,
+                notification counts 5s). The lead counter of a line either submits
+                or, when the line is off target, requests reconciliation and waits.
+  * TL        - polls tl_queue / inbox / notification_count every 5s and resolves
+                whatever is pending.
+  * dashboard - refreshes /api/insights/dashboard and line management every 30s.
+
+By default the app is started on a local gunicorn in a throwaway working directory
+and seeded with bench/seed_count_night.py first:
+
+    python bench/loadtest.py run --counters 40 --duration 120 --label baseline
+    python bench/loadtest.py run --server dev ...           # python app.py instead
+    python bench/loadtest.py run --url http://host:8000 ... # already running server
+    python bench/loadtest.py compare bench/results/a.json bench/results/b.json
+
+Each run prints latency percentiles per endpoint plus a throughput curve and stores
+everything under bench/results/ so two versions can be compared later.
+"""
+import argparse
+import heapq
+import http.client
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+
+_ID_RE = re.compile(r"/\d+(?=/|$)")
+PERCENTILES = (50, 90, 95, 99)
+
+
+class Client:
+    """Minimal keep-alive HTTP client with a cookie jar (stdlib only)"""
+
+    def __init__(self, base_url, recorder=None, timeout=30):
+        parts = urllib.parse.urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.recorder = recorder
+        self.cookies = {}
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self._conn
+
+    def request(self, method, path, body=None, label=None):
+        """Send one request; returns (status, parsed JSON or None)"""
+        headers = {"Accept": "application/json", "Accept-Encoding": "identity"}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+
+        started = time.perf_counter()
+        status, data = 0, b""
+        for attempt in (0, 1):
+            try:
+                conn = self._connection()
+                conn.request(method, path, body=payload, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+                status = resp.status
+                for header in resp.msg.get_all("Set-Cookie") or []:
+                    name, _, rest = header.partition("=")
+                    self.cookies[name.strip()] = rest.split(";", 1)[0]
+                if resp.will_close:
+                    self.close()
+                break
+            except (http.client.HTTPException, OSError):
+                # Server closed an idle keep-alive connection: reconnect once
+                self.close()
+                if attempt:
+                    status = 0
+        elapsed = time.perf_counter() - started
+
+        if self.recorder is not None:
+            self.recorder.record(label or endpoint_label(method, path), started, elapsed, status, len(data))
+        try:
+            return status, json.loads(data) if data else None
+        except ValueError:
+            return status, None
+
+    def get(self, path, label=None):
+        return self.request("GET", path, label=label)
+
+    def post(self, path, body, label=None):
+        return self.request("POST", path, body=body, label=label)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def endpoint_label(method, path):
+    """'GET /api/logs/delete/3?x=1' -> 'GET /api/logs/delete/:id'"""
+    return f"{method} {_ID_RE.sub('/:id', path.split('?', 1)[0])}"
+
+
+class Recorder:
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def record(self, label, started, elapsed, status, size):
+        with self._lock:
+            self.samples.append((label, started - self.t0, elapsed, status, size))
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(samples, duration, bucket):
+    """Per-endpoint latency percentiles (ms) and a per-bucket throughput curve"""
+    by_label = defaultdict(list)
+    errors = defaultdict(int)
+    for label, _, elapsed, status, _ in samples:
+        by_label[label].append(elapsed * 1000.0)
+        if status == 0 or status >= 500:
+            errors[label] += 1
+
+    endpoints = {}
+    all_ms = []
+    for label, values in sorted(by_label.items()):
+        values.sort()
+        all_ms.extend(values)
+        endpoints[label] = {
+            "count": len(values),
+            "errors": errors[label],
+            "rps": round(len(values) / duration, 2) if duration else None,
+            "mean": round(sum(values) / len(values), 2),
+            **{f"p{p}": round(percentile(values, p), 2) for p in PERCENTILES},
+            "max": round(values[-1], 2),
+        }
+    all_ms.sort()
+
+    buckets = defaultdict(list)
+    for _, offset, elapsed, status, _ in samples:
+        buckets[int(offset // bucket)].append((elapsed * 1000.0, status))
+    curve = []
+    for idx in range(max(buckets) + 1 if buckets else 0):
+        rows = buckets.get(idx, [])
+        lat = sorted(ms for ms, _ in rows)
+        curve.append({
+            "t": idx * bucket,
+            "rps": round(len(rows) / bucket, 2),
+            "errors": sum(1 for _, s in rows if s == 0 or s >= 500),
+            "p95": round(percentile(lat, 95), 2) if lat else None,
+        })
+
+    overall = {
+        "count": len(all_ms),
+        "errors": sum(errors.values()),
+        "rps": round(len(all_ms) / duration, 2) if duration else None,
+        **{f"p{p}": round(percentile(all_ms, p), 2) for p in PERCENTILES if all_ms},
+    }
+    return {"overall": overall, "endpoints": endpoints, "throughput": curve}
+
+
+# ---------------------------------------------------------------- simulated users
+
+class User(threading.Thread):
+    """A browser tab: a heap of periodic/one-shot tasks run on one connection"""
+
+    def __init__(self, name, client, stop_at, rng):
+        super().__init__(name=name, daemon=True)
+        self.client = client
+        self.stop_at = stop_at
+        self.rng = rng
+        self._tasks = []
+        self._seq = 0
+
+    def schedule(self, delay, fn, every=None):
+        self._seq += 1
+        heapq.heappush(self._tasks, (time.monotonic() + delay, self._seq, fn, every))
+
+    def run(self):
+        self.start_user()
+        while self._tasks:
+            due, _, fn, every = heapq.heappop(self._tasks)
+            now = time.monotonic()
+            if due >= self.stop_at:
+                break
+            if due > now:
+                time.sleep(due - now)
+            if fn() is False:
+                continue
+            if every:
+                # Browsers drift: jitter the interval by +-10%
+                self.schedule(every * self.rng.uniform(0.9, 1.1), fn, every)
+        self.client.close()
+
+    def start_user(self):
+        raise NotImplementedError
+
+
+class Counter(User):
+    def __init__(self, name, client, stop_at, rng, line, quota, lead, scan_gap):
+        super().__init__(name, client, stop_at, rng)
+        self.counter = name
+        self.line = line
+        self.quota = quota
+        self.lead = lead
+        self.scan_gap = scan_gap
+        self.scanned = 0
+        self.job_id = None
+        self.line_id = None
+        self.status = None
+        self.scanned_total = 0
+        self.recent_last_id = None
+        self.requested = False
+        self.done = False
+
+    def _q(self):
+        return urllib.parse.urlencode({
+            "location": self.line["location"], "warehouse": self.line["warehouse"],
+            "line_code": self.line["line_code"], "counter": self.counter})
+
+    def start_user(self):
+        self.client.get("/count?" + self._q(), label="GET /count")
+        self.job_state()
+        self.recent_scans()
+        self.schedule(3, self.job_state, every=3)                  # count.html startPolling
+        self.schedule(3, self.check_response, every=3)             # count.html / home.js
+        self.schedule(5, self.notification_count, every=5)         # home.js
+        self.schedule(15, self.fetch_lines, every=15)              # home.js
+        self.schedule(self.rng.expovariate(1 / self.scan_gap), self.scan)
+
+    def job_state(self):
+        status, data = self.client.get("/api/job/state?" + self._q())
+        if status == 200 and data and data.get("ok"):
+            if data.get("job_id") != self.job_id:
+                self.recent_last_id = None
+            self.job_id = data.get("job_id")
+            self.line_id = data.get("line_id")
+            self.status = data.get("status")
+            self.scanned_total = data.get("scanned_total") or 0
+            if self.lead and not self.done:
+                self.maybe_finish()
+
+    def recent_scans(self):
+        if not self.job_id:
+            return
+        path = f"/api/recent-scans?job_id={self.job_id}"
+        if self.recent_last_id is not None:
+            path += f"&since_id={self.recent_last_id}"
+        status, data = self.client.get(path)
+        if status == 200 and data is not None:
+            if isinstance(data, list):
+                self.recent_last_id = max([0] + [s.get("id") or 0 for s in data])
+            else:
+                self.recent_last_id = data.get("last_id", self.recent_last_id)
+
+    def check_response(self):
+        if self.job_id:
+            self.client.get(f"/api/reconcile/check_response?job_id={self.job_id}")
+
+    def notification_count(self):
+        self.client.get("/api/reconcile/pending_count_all")
+
+    def fetch_lines(self):
+        q = urllib.parse.urlencode({"location": self.line["location"], "warehouse": self.line["warehouse"]})
+        self.client.get("/api/lines?" + q)
+
+    def scan(self):
+        if self.scanned >= self.quota or not self.job_id or self.status not in ("open", None):
+            return False
+        serial = f"{self.line['line_code']}-{self.counter}-{self.scanned:05d}"
+        status, data = self.client.post("/api/scan/add", {
+            "job_id": self.job_id, "line_id": self.line_id, "counter_name": self.counter,
+            "sku": self.line["sku"], "serial_or_code": serial, "qty": 1})
+        if status == 200 and data and data.get("ok"):
+            self.scanned += 1
+            self.scanned_total = data.get("scanned_total", self.scanned_total)
+        self.recent_scans()
+        if self.scanned < self.quota:
+            self.schedule(self.rng.expovariate(1 / self.scan_gap), self.scan)
+        return False
+
+    def maybe_finish(self):
+        """Lead counter: submit once both counters are done, or ask the TL to reconcile"""
+        if self.scanned_total < self.line["expected_total"]:
+            return
+        if self.status == "open" and self.scanned_total != self.line["target_qty"]:
+            if self.requested:
+                return
+            self.requested = True
+            self.client.post("/api/reconcile/request", {
+                "job_id": self.job_id, "line_id": self.line_id, "counter_name": self.counter,
+                "reason": "load test variance"})
+        elif self.status == "variance_approved" or self.scanned_total == self.line["target_qty"]:
+            status, _ = self.client.post("/api/submit/final", {"job_id": self.job_id, "counter_name": self.counter})
+            if status == 200:
+                self.done = True
+
+
+class TeamLeader(User):
+    def __init__(self, name, client, stop_at, rng, tl_name, tl_pin):
+        super().__init__(name, client, stop_at, rng)
+        self.tl_name = tl_name
+        self.tl_pin = tl_pin
+
+    def start_user(self):
+        self.client.post("/api/tl/login", {"tl_name": self.tl_name, "tl_pin": self.tl_pin})
+        self.schedule(self.rng.uniform(0, 5), self.poll, every=5)                  # reconcile.js
+        self.schedule(self.rng.uniform(0, 5), self.notifications, every=5)         # home.js
+
+    def notifications(self):
+        self.client.get("/api/reconcile/notification_count")
+
+    def poll(self):
+        status, data = self.client.get("/api/reconcile/tl_queue")
+        for item in (data or {}).get("requests", []) if status == 200 else []:
+            self.client.post("/api/reconcile/tl_respond", {
+                "queue_id": item["id"], "action": "approve_variance", "note": "load test"})
+        status, data = self.client.get("/api/reconcile/inbox")
+        for item in (data or {}).get("requests", []) if status == 200 else []:
+            self.client.post("/api/reconcile/resolve", {"request_id": item["request_id"], "action": "approve_variance"})
+
+
+class Dashboard(User):
+    def start_user(self):
+        self.schedule(self.rng.uniform(0, 2), self.refresh, every=30)   # insights.html
+        self.schedule(self.rng.uniform(0, 2), self.lines, every=30)     # line_management.html
+
+    def refresh(self):
+        self.client.get("/api/insights/dashboard")
+
+    def lines(self):
+        self.client.get("/api/line-management/all")
+
+
+# ---------------------------------------------------------------- server management
+
+def _wait_healthy(base_url, proc, timeout=60):
+    deadline = time.monotonic() + timeout
+    probe = Client(base_url, timeout=2)
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        status, _ = probe.get("/health")
+        if status == 200:
+            probe.close()
+            return
+        time.sleep(0.25)
+    raise RuntimeError("server did not become healthy")
+
+
+def start_server(mode, port, workdir, gunicorn_args):
+    """Start the app in workdir; returns (process, base_url)"""
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    if mode == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "--chdir", workdir, "-b", f"127.0.0.1:{port}"]
+        cmd += gunicorn_args or ["-c", os.path.join(ROOT, "gunicorn.conf.py")]
+        cmd.append("app:app")
+    else:
+        # Exactly what the Procfile runs (Flask dev server, fixed port 5000)
+        port = 5000
+        cmd = [sys.executable, os.path.join(ROOT, "app.py")]
+    with open(os.path.join(workdir, "server.log"), "wb") as log:
+        proc = subprocess.Popen(cmd, cwd=workdir, env=env, start_new_session=True,
+                                stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    _wait_healthy(base_url, proc)
+    return proc, base_url
+
+
+def stop_server(proc):
+    if proc is None or proc.poll() is not None:
+        return
+    os.killpg(proc.pid, signal.SIGTERM)
+    try:
+        proc.wait(timeout=20)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# ---------------------------------------------------------------- commands
+
+def cmd_run(args):
+    from seed_count_night import seed
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    proc = None
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+            server = "external"
+        else:
+            proc, base_url = start_server(args.server, args.port, workdir, args.gunicorn_args)
+            server = args.server
+        print(f"server: {server} at {base_url}")
+
+        lines = seed(Client(base_url), counters=args.counters, scans_per_line=args.scans_per_line,
+                     mismatch_rate=args.mismatch_rate, rng=rng, tl_name=args.tl_name, tl_pin=args.tl_pin)
+        print(f"seeded {len(lines)} lines for {args.counters} counters")
+
+        recorder = Recorder()
+        t_start = time.monotonic()
+        stop_at = t_start + args.ramp + args.duration
+        users = []
+        for line in lines:
+            for idx, counter in enumerate(line["counters"]):
+                quota = line["quotas"][idx]
+                users.append(Counter(counter, Client(base_url, recorder), stop_at, random.Random(rng.random()),
+                                     line, quota, lead=(idx == 0), scan_gap=args.scan_gap))
+        for n in range(args.tls):
+            users.append(TeamLeader(f"tl{n}", Client(base_url, recorder), stop_at, random.Random(rng.random()),
+                                    args.tl_name, args.tl_pin))
+        for n in range(args.dashboards):
+            users.append(Dashboard(f"dash{n}", Client(base_url, recorder), stop_at, random.Random(rng.random())))
+
+        rng.shuffle(users)
+        for i, user in enumerate(users):
+            # Linear ramp-up: users join evenly over the ramp window
+            delay = t_start + args.ramp * i / max(len(users), 1) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            user.start()
+        for user in users:
+            user.join(timeout=max(stop_at - time.monotonic(), 0) + 30)
+        wall = time.monotonic() - t_start
+
+        summary = summarize(recorder.samples, wall, args.bucket)
+        submitted = sum(1 for u in users if isinstance(u, Counter) and u.done)
+        result = {
+            "label": args.label,
+            "git_rev": _git_rev(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "server": server,
+            "gunicorn_args": args.gunicorn_args if server == "gunicorn" else None,
+            "params": {k: getattr(args, k) for k in (
+                "counters", "tls", "dashboards", "duration", "ramp", "scan_gap",
+                "scans_per_line", "mismatch_rate", "seed", "bucket")},
+            "wall_seconds": round(wall, 2),
+            "lines_submitted": submitted,
+            **summary,
+        }
+        print_summary(result)
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = args.out or os.path.join(
+            RESULTS_DIR, f"{args.label}-{server}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        with open(out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nresults written to {out}")
+        return 0
+    finally:
+        stop_server(proc)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_summary(result):
+    o = result["overall"]
+    print(f"\n{result['label']} ({result['server']}, rev {result['git_rev']}): "
+          f"{o['count']} requests in {result['wall_seconds']}s = {o['rps']} req/s, "
+          f"{o['errors']} errors, {result['lines_submitted']} lines submitted")
+    print(f"\n{'endpoint':48} {'count':>7} {'err':>5} {'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for label, e in sorted(result["endpoints"].items(), key=lambda kv: -kv[1]["count"]):
+        print(f"{label[:48]:48} {e['count']:>7} {e['errors']:>5} {e['p50']:>8} {e['p90']:>8} "
+              f"{e['p95']:>8} {e['p99']:>8} {e['max']:>8}")
+    print("\nthroughput (req/s, p95 ms):")
+    for point in result["throughput"]:
+        bar = "#" * int(point["rps"] / 2)
+        print(f"  t={point['t']:>5}s {point['rps']:>8} {point['p95'] or '-':>8}  {bar}")
+
+
+def cmd_compare(args):
+    """Per-endpoint p50/p95/p99 deltas of NEW against BASE; exit 1 on regression"""
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"base: {base['label']} ({base['server']}, rev {base['git_rev']}) {base['overall'].get('rps')} req/s")
+    print(f"new:  {new['label']} ({new['server']}, rev {new['git_rev']}) {new['overall'].get('rps')} req/s\n")
+
+    regressions = []
+    print(f"{'endpoint':48} {'p50':>16} {'p95':>16} {'p99':>16}")
+    for label in sorted(set(base["endpoints"]) | set(new["endpoints"])):
+        b, n = base["endpoints"].get(label), new["endpoints"].get(label)
+        if not b or not n:
+            print(f"{label[:48]:48} {'only in ' + ('new' if n else 'base'):>16}")
+            continue
+        cells = []
+        for key in ("p50", "p95", "p99"):
+            change = (n[key] - b[key]) / b[key] * 100 if b[key] else 0.0
+            cells.append(f"{n[key]:>7} ({change:+.0f}%)")
+            if key == "p95" and change > args.threshold and n[key] - b[key] > args.min_ms:
+                regressions.append((label, b[key], n[key]))
+        print(f"{label[:48]:48} " + " ".join(f"{c:>16}" for c in cells))
+
+    if regressions:
+        print(f"\n{len(regressions)} endpoint(s) regressed more than {args.threshold}% at p95:")
+        for label, b, n in regressions:
+            print(f"  {label}: {b} -> {n} ms")
+        return 1
+    print("\nno p95 regressions")
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="seed and run a simulated count night")
+    run.add_argument("--server", choices=("gunicorn", "dev"), default="gunicorn")
+    run.add_argument("--url", help="target an already running server instead of starting one")
+    run.add_argument("--port", type=int, default=8765)
+    run.add_argument("--gunicorn-args", nargs=argparse.REMAINDER,
+                     help="gunicorn arguments replacing the default -c gunicorn.conf.py (must be last)")
+    run.add_argument("--counters", type=int, default=20)
+    run.add_argument("--tls", type=int, default=1)
+    run.add_argument("--dashboards", type=int, default=1)
+    run.add_argument("--duration", type=float, default=60, help="seconds of steady state after ramp-up")
+    run.add_argument("--ramp", type=float, default=10)
+    run.add_argument("--scan-gap", type=float, default=2.5, help="mean seconds between scans per counter")
+    run.add_argument("--scans-per-line", type=int, default=40)
+    run.add_argument("--mismatch-rate", type=float, default=0.25, help="share of lines that end off target")
+    run.add_argument("--tl-name", default="jawad")
+    run.add_argument("--tl-pin", default="112233")
+    run.add_argument("--bucket", type=float, default=5, help="throughput curve bucket size (s)")
+    run.add_argument("--seed", type=int, default=1)
+    run.add_argument("--label", default="run")
+    run.add_argument("--out")
+    run.set_defaults(func=cmd_run)
+
+    cmp_ = sub.add_parser("compare", help="compare two stored results")
+    cmp_.add_argument("base")
+    cmp_.add_argument("new")
+    cmp_.add_argument("--threshold", type=float, default=20, help="p95 regression threshold in percent")
+    cmp_.add_argument("--min-ms", type=float, default=2, help="ignore absolute p95 changes below this")
+    cmp_.set_defaults(func=cmd_compare)
+
+    args = ap.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
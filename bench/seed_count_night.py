@@ -0,0 +1,89 @@
+"""
+Seed a running server with the lines, counters and TL assignments of a count night.
+
+Lines are created through the public API (TL login + /api/line/upsert) so the seed
+works against any version of the app. Two counters share each line; a share of the
+lines is given quotas that end off target, so those lines go through reconciliation.
+
+    python bench/seed_count_night.py --url http://127.0.0.1:8000 --counters 40 > plan.json
+
+bench/loadtest.py calls seed() directly before every run.
+"""
+import argparse
+import json
+import random
+import sys
+
+from loadtest import Client
+
+
+def seed(client, counters=20, scans_per_line=40, mismatch_rate=0.25, rng=None,
+         tl_name="jawad", tl_pin="112233", location=None, warehouse=None, prefix="LT"):
+    """Create the lines and return the plan the simulated counters follow"""
+    rng = rng or random.Random(1)
+    status, data = client.post("/api/tl/login", {"tl_name": tl_name, "tl_pin": tl_pin})
+    if status != 200:
+        raise RuntimeError(f"TL login failed: {status} {data}")
+
+    if location is None or warehouse is None:
+        status, data = client.get("/api/locations")
+        if status == 200 and data and data.get("locations"):
+            location = location or data["locations"][0]
+            warehouse = warehouse or data["warehouses"][location][0]
+        else:
+            location, warehouse = location or "KIZAD", warehouse or "KIZAD-W1"
+
+    lines = []
+    for n in range((counters + 1) // 2):
+        line_code = f"{prefix}{n + 1:03d}"
+        names = [f"counter{2 * n + 1:03d}", f"counter{2 * n + 2:03d}"]
+        quotas = [scans_per_line // 2, scans_per_line - scans_per_line // 2]
+        if rng.random() < mismatch_rate:
+            # Off-target line: counters stop a few items short
+            quotas[1] = max(quotas[1] - rng.randint(1, 3), 0)
+        if 2 * n + 1 >= counters:
+            # Odd counter count: the last line has a single active counter
+            quotas = [sum(quotas), 0]
+
+        status, data = client.post("/api/line/upsert", {
+            "location": location, "warehouse": warehouse, "line_code": line_code,
+            "target_qty": scans_per_line, "counter1": names[0], "counter2": names[1],
+            "tl_name": tl_name, "pin": "1234"})
+        if status != 200 or not (data or {}).get("ok"):
+            raise RuntimeError(f"line upsert failed for {line_code}: {status} {data}")
+
+        lines.append({
+            "location": location,
+            "warehouse": warehouse,
+            "line_code": line_code,
+            "sku": f"SKU-{line_code}",
+            "target_qty": scans_per_line,
+            "counters": names if quotas[1] else names[:1],
+            "quotas": quotas if quotas[1] else quotas[:1],
+            "expected_total": sum(quotas),
+        })
+    client.close()
+    return lines
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--counters", type=int, default=20)
+    ap.add_argument("--scans-per-line", type=int, default=40)
+    ap.add_argument("--mismatch-rate", type=float, default=0.25)
+    ap.add_argument("--tl-name", default="jawad")
+    ap.add_argument("--tl-pin", default="112233")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    lines = seed(Client(args.url), counters=args.counters, scans_per_line=args.scans_per_line,
+                 mismatch_rate=args.mismatch_rate, rng=random.Random(args.seed),
+                 tl_name=args.tl_name, tl_pin=args.tl_pin)
+    json.dump(lines, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Single-flight request coalescing with a small, short-lived LRU.
+
+Identical concurrent reads (same key) share one computation: the first caller
+runs it, later callers block until it finishes and reuse the result. Finished
+results stay in an LRU for `ttl` seconds; a result the `cacheable` predicate
+rejects is neither stored nor shared, so waiting callers compute their own. Callers put a data version in the key,
+so a local write makes every older entry unreachable at once; the TTL bounds
+staleness for writes made by other worker processes.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+CoalesceInfo = namedtuple("CoalesceInfo", "hits coalesced misses size")
+
+
+class _Flight:
+    __slots__ = ("done", "value", "failed")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.failed = False
+
+
+class SingleFlight:
+    def __init__(self, maxsize=256, ttl=1.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._results = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}
+        self.hits = self.coalesced = self.misses = 0
+
+    def do(self, key, fn, cacheable=None):
+        """Return fn()'s value for key, computing it at most once per flight/TTL window"""
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._results.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._results[key]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if not flight.failed:
+                return flight.value
+            # Leader raised or got an uncacheable value: compute independently rather than share it
+            return fn()
+
+        try:
+            value = fn()
+        except BaseException:
+            flight.failed = True
+            raise
+        else:
+            if cacheable is not None and not cacheable(value):
+                flight.failed = True
+                return value
+            flight.value = value
+            if self.ttl > 0:
+                with self._lock:
+                    self._results[key] = (time.monotonic() + self.ttl, value)
+                    self._results.move_to_end(key)
+                    while len(self._results) > self.maxsize:
+                        self._results.popitem(last=False)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def info(self):
+        with self._lock:
+            return CoalesceInfo(self.hits, self.coalesced, self.misses, len(self._results))
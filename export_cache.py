@@ -0,0 +1,99 @@
+"""
+On-disk cache of generated export files, addressed by what they were built from.
+
+An entry's key is (name, params, version): the export kind, its filter
+parameters and the data version it was generated at. The file name carries a
+digest of the key, so a changed version simply addresses a different file and
+nothing is ever invalidated in place. The digest doubles as the ETag.
+
+Misses are built once across processes: the builder holds the export name's
+file lock, writes to a temporary file and renames it into place, so readers only
+ever see complete files. Only the `keep` newest entries of each name are kept;
+pruning runs in other processes too, so a path returned by get() can vanish
+before it is opened, and callers retry get() on FileNotFoundError.
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+from collections import namedtuple
+
+from filelock import FileLock
+
+CachedExport = namedtuple("CachedExport", "path etag mtime hit")
+ExportCacheInfo = namedtuple("ExportCacheInfo", "hits misses entries")
+
+
+class ExportCache:
+    def __init__(self, root, keep=4, timeout=120):
+        self.root = root
+        self.keep = keep
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def digest(name, params, version):
+        key = json.dumps([name, params, version], sort_keys=True, default=str)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+    def _entries(self, name):
+        return glob.glob(os.path.join(self.root, f"{name}-*.cache"))
+
+    def get(self, name, params, version, build):
+        """The cached file for this key, calling build(path) to generate it on a miss"""
+        etag = self.digest(name, params, version)
+        path = os.path.join(self.root, f"{name}-{etag}.cache")
+        try:
+            cached = CachedExport(path, etag, os.stat(path).st_mtime, True)
+        except FileNotFoundError:
+            os.makedirs(self.root, exist_ok=True)
+            with FileLock(os.path.join(self.root, f"{name}.lock"), timeout=self.timeout):
+                try:
+                    # Another process built it while we waited
+                    cached = CachedExport(path, etag, os.stat(path).st_mtime, True)
+                except FileNotFoundError:
+                    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    try:
+                        build(tmp)
+                        os.replace(tmp, path)
+                    finally:
+                        if os.path.exists(tmp):
+                            os.remove(tmp)
+                    cached = CachedExport(path, etag, os.stat(path).st_mtime, False)
+                    self._prune(name, path)
+        with self._lock:
+            if cached.hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return cached
+
+    def _prune(self, name, current):
+        """Drop all but the `keep` newest entries of name (open readers keep their file handle)"""
+        entries = []
+        for path in self._entries(name):
+            try:
+                entries.append((os.stat(path).st_mtime, path))
+            except FileNotFoundError:
+                pass  # pruned by another process meanwhile
+        entries.sort(reverse=True)
+        for _, path in [e for e in entries if e[1] != current][max(self.keep - 1, 0):]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        """Remove every cached file"""
+        for path in glob.glob(os.path.join(self.root, "*.cache")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def info(self):
+        with self._lock:
+            entries = len(glob.glob(os.path.join(self.root, "*.cache")))
+            return ExportCacheInfo(self.hits, self.misses, entries)
@@ -0,0 +1,88 @@
+"""
+Group commit: one writer thread per process turns many small write requests into
+one transaction.
+
+Request threads call submit(item) and block on the returned Future. The writer
+collects items for up to `max_wait` seconds (or `max_batch` items), runs
+apply_batch(db, items) in a single session, commits once and resolves every
+caller's future with its own result. If the batch fails, each item is retried in
+its own transaction so one bad item cannot fail its neighbours.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from worker_thread import WorkerThreadMixin
+
+
+class GroupCommitWriter(WorkerThreadMixin):
+    def __init__(self, session_factory, apply_batch, max_wait=0.005, max_batch=100, name="group-commit"):
+        self.session_factory = session_factory
+        self.apply_batch = apply_batch
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self.thread_name = name
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, item):
+        """Queue one item; the Future resolves to apply_batch's result for it"""
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((item, future))
+        return future
+
+    def _after_fork(self):
+        # Items queued in the parent belong to the parent
+        self._queue = queue.SimpleQueue()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit(self, batch):
+        db = self.session_factory()
+        try:
+            results = self.apply_batch(db, [item for item, _ in batch])
+            db.commit()
+            return results
+        except BaseException:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = self._commit(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+                for entry in batch:
+                    try:
+                        entry[1].set_result(self._commit([entry])[0])
+                    except Exception as item_error:
+                        entry[1].set_exception(item_error)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,162 @@
+"""
+GS1-128 / GS1 DataMatrix payload parsing for the scan endpoints.
+
+Accepts the raw scanner output (optionally prefixed with a symbology identifier
+such as ]C1 / ]d2 / ]Q3, fields separated by the FNC1 group separator \\x1d) and
+the human-readable bracketed form "(01)09506000134352(21)SN42(30)12".
+
+Returns None for anything that is not a GS1 element string, so plain serials
+keep the existing behaviour.
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+GS = "\x1d"
+SYMBOLOGY_PREFIXES = ("]C1", "]d2", "]Q3", "]e0", "]J1")
+
+# AI -> (fixed data length, max data length). Fixed-length AIs don't need a separator.
+_AI_TABLE = {
+    "00": (18, 18),   # SSCC
+    "01": (14, 14),   # GTIN
+    "02": (14, 14),   # GTIN of contained items
+    "10": (None, 20), # Batch / lot
+    "11": (6, 6),     # Production date
+    "12": (6, 6),     # Due date
+    "13": (6, 6),     # Packaging date
+    "15": (6, 6),     # Best before
+    "16": (6, 6),     # Sell by
+    "17": (6, 6),     # Expiry
+    "20": (2, 2),     # Variant
+    "21": (None, 20), # Serial
+    "22": (None, 20), # Consumer product variant
+    "30": (None, 8),  # Variable count
+    "37": (None, 8),  # Count of trade items
+    "240": (None, 30),
+    "241": (None, 30),
+    "250": (None, 30),
+    "400": (None, 30),
+    "8004": (None, 30),
+}
+for _ai in ("410", "411", "412", "413", "414", "415"):
+    _AI_TABLE[_ai] = (13, 13)
+
+# 310n..369n measures: 4-digit AI, 6 digits of data
+_MEASURE_RE = re.compile(r"3[1-6]\d\d")
+_BRACKETED_RE = re.compile(r"\((\d{2,4})\)([^()]*)")
+
+ParsedBarcode = namedtuple("ParsedBarcode", "gtin serial lot qty sscc expiry ais")
+
+PARSE_CACHE_SIZE = 4096
+
+
+def _match_ai(s, i):
+    """Return (ai, fixed_len, max_len) for the AI starting at s[i], or None"""
+    for width in (2, 3, 4):
+        ai = s[i:i + width]
+        if ai in _AI_TABLE:
+            fixed, max_len = _AI_TABLE[ai]
+            return ai, fixed, max_len
+    ai = s[i:i + 4]
+    if _MEASURE_RE.fullmatch(ai):
+        return ai, 6, 6
+    return None
+
+
+def _split_raw(s):
+    """Split an FNC1-delimited element string into [(ai, value), ...]"""
+    pairs = []
+    i = 0
+    n = len(s)
+    while i < n:
+        if s[i] == GS:
+            i += 1
+            continue
+        found = _match_ai(s, i)
+        if not found:
+            return None
+        ai, fixed, max_len = found
+        i += len(ai)
+        if fixed:
+            value = s[i:i + fixed]
+            if len(value) != fixed:
+                return None
+            i += fixed
+        else:
+            end = s.find(GS, i)
+            end = n if end == -1 else end
+            value = s[i:end]
+            if not value or len(value) > max_len:
+                return None
+            i = end
+        pairs.append((ai, value))
+    return pairs
+
+
+def _split_bracketed(s):
+    pairs = []
+    pos = 0
+    for m in _BRACKETED_RE.finditer(s):
+        if s[pos:m.start()].strip():
+            return None
+        ai, value = m.group(1), m.group(2).strip()
+        if ai not in _AI_TABLE and not _MEASURE_RE.fullmatch(ai):
+            return None
+        pairs.append((ai, value))
+        pos = m.end()
+    if not pairs or s[pos:].strip():
+        return None
+    return pairs
+
+
+def _gtin_ok(gtin):
+    """Mod-10 check digit for GTIN-14"""
+    if not gtin.isdigit():
+        return False
+    digits = [int(c) for c in gtin]
+    total = sum(d * (3 if idx % 2 == 0 else 1) for idx, d in enumerate(reversed(digits[:-1])))
+    return (10 - total % 10) % 10 == digits[-1]
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_barcode(raw):
+    """Decode a GS1 payload into a ParsedBarcode, or None if raw is not GS1"""
+    if not raw:
+        return None
+    s = raw.strip()
+    prefixed = s.startswith(SYMBOLOGY_PREFIXES)
+    if prefixed:
+        s = s[3:]
+
+    if s.startswith("("):
+        pairs = _split_bracketed(s)
+    elif prefixed or GS in s:
+        pairs = _split_raw(s)
+    else:
+        return None
+    if not pairs:
+        return None
+
+    ais = dict(pairs)
+    gtin = ais.get("01") or ais.get("02")
+    if gtin and not _gtin_ok(gtin):
+        return None
+
+    qty = None
+    count = ais.get("30") or ais.get("37")
+    if count and count.isdigit():
+        qty = int(count)
+
+    return ParsedBarcode(
+        gtin=gtin,
+        serial=ais.get("21"),
+        lot=ais.get("10"),
+        qty=qty,
+        sscc=ais.get("00"),
+        expiry=ais.get("17"),
+        ais=tuple(pairs),
+    )
+
+
+def cache_info():
+    return parse_barcode.cache_info()
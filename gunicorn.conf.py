@@ -0,0 +1,65 @@
+"""
+Production serving profile (gunicorn -c gunicorn.conf.py app:app).
+
+Threaded workers (gthread): every open count page polls several endpoints every
+few seconds, so most connections are idle keep-alives or short reads. Threads
+park those cheaply, while the small number of processes keeps SQLite writer
+contention and memory (pandas/openpyxl per process) in check.
+
+All knobs can be overridden from the environment:
+
+    PORT, WEB_CONCURRENCY (processes), GUNICORN_THREADS, GUNICORN_WORKER_CLASS,
+    GUNICORN_TIMEOUT, GUNICORN_KEEPALIVE, GUNICORN_MAX_REQUESTS
+
+Graceful reloads:
+    kill -HUP <master>   re-reads this file and replaces workers one by one; with
+                         preload_app the application code is NOT re-imported
+    kill -USR2 <master>  starts a new master with fresh code next to the old one,
+                         then kill -WINCH / -QUIT the old master once healthy
+
+Measured with bench/loadtest.py (40 counters, 0.5s mean scan gap, 1 vCPU, 3x8 gthread):
+dev server p50/p95/p99 109/257/435 ms, this profile 23/210/731 ms at the same
+offered load (~84 req/s). Reads got 3-5x faster at p50. POST /api/scan/add tail
+latency grew because writers in different processes now queue on the SQLite lock.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# gevent is also supported (GUNICORN_WORKER_CLASS=gevent) when installed
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.environ.get("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1, 4)))
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+worker_connections = 1000  # gevent only
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))  # MDF exports of large periods take a while
+graceful_timeout = 30
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "15"))  # longer than the 3-5s polling intervals
+
+# Recycle workers now and then so pandas/openpyxl fragmentation cannot grow unbounded
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "5000"))
+max_requests_jitter = max_requests // 10
+
+preload_app = True
+accesslog = "-"
+errorlog = "-"
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
+
+
+def when_ready(server):
+    """Create tables, run migrations and the MDF header once, in the master"""
+    import app as app_module
+
+    with app_module.app.app_context():
+        app_module.init_db()
+        app_module.ensure_mdf()
+    app_module.app._initialized = True
+    # No pooled SQLite connection may be inherited by the forked workers
+    app_module.dispose_engines()
+
+
+def post_fork(server, worker):
+    import app as app_module
+
+    app_module.dispose_engines(close=False)
@@ -0,0 +1,82 @@
+"""
+JSON provider for the Flask app: orjson when installed, the stdlib otherwise.
+
+Both paths produce the same documents (sorted keys, compact separators) and both
+serialize datetime/date/time natively as ISO 8601, so handlers can put model
+timestamps straight into a payload instead of formatting them row by row.
+"""
+import dataclasses
+import decimal
+import json
+import uuid
+from datetime import date, datetime, time
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json fallback
+    orjson = None
+
+
+def _default(o):
+    """Types neither encoder knows natively"""
+    if isinstance(o, (datetime, date, time)):
+        return o.isoformat()
+    if isinstance(o, decimal.Decimal):
+        return str(o)
+    if isinstance(o, uuid.UUID):
+        return str(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    if hasattr(o, "item"):  # numpy / pandas scalars
+        return o.item()
+    if hasattr(o, "tolist"):
+        return o.tolist()
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    default = staticmethod(_default)
+    ensure_ascii = False
+
+    if orjson is not None:
+        _OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+        def dumps(self, obj, **kwargs):
+            if kwargs:
+                # Callers asking for stdlib-only knobs (indent=..., cls=...) get the stdlib
+                return super().dumps(obj, **kwargs)
+            return orjson.dumps(obj, default=_default, option=self._OPTIONS).decode()
+
+        def loads(self, s, **kwargs):
+            if kwargs:
+                return super().loads(s, **kwargs)
+            return orjson.loads(s)
+
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            if (self.compact is None and self._app.debug) or self.compact is False:
+                return self._app.response_class(
+                    orjson.dumps(obj, default=_default, option=self._OPTIONS | orjson.OPT_INDENT_2) + b"\n",
+                    mimetype=self.mimetype)
+            return self._app.response_class(
+                orjson.dumps(obj, default=_default, option=self._OPTIONS) + b"\n", mimetype=self.mimetype)
+
+
+def dumps_ordered(obj):
+    """Compact JSON keeping dict keys in insertion order (export rows follow their column order)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode()
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def backend():
+    return "orjson" if orjson is not None else "json"
+
+
+def stdlib_dumps(obj):
+    """Stdlib encoding with Flask's default settings, as a benchmark baseline"""
+    return json.dumps(obj, default=_default, ensure_ascii=True, sort_keys=True, separators=(",", ":"))
@@ -0,0 +1,199 @@
+"""
+MDF export store partitioned by location/warehouse.
+
+Each location/warehouse pair has its own workbook and its own file lock under
+<exports>/mdf/, so a submit in one warehouse never waits for a submit, delete or
+rewrite in another. Writers replace a partition atomically (temp file +
+os.replace), so lock-free readers always see a complete workbook. The combined
+MDF is never stored: readers get it as a streaming merge of the partitions, and
+drain() materializes it with a write-only workbook when a single file is needed
+(backups, archives).
+
+Every append is named by a key (the submit that produced it), recorded in a hidden
+"Exports" sheet saved together with the rows. An append whose key the partition
+already holds is skipped, so a submit retried after its rows landed doesn't
+duplicate them.
+"""
+import glob
+import heapq
+import os
+import re
+
+from filelock import FileLock
+from openpyxl import Workbook, load_workbook
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]+")
+_KEYS_SHEET = "Exports"
+
+
+def _slug(value):
+    return _UNSAFE.sub("_", str(value or "").strip()) or "_"
+
+
+class MDFStore:
+    def __init__(self, root, columns, global_lock_path, timeout=10):
+        self.root = root
+        self.columns = list(columns)
+        self.global_lock_path = global_lock_path  # store-wide operations (legacy split)
+        self.timeout = timeout
+
+    def partition_path(self, location, warehouse):
+        return os.path.join(self.root, f"{_slug(location)}__{_slug(warehouse)}.xlsx")
+
+    def _lock(self, path):
+        return FileLock(path[:-len(".xlsx")] + ".lock", timeout=self.timeout)
+
+    def lock(self, location, warehouse):
+        """File lock for one partition"""
+        return self._lock(self.partition_path(location, warehouse))
+
+    def partitions(self):
+        return sorted(glob.glob(os.path.join(self.root, "*.xlsx")))
+
+    def _new_workbook(self):
+        wb = Workbook()
+        ws = wb.active
+        ws.title = "Sheet1"
+        ws.append(self.columns)
+        return wb
+
+    def append(self, location, warehouse, key, rows):
+        """Append rows to one partition under its own lock; False if key was appended before"""
+        os.makedirs(self.root, exist_ok=True)
+        path = self.partition_path(location, warehouse)
+        with self.lock(location, warehouse):
+            wb = load_workbook(path) if os.path.exists(path) else self._new_workbook()
+            if _KEYS_SHEET in wb.sheetnames:
+                keys = wb[_KEYS_SHEET]
+                if any(value == key for (value,) in keys.iter_rows(values_only=True, max_col=1)):
+                    wb.close()
+                    return False
+            else:
+                keys = wb.create_sheet(_KEYS_SHEET)
+                keys.sheet_state = "hidden"
+            ws = wb.worksheets[0]
+            for row in rows:
+                ws.append(list(row))
+            keys.append([key])
+            tmp = path + ".tmp"
+            wb.save(tmp)
+            wb.close()
+            os.replace(tmp, path)
+            return True
+
+    def rewrite(self, location, warehouse, keep):
+        """Rewrite one partition keeping only rows for which keep(row) is true; returns rows dropped"""
+        path = self.partition_path(location, warehouse)
+        with self.lock(location, warehouse):
+            if not os.path.exists(path):
+                return 0
+            kept, dropped = [], 0
+            for row in self._read(path):
+                if keep(row):
+                    kept.append(row)
+                else:
+                    dropped += 1
+            if dropped:
+                self._write(path, kept, self._keys(path))
+            return dropped
+
+    def _read(self, path):
+        """Data rows of one partition file, streamed"""
+        wb = load_workbook(path, read_only=True)
+        try:
+            for row in wb.worksheets[0].iter_rows(min_row=2, values_only=True):
+                if any(v is not None for v in row):
+                    yield tuple(row[:len(self.columns)])
+        finally:
+            wb.close()
+
+    def _keys(self, path):
+        """Export keys recorded in one partition file"""
+        wb = load_workbook(path, read_only=True)
+        try:
+            if _KEYS_SHEET not in wb.sheetnames:
+                return []
+            return [value for (value,) in wb[_KEYS_SHEET].iter_rows(values_only=True, max_col=1) if value]
+        finally:
+            wb.close()
+
+    def _write(self, path, rows, keys=()):
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Sheet1")
+        ws.append(self.columns)
+        for row in rows:
+            ws.append(list(row))
+        if keys:
+            ks = wb.create_sheet(_KEYS_SHEET)
+            ks.sheet_state = "hidden"
+            for key in keys:
+                ks.append([key])
+        tmp = path + ".tmp"
+        wb.save(tmp)
+        os.replace(tmp, path)
+
+    def _merge(self, paths):
+        # Each partition keeps its own (submit) order; partitions are interleaved by the
+        # (Date, Time) of their next row. This is not a global sort.
+        return heapq.merge(*(self._read(path) for path in paths),
+                           key=lambda row: (str(row[0] or ""), str(row[1] or "")))
+
+    def iter_rows(self):
+        """Every row of every partition, streamed without loading them all"""
+        return self._merge(self.partitions())
+
+    def rows(self):
+        return list(self.iter_rows())
+
+    def drain(self, path=None):
+        """Empty the store, first writing its rows as one workbook at path if given.
+
+        Each partition is renamed aside under its own lock, so an append that arrives
+        meanwhile starts a new partition: it is neither lost nor included. Returns the
+        number of partitions drained.
+        """
+        drained = []
+        aside_dir = os.path.join(self.root, "drained")  # outside the partition glob
+        os.makedirs(aside_dir, exist_ok=True)
+        for part in self.partitions():
+            with self._lock(part):
+                if os.path.exists(part):
+                    aside = os.path.join(aside_dir, f"{os.getpid()}-{os.path.basename(part)}")
+                    os.replace(part, aside)
+                    drained.append((part, aside))
+        try:
+            if path and drained:
+                wb = Workbook(write_only=True)
+                ws = wb.create_sheet("Sheet1")
+                ws.append(self.columns)
+                for row in self._merge([aside for _, aside in drained]):
+                    ws.append(list(row))
+                wb.save(path)
+        except Exception:
+            # Put the rows back (ahead of anything appended since) rather than lose them
+            for part, aside in drained:
+                with self._lock(part):
+                    rows, keys = list(self._read(aside)), self._keys(aside)
+                    if os.path.exists(part):
+                        rows += list(self._read(part))
+                        keys += self._keys(part)
+                    self._write(part, rows, keys)
+                    os.remove(aside)
+            raise
+        for _, aside in drained:
+            os.remove(aside)
+        return len(drained)
+
+    def split_legacy(self, legacy_path, location_col="Location", warehouse_col="Warehouse"):
+        """Move the rows of a single combined MDF into partitions; returns rows moved"""
+        with FileLock(self.global_lock_path, timeout=self.timeout):
+            if not os.path.exists(legacy_path):
+                return 0
+            li, wi = self.columns.index(location_col), self.columns.index(warehouse_col)
+            groups = {}
+            for row in self._read(legacy_path):
+                groups.setdefault((row[li], row[wi]), []).append(row)
+            for (location, warehouse), rows in groups.items():
+                self.append(location, warehouse, f"legacy:{os.path.basename(legacy_path)}", rows)
+            os.replace(legacy_path, legacy_path[:-len(".xlsx")] + "_presplit.xlsx")
+            return sum(len(rows) for rows in groups.values())
@@ -0,0 +1,68 @@
+"""
+SKU / serial normalization shared by the scan and bulk paths.
+
+Canonical form: keep only A-Z, 0-9, '-' and '_', uppercased. This matches the
+original regex rule re.sub(r"[^A-Za-z0-9\\-_]", "", s.strip()).upper().
+"""
+import re
+import string
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+_ALLOWED = (string.ascii_letters + string.digits + "-_").encode("ascii")
+
+# Byte-level translation: lowercase -> uppercase, every other non-allowed ASCII byte deleted
+_UPPER_TABLE = bytes.maketrans(string.ascii_lowercase.encode("ascii"), string.ascii_uppercase.encode("ascii"))
+_DELETE_BYTES = bytes(b for b in range(128) if b not in _ALLOWED)
+
+_DISALLOWED_RE = re.compile(r"[^A-Za-z0-9\-_]")
+_NON_ASCII_RE = re.compile(r"[^\x00-\x7f]")
+
+NORMALIZE_CACHE_SIZE = 8192
+
+
+def normalize(s):
+    """Normalize a scanned or typed value (uncached)"""
+    if not s:
+        return ""
+    if not s.isascii():
+        # Rare path: drop non-ASCII characters first, the table only covers ASCII
+        s = _NON_ASCII_RE.sub("", s)
+    return s.encode("ascii").translate(_UPPER_TABLE, _DELETE_BYTES).decode("ascii")
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize_cached(s):
+    return normalize(s)
+
+
+def norm_sku(s):
+    """Normalize SKU for consistent storage"""
+    return _normalize_cached(s or "")
+
+
+def norm_code(s):
+    """Normalize serial/code for consistent storage"""
+    return _normalize_cached(s or "")
+
+
+def norm_series(series):
+    """Vectorized normalization of a pandas Series (bulk imports / exports).
+
+    Each distinct value is normalized once; results are scattered back with a NumPy take.
+    """
+    codes, uniques = pd.factorize(series.fillna("").astype(str))
+    normalized = np.array([normalize(u) for u in uniques], dtype=object)
+    return pd.Series(normalized.take(codes), index=series.index, dtype=object)
+
+
+def cache_info():
+    """LRU statistics for the hot-barcode cache"""
+    return _normalize_cached.cache_info()
+
+
+def regex_normalize(s):
+    """Reference implementation (the original per-call regex), kept for equivalence checks"""
+    return _DISALLOWED_RE.sub("", (s or "").strip()).upper()
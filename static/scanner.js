@@ -458,6 +458,16 @@
     const d = await r.json();
     if (!d.ok) { alert("Line not configured."); history.back(); return; }
     if (!d.is_assigned) { alert("You are not assigned to this line."); history.back(); return; }
+    if (!d.job_id) {
+      // Nothing to count into yet: open the line's job explicitly
+      const s = await fetch("/api/job/start", {
+        method: "POST", headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ location:loc, warehouse:wh, line_code:line, counter })
+      });
+      const started = await s.json();
+      if (!s.ok || !started.ok) { alert("Could not start this line."); history.back(); return; }
+      d.job_id = started.job_id; d.status = started.status;
+    }
     jobState = {
       job_id: d.job_id, line_id: d.line_id,
       scanned_total: d.scanned_total||0, target_qty: d.target_qty||0, status: d.status
@@ -0,0 +1,33 @@
+"""
+Lazily started background thread that follows the process across fork().
+
+Threads don't survive fork (gunicorn workers), so the owner's pid is recorded
+with the thread and a forked child starts its own on first use.
+"""
+import os
+import threading
+
+
+class WorkerThreadMixin:
+    """Runs self._run() on a daemon thread named self.thread_name; needs self._lock"""
+    thread_name = "worker"
+    _thread = None
+    _pid = None
+
+    def _thread_alive(self):
+        return self._thread is not None and self._pid == os.getpid() and self._thread.is_alive()
+
+    def _after_fork(self):
+        """Called (under self._lock) before the first thread starts in a new process"""
+
+    def _ensure_thread(self):
+        if self._thread_alive():
+            return
+        with self._lock:
+            if self._thread_alive():
+                return
+            if self._pid != os.getpid():
+                self._after_fork()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()